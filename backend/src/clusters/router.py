@@ -1,13 +1,22 @@
+from typing import Optional
+
 import numpy as np
 import pandas as pd
 from fastapi import APIRouter, Depends
 from sqlalchemy import and_, exists, not_
-from sqlalchemy.orm import Session, aliased
+from sqlalchemy.orm import Session
 
-from db.models import (Cluster, Code, Embedding, Model, Project,
-                       ReducedEmbedding, Segment, Sentence)
+from db.changes import PLOT_CHANGE_RETENTION, record_changes
+from db.counters import add_count, get_count, model_counter_key
+from db.models import Cluster, Embedding, Model, Project, ReducedEmbedding
+from db.pagination import keyset_page
+from db.plot_points import update_plot_clusters
 from db.session import get_db
+from db.single_flight import single_flight
+from db.versions import bump_version
+from plot.service import get_plot_model_ids, plot_rows_query
 from project.service import ProjectService
+from utilities.json_response import FastJSONResponse
 
 router = APIRouter()
 
@@ -21,7 +30,15 @@ def extract_clusters_endpoint(
     return_data: bool = False,
     db: Session = Depends(get_db),
 ):
-    """Extract clusters from reduced embeddings"""
+    """Extract clusters from reduced embeddings, concurrent calls for the same model run one after another"""
+    model_hash = ProjectService(project_id, db).get_model_hash("cluster_config")
+    with single_flight(project_id, "clusters", model_hash):
+        return extract_clusters(project_id, all, page, page_size, return_data, db)
+
+
+def extract_clusters(
+    project_id: int, all: bool, page: int, page_size: int, return_data: bool, db: Session
+):
     clusters = []
     project: ProjectService = ProjectService(project_id, db)
     model_entry, cluster_model = project.get_model("cluster_config")
@@ -74,6 +91,22 @@ def extract_clusters_endpoint(
         ]
 
         db.bulk_insert_mappings(Cluster, cluster_mappings)
+        add_count(db, model_counter_key(model_entry.model_id), len(cluster_mappings))
+        update_plot_clusters(db, reduction_model_entry.model_id, model_entry.model_id)
+        segment_ids = None
+        if len(reduced_embeddings_todo) <= PLOT_CHANGE_RETENTION:
+            embedding_ids = [r.embedding_id for r in reduced_embeddings_todo]
+            segment_ids = [
+                segment_id
+                for segment_id, in db.query(Embedding.segment_id).filter(
+                    Embedding.embedding_id.in_(embedding_ids)
+                )
+            ]
+        record_changes(db, project_id, bump_version(db, project_id), segment_ids)
+        db.commit()
+    elif update_plot_clusters(db, reduction_model_entry.model_id, model_entry.model_id):
+        # clusters extracted before the plot points existed
+        record_changes(db, project_id, bump_version(db, project_id))
         db.commit()
 
     return_dict = {"extracted": len(reduced_embeddings_todo)}
@@ -102,6 +135,7 @@ def get_clusters_endpoint(
     all: bool = False,
     page: int = 0,
     page_size: int = 100,
+    cursor: Optional[int] = None,
     db: Session = Depends(get_db),
 ):
     """Get clusters"""
@@ -109,25 +143,23 @@ def get_clusters_endpoint(
     project = ProjectService(project_id, db)
     model_entry = project.get_model_entry("cluster_config")
     return_dict = {}
-    count = db.query(Cluster).filter(Cluster.model_id == model_entry.model_id).count()
+    query = db.query(
+        Cluster.cluster_id, Cluster.reduced_embedding_id, Cluster.model_id, Cluster.cluster
+    ).filter(Cluster.model_id == model_entry.model_id)
+    count = get_count(db, project_id, model_counter_key(model_entry.model_id), query)
 
     if all:
-        clusters = (
-            db.query(Cluster).filter(Cluster.model_id == model_entry.model_id).all()
-        )
+        clusters = query.all()
     else:
-        clusters = (
-            db.query(Cluster)
-            .filter(Cluster.model_id == model_entry.model_id)
-            .offset(page * page_size)
-            .limit(page_size)
-            .all()
+        clusters, next_cursor = keyset_page(
+            query, Cluster.cluster_id, "cluster_id", page_size, page, cursor
         )
-        return_dict.update({"page": page, "page_size": page_size})
+        return_dict.update({"page": page, "page_size": page_size, "next_cursor": next_cursor})
 
-    return_dict.update({"length": len(clusters), "count": count, "data": clusters})
+    data = [cluster._asdict() for cluster in clusters]
+    return_dict.update({"length": len(data), "count": count, "data": data})
 
-    return return_dict
+    return FastJSONResponse(return_dict)
 
 
 @router.get("/errors")
@@ -138,55 +170,17 @@ def get_error_endpoint(
     db: Session = Depends(get_db),
 ):
     """Get clusters with mismatched primary codes"""
-    plots = []
-
-    ReducedEmbeddingAlias = aliased(ReducedEmbedding)
-    EmbeddingAlias = aliased(Embedding)
-    SegmentAlias = aliased(Segment)
-    SentenceAlias = aliased(Sentence)
-    CodeAlias = aliased(Code)
-    ProjectAlias = aliased(Project)
-
     # get config id from project id
     project: ProjectService = ProjectService(project_id, db)
-    model_entry = project.get_model_entry("cluster_config")
+    reduction_model_id, cluster_model_id = get_plot_model_ids(project)
+    if reduction_model_id is None or cluster_model_id is None:
+        return {"data": []}
 
-    query = (
-        db.query(
-            Cluster,
-            ReducedEmbeddingAlias,
-            EmbeddingAlias,
-            SegmentAlias,
-            SentenceAlias,
-            CodeAlias,
-            ProjectAlias,
-        )
-        .filter(ProjectAlias.project_id == project_id)
-        .filter(Cluster.model_id == model_entry.model_id)
-        .join(
-            ReducedEmbeddingAlias,
-            Cluster.reduced_embedding_id == ReducedEmbeddingAlias.reduced_embedding_id,
-        )
-        .join(
-            EmbeddingAlias,
-            ReducedEmbeddingAlias.embedding_id == EmbeddingAlias.embedding_id,
-        )
-        .join(SegmentAlias, EmbeddingAlias.segment_id == SegmentAlias.segment_id)
-        .join(SentenceAlias, SegmentAlias.sentence_id == SentenceAlias.sentence_id)
-        .join(CodeAlias, SegmentAlias.code_id == CodeAlias.code_id)
-        .join(ProjectAlias, CodeAlias.project_id == ProjectAlias.project_id)
-    )
-    plots = query.all()
+    plots = plot_rows_query(
+        db, reduction_model_id, cluster_model_id, with_text=False, only_clustered=True
+    ).all()
     result_dicts = [
-        {
-            "id": row[3].segment_id,
-            "sentence": row[4].text,
-            "segment": row[3].text,
-            "code": row[5].code_id,
-            "reduced_embedding": {"x": row[1].pos_x, "y": row[1].pos_y},
-            "cluster": row[0].cluster,
-        }
-        for row in plots
+        {"id": row.id, "code": row.code, "cluster": row.cluster} for row in plots
     ]
     pandas_df = pd.DataFrame(result_dicts)
     if len(pandas_df) < 2:
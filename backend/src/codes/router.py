@@ -3,15 +3,22 @@ This module defines a FastAPI APIRouter for managing codes in a project.
 It includes routes for retrieving, creating, updating, merging and deleting codes.
 """
 
+from collections import Counter
 from typing import Optional
 import requests
 import sqlalchemy
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from sqlalchemy.orm import Session
 
 from codes.schemas import MergeOperation
 from codes.service import build_category_tree, has_circular_dependency
 from db import models, session
+from db.changes import record_changes
+from db.counters import add_project_counts, reset_counts
+from db.plot_points import update_plot_codes
+from db.versions import bump_version
+from plot.autocomplete import autocomplete_cache
+from utilities.etag import check_project_etag
 
 import random
 
@@ -31,7 +38,12 @@ router = APIRouter()
 
 # Route to get all codes for a specific project
 @router.get("/")
-def get_codes_route(project_id: int, db: Session = Depends(session.get_db)):
+def get_codes_route(
+    project_id: int, request: Request, response: Response, db: Session = Depends(session.get_db)
+):
+    etag, not_modified = check_project_etag(request, response, db, project_id)
+    if not_modified:
+        return not_modified
     codes = db.query(models.Code).filter(models.Code.project_id == project_id).all()
     if codes is None:
         raise HTTPException(status_code=404, detail="Data not found")
@@ -39,7 +51,12 @@ def get_codes_route(project_id: int, db: Session = Depends(session.get_db)):
 
 # Route to get top-level codes for a specific project
 @router.get("/roots")
-def get_top_level_codes_route(project_id: int, db: Session = Depends(session.get_db)):
+def get_top_level_codes_route(
+    project_id: int, request: Request, response: Response, db: Session = Depends(session.get_db)
+):
+    etag, not_modified = check_project_etag(request, response, db, project_id)
+    if not_modified:
+        return not_modified
     codes = (
         db.query(models.Code)
         .filter(models.Code.project_id == project_id, models.Code.parent_code_id == None)
@@ -51,7 +68,12 @@ def get_top_level_codes_route(project_id: int, db: Session = Depends(session.get
 
 # Route to get leaf codes (codes without children) for a specific project
 @router.get("/leaves")
-def get_leaf_codes_route(project_id: int, db: Session = Depends(session.get_db)):
+def get_leaf_codes_route(
+    project_id: int, request: Request, response: Response, db: Session = Depends(session.get_db)
+):
+    etag, not_modified = check_project_etag(request, response, db, project_id)
+    if not_modified:
+        return not_modified
     subquery = (
         db.query(models.Code.parent_code_id)
         .filter(models.Code.project_id == project_id)
@@ -70,7 +92,12 @@ def get_leaf_codes_route(project_id: int, db: Session = Depends(session.get_db))
 
 # Route to get the hierarchical tree structure of codes for a specific project
 @router.get("/tree")
-def get_code_tree(project_id: int, db: Session = Depends(session.get_db)):
+def get_code_tree(
+    project_id: int, request: Request, response: Response, db: Session = Depends(session.get_db)
+):
+    etag, not_modified = check_project_etag(request, response, db, project_id)
+    if not_modified:
+        return not_modified
     codes = db.query(models.Code).filter(models.Code.project_id == project_id).all()
     codes = build_category_tree(codes)
     if codes is None:
@@ -80,7 +107,12 @@ def get_code_tree(project_id: int, db: Session = Depends(session.get_db)):
 
 # Route to get a specific code by its id
 @router.get("/{id}")
-def get_code_route(project_id: int, id: int, db: Session = Depends(session.get_db)):
+def get_code_route(
+    project_id: int, id: int, request: Request, response: Response, db: Session = Depends(session.get_db)
+):
+    etag, not_modified = check_project_etag(request, response, db, project_id)
+    if not_modified:
+        return not_modified
     data = (
         db.query(models.Code)
         .filter(models.Code.project_id == project_id, models.Code.code_id == id)
@@ -97,8 +129,19 @@ def delete_code_route(project_id: int, id: int, db: Session = Depends(session.ge
     try:
         code = db.query(models.Code).filter(models.Code.code_id == id).first()
         if code:
+            # segments of child codes are deleted as well, those are not listed
+            segment_ids = None
+            if not db.query(models.Code).filter(models.Code.parent_code_id == id).first():
+                segment_ids = [
+                    segment_id
+                    for segment_id, in db.query(models.Segment.segment_id).filter(
+                        models.Segment.code_id == id
+                    )
+                ]
             db.delete(code)
+            record_changes(db, project_id, bump_version(db, project_id), segment_ids)
             db.commit()
+            reset_counts(db, project_id)
             return {"id": id, "deleted": True}
         else:
             return {"id": id, "deleted": False}
@@ -118,8 +161,11 @@ def insert_code_route(
             parent_code_id=parent_id, project_id=project_id, text=code_name, color=generate_light_color()
         )
         db.add(new_code)
+        add_project_counts(db, project_id, code_count=1)
+        version = bump_version(db, project_id)
         db.commit()
         db.refresh(new_code)
+        autocomplete_cache.add(project_id, version, codes=Counter({code_name: 0}))
         return new_code
     except sqlalchemy.exc.IntegrityError as e:
         db.rollback()
@@ -162,6 +208,7 @@ def update_code_route(
             if parent_id == -1:
                 data.parent_code_id = None
         db.add(data)
+        bump_version(db, project_id)
         db.commit()
         db.refresh(data)
         return data
@@ -188,9 +235,18 @@ def merge_codes_route(
         ).update({models.Code.parent_code_id: new_code_id}, synchronize_session=False)
         db.commit()
 
-        db.query(models.Segment).filter(
+        segments = db.query(models.Segment).filter(
             models.Segment.code_id.in_(data.list_of_codes)
-        ).update({models.Segment.code_id: new_code_id}, synchronize_session=False)
+        )
+        segment_ids = [segment.segment_id for segment in segments.with_entities(models.Segment.segment_id)]
+        segments.update({models.Segment.code_id: new_code_id}, synchronize_session=False)
+        update_plot_codes(
+            db,
+            new_code_id,
+            models.PlotPoint.project_id == project_id,
+            models.PlotPoint.code_id.in_(data.list_of_codes),
+        )
+        record_changes(db, project_id, bump_version(db, project_id), segment_ids)
         db.commit()
 
         for code_id in data.list_of_codes:
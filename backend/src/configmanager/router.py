@@ -5,9 +5,12 @@ from sqlalchemy.orm import Session
 
 from configmanager.schemas import ConfigModel
 from configmanager.service import ConfigManager
-from db.models import Config  # Import the Config model
+from db.models import Config, Project  # Import the Config model
 # Create a ConfigManager instance with a database session
+from db.changes import record_changes
 from db.session import get_db
+from db.versions import bump_version
+from pipeline.service import pipeline_runner
 
 router = APIRouter()
 
@@ -67,6 +70,12 @@ def update_config(
         existing_config.default_limit = config.default_limit
 
         config_manager.save_config(existing_config)
+        projects = db.query(Project).filter(Project.config_id == id).all()
+        for project in projects:
+            record_changes(db, project.project_id, bump_version(db, project.project_id))
+        db.commit()
+        for project in projects:
+            pipeline_runner.trigger(project.project_id)
 
         return {"message": f"Config '{id}' updated successfully."}
     else:
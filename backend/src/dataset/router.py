@@ -1,6 +1,7 @@
 import json
 import shutil
 from io import BytesIO
+from typing import Optional
 
 from fastapi import APIRouter, Body, Depends, File, HTTPException, UploadFile
 from pydantic import BaseModel
@@ -10,7 +11,13 @@ from sqlalchemy.orm import Session
 from dataset.schemas import DatasetCreate, DatasetTextOptions
 from dataset.service import add_data_to_db, text_to_json
 from db import models, session
+from db.changes import record_changes
+from db.counters import dataset_counter_key, get_count, reset_counts
+from db.pagination import keyset_page
+from db.plot_points import update_plot_codes
 from db.schema import DeleteResponse
+from db.versions import bump_version
+from pipeline.service import pipeline_runner
 
 router = APIRouter()
 
@@ -66,6 +73,7 @@ async def upload_dataset(
         return {"error": "Unsupported file type"}
 
     add_data_to_db(project_id, dataset_name, temp_dictionary, db)
+    pipeline_runner.trigger(project_id)
 
     return {"filename": file.filename, "content_length": len(file_content)}
 
@@ -158,7 +166,9 @@ def delete_datasets_route(
             detail="Dataset not found or you don't have permission to access it.",
         )
     db.delete(dataset)
+    record_changes(db, project_id, bump_version(db, project_id))
     db.commit()
+    reset_counts(db, project_id)
     return {"id": dataset_id, "deleted": True}
 
 
@@ -168,6 +178,7 @@ def get_sentences_segments_route(
     dataset_id: int,
     page: int = 0,
     page_size: int = 10,
+    cursor: Optional[int] = None,
     db: Session = Depends(session.get_db),
 ):
     # Get sentences with their segments
@@ -186,14 +197,11 @@ def get_sentences_segments_route(
         )
 
     # Query for sentences without text_tsv
-    sentences = (
-        db.query(models.Sentence)
-        .filter(
-            models.Sentence.dataset_id == dataset_id,
-        )
-        .offset(page * page_size)
-        .limit(page_size)
-        .all()
+    query = db.query(models.Sentence).filter(
+        models.Sentence.dataset_id == dataset_id,
+    )
+    sentences, next_cursor = keyset_page(
+        query, models.Sentence.sentence_id, "sentence_id", page_size, page, cursor
     )
 
     # Fetch all segments for the selected sentences
@@ -207,9 +215,7 @@ def get_sentences_segments_route(
         .all()
     )
 
-    count = (
-        db.query(models.Sentence).filter(models.Sentence.dataset_id == dataset_id).count()
-    )
+    count = get_count(db, project_id, dataset_counter_key(dataset_id), query)
 
     # Organize the data into a dictionary with sentences and their associated segments
     sentences_dict = {sentence.sentence_id: sentence for sentence in sentences}
@@ -226,6 +232,7 @@ def get_sentences_segments_route(
     return {
         "length": len(sentences_dict),
         "count": count,
+        "next_cursor": next_cursor,
         "data": list(sentences_dict.values()),
     }
 
@@ -264,8 +271,11 @@ def delete_sentence_route(
             detail="Sentence not found or you don't have permission to access it.",
         )
 
+    segment_ids = [segment.segment_id for segment in sentence.segments]
     db.delete(sentence)
+    record_changes(db, project_id, bump_version(db, project_id), segment_ids)
     db.commit()
+    reset_counts(db, project_id)
 
     return {"id": sentence_id, "deleted": True}
 
@@ -305,6 +315,8 @@ def update_segment_code(
 
     segment.code_id = code_id
     db.add(segment)
+    update_plot_codes(db, code_id, models.PlotPoint.segment_id == segment.segment_id)
+    record_changes(db, project_id, bump_version(db, project_id), [segment.segment_id])
     db.commit()
     db.refresh(segment)
 
@@ -1,10 +1,14 @@
 import logging
 import time
+from collections import Counter
 
 from sqlalchemy import and_
 from sqlalchemy.dialects.postgresql import insert
 import random
 from db.models import Code, Dataset, Project, Segment, Sentence
+from db.counters import add_project_counts
+from db.versions import bump_version
+from plot.autocomplete import autocomplete_cache
 
 logger = logging.getLogger(__name__)
 
@@ -125,7 +129,8 @@ def add_data_to_db(project_id, database_name, json_data, session):
         dataset_name=database_name,
     )
     session.add(dataset)
-    session.commit()
+    # one transaction for the rows and the project counters, flushed for the generated ids
+    session.flush()
 
     sentence_dicts = [
         {"text": item["text"], "dataset_id": dataset.dataset_id, "position_in_dataset": i}
@@ -141,6 +146,7 @@ def add_data_to_db(project_id, database_name, json_data, session):
         for a in session.query(Code).filter_by(project_id=project.project_id).all()
     }
     new_codes = set()
+    code_texts = Counter()
 
     for item, sentence_id in zip(json_data["data"], sentence_ids):
         for entity in item["entities"]:
@@ -161,7 +167,7 @@ def add_data_to_db(project_id, database_name, json_data, session):
                             color=generate_light_color(),
                         )
                         session.add(new_code)
-                        session.commit()
+                        session.flush()
                         code_id = new_code.code_id
                         codes_dict[(label, last_id)] = new_code
                         new_codes.add((label, last_id))
@@ -176,12 +182,30 @@ def add_data_to_db(project_id, database_name, json_data, session):
             }
 
             segment_dicts.append(segment_dict)
+            code_texts[labels[-1]] += 1
 
     if segment_dicts:
         session.bulk_insert_mappings(Segment, segment_dicts)
 
+    add_project_counts(
+        session,
+        project_id,
+        dataset_count=1,
+        code_count=len(new_codes),
+        sentence_count=len(sentence_ids),
+        segment_count=len(segment_dicts),
+    )
+    version = bump_version(session, project_id)
     session.commit()
     session.close()
+    # codes count the segments coded with them, new parent codes have none
+    code_texts.update({label: 0 for label, _ in new_codes})
+    autocomplete_cache.add(
+        project_id,
+        version,
+        segments=Counter(segment["text"] for segment in segment_dicts),
+        codes=code_texts,
+    )
 
     segment_time = time.time()
 
@@ -0,0 +1,78 @@
+"""
+Bounded per-project log of changed plot points, so clients can refresh a plot by version
+delta. Writes that change all (or too many) points move the start of the log instead of
+logging every point, clients behind the start of the log need a full refresh.
+"""
+
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from db.models import PlotChange, ProjectVersion
+
+PLOT_CHANGE_RETENTION = 10000
+
+
+def _truncate_changes(db: Session, project_id: int, version: int):
+    db.query(PlotChange).filter(
+        PlotChange.project_id == project_id, PlotChange.version <= version
+    ).delete(synchronize_session=False)
+    db.query(ProjectVersion).filter(ProjectVersion.project_id == project_id).update(
+        {ProjectVersion.change_log_start: version}, synchronize_session=False
+    )
+
+
+def record_changes(
+    db: Session,
+    project_id: int,
+    version: int,
+    segment_ids: Optional[Iterable[int]] = None,
+):
+    """Log the segments changed with version, None means all segments; does not commit"""
+    if segment_ids is not None:
+        segment_ids = set(segment_ids)
+    if segment_ids is None or len(segment_ids) > PLOT_CHANGE_RETENTION:
+        _truncate_changes(db, project_id, version)
+        return
+    if not segment_ids:
+        return
+    db.execute(
+        insert(PlotChange),
+        [
+            {"project_id": project_id, "version": version, "segment_id": segment_id}
+            for segment_id in segment_ids
+        ],
+    )
+    # drop whole versions from the start until the retention limit is met
+    overflow = (
+        db.query(PlotChange.version)
+        .filter(PlotChange.project_id == project_id)
+        .order_by(PlotChange.version.desc())
+        .offset(PLOT_CHANGE_RETENTION)
+        .limit(1)
+        .scalar()
+    )
+    if overflow is not None:
+        _truncate_changes(db, project_id, overflow)
+
+
+def get_changed_segments(
+    db: Session, project_id: int, since: int
+) -> Tuple[int, Optional[List[int]]]:
+    """The current version and the segments changed after since, None if not logged"""
+    row = (
+        db.query(ProjectVersion.version, ProjectVersion.change_log_start)
+        .filter(ProjectVersion.project_id == project_id)
+        .first()
+    )
+    version, change_log_start = row if row else (0, 0)
+    if since < change_log_start or since > version:
+        return version, None
+    segment_ids = (
+        db.query(PlotChange.segment_id)
+        .filter(PlotChange.project_id == project_id, PlotChange.version > since)
+        .distinct()
+        .all()
+    )
+    return version, [segment_id for segment_id, in segment_ids]
@@ -0,0 +1,168 @@
+"""
+Cached row counts, so paginated listings and project statistics do not have to count their
+full query. Inserts increment a counter in the same transaction, deletes reset the
+counters of a project and the next read recounts. Counting and incrementing a counter hold
+its advisory lock, so an increment is never lost to a counter stored from an older count.
+reconcile_project_counts recounts the project counters to correct drift.
+"""
+
+import logging
+
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from db.models import (
+    Code,
+    Counter,
+    Dataset,
+    Embedding,
+    Model,
+    ProjectCounter,
+    Segment,
+    Sentence,
+)
+from db.single_flight import advisory_lock_key
+
+logger = logging.getLogger(__name__)
+
+PROJECT_COUNTS = (
+    "dataset_count",
+    "code_count",
+    "model_count",
+    "sentence_count",
+    "segment_count",
+    "embedding_count",
+)
+
+
+def model_counter_key(model_id: int) -> str:
+    return f"model:{model_id}"
+
+
+def plot_counter_key(reduction_model_id: int) -> str:
+    """Key of the number of points with a code of a reduction model, the plot rows"""
+    return f"plot:{reduction_model_id}"
+
+
+def dataset_counter_key(dataset_id: int) -> str:
+    return f"dataset:{dataset_id}"
+
+
+def lock_counter(db: Session, key: str):
+    """Hold the advisory lock of a counter until the transaction of db ends"""
+    db.execute(
+        text("SELECT pg_advisory_xact_lock(:key)"),
+        {"key": advisory_lock_key("counter", key)},
+    )
+
+
+def get_count(db: Session, project_id: int, key: str, count_query) -> int:
+    """Get a cached count, count_query is counted and stored if there is no counter"""
+    value = db.query(Counter.value).filter(Counter.counter_key == key).scalar()
+    if value is not None:
+        return value
+    # waits for the open increments of the counter, so the count includes their rows
+    lock_counter(db, key)
+    value = db.query(Counter.value).filter(Counter.counter_key == key).scalar()
+    if value is not None:
+        db.commit()
+        return value
+    value = count_query.order_by(None).with_entities(func.count()).scalar()
+    db.execute(
+        insert(Counter)
+        .values(counter_key=key, project_id=project_id, value=value)
+        .on_conflict_do_nothing(index_elements=[Counter.counter_key])
+    )
+    db.commit()
+    return value
+
+
+def add_count(db: Session, key: str, amount: int):
+    """Increment an existing counter, call before committing the inserted rows
+
+    Holds the lock of the counter until the commit, a counter created meanwhile counts the
+    rows.
+    """
+    lock_counter(db, key)
+    db.query(Counter).filter(Counter.counter_key == key).update(
+        {Counter.value: Counter.value + amount}, synchronize_session=False
+    )
+
+
+def reset_counts(db: Session, project_id: int):
+    """Drop the counters of a project after rows were deleted"""
+    db.query(Counter).filter(Counter.project_id == project_id).delete(
+        synchronize_session=False
+    )
+    db.query(ProjectCounter).filter(ProjectCounter.project_id == project_id).delete(
+        synchronize_session=False
+    )
+    db.commit()
+
+
+def add_project_counts(db: Session, project_id: int, **amounts: int):
+    """Increment project counters, e.g. segment_count=10; call before the commit"""
+    columns = {getattr(ProjectCounter, name): amount for name, amount in amounts.items()}
+    db.query(ProjectCounter).filter(ProjectCounter.project_id == project_id).update(
+        {column: column + amount for column, amount in columns.items()},
+        synchronize_session=False,
+    )
+
+
+def count_project(db: Session, project_id: int) -> dict:
+    """Count the rows of a project in one statement"""
+    datasets = select(Dataset.dataset_id).where(Dataset.project_id == project_id)
+    sentences = select(Sentence.sentence_id).where(Sentence.dataset_id.in_(datasets))
+    counts = {
+        "dataset_count": select(func.count()).where(Dataset.project_id == project_id),
+        "code_count": select(func.count()).where(Code.project_id == project_id),
+        "model_count": select(func.count()).where(Model.project_id == project_id),
+        "sentence_count": select(func.count()).where(Sentence.dataset_id.in_(datasets)),
+        "segment_count": select(func.count()).where(Segment.sentence_id.in_(sentences)),
+        "embedding_count": select(func.count())
+        .select_from(Embedding)
+        .join(Model, Model.model_id == Embedding.model_id)
+        .where(Model.project_id == project_id),
+    }
+    columns = [query.scalar_subquery().label(name) for name, query in counts.items()]
+    return dict(db.execute(select(*columns)).one()._mapping)
+
+
+def get_project_counts(db: Session, project_id: int) -> dict:
+    """Get the project counters by primary key, counted and stored if there are none"""
+    row = db.query(ProjectCounter).filter(ProjectCounter.project_id == project_id).first()
+    if row is not None:
+        return {name: getattr(row, name) for name in PROJECT_COUNTS}
+    counts = count_project(db, project_id)
+    db.execute(
+        insert(ProjectCounter)
+        .values(project_id=project_id, **counts)
+        .on_conflict_do_nothing(index_elements=[ProjectCounter.project_id])
+    )
+    db.commit()
+    return counts
+
+
+def reconcile_project_counts(db: Session, project_id: int) -> dict:
+    """Recount and store the project counters, returns the drift of the counters"""
+    counts = count_project(db, project_id)
+    row = db.query(ProjectCounter).filter(ProjectCounter.project_id == project_id).first()
+    drift = {}
+    if row is not None:
+        drift = {
+            name: counts[name] - getattr(row, name)
+            for name in PROJECT_COUNTS
+            if counts[name] != getattr(row, name)
+        }
+    statement = insert(ProjectCounter).values(project_id=project_id, **counts)
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[ProjectCounter.project_id],
+            set_={name: getattr(statement.excluded, name) for name in PROJECT_COUNTS},
+        )
+    )
+    db.commit()
+    if drift:
+        logger.warning(f"Project counters of project {project_id} drifted: {drift}")
+    return drift
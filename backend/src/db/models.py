@@ -1,5 +1,5 @@
-from sqlalchemy import (JSON, Column, Computed, Float, ForeignKey, Integer,
-                        LargeBinary, String, Text)
+from sqlalchemy import (JSON, BigInteger, Column, Computed, Float, ForeignKey,
+                        Integer, LargeBinary, String, Text)
 from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import relationship
 
@@ -55,6 +55,8 @@ class Sentence(Base):
         "Segment", back_populates="sentence"#, cascade="all, delete, delete-orphan"
     )
 
+    __table_args__ = (Index("ix_Sentence_sentence_tsv", "sentence_tsv", postgresql_using="gin"),)
+
 
 class Segment(Base):
     __tablename__ = "Segment"
@@ -73,6 +75,8 @@ class Segment(Base):
     )
     code = relationship("Code", back_populates="segments")
 
+    __table_args__ = (Index("ix_Segment_sentence_tsv", "sentence_tsv", postgresql_using="gin"),)
+
 
 class Embedding(Base):
     __tablename__ = "Embedding"
@@ -83,6 +87,9 @@ class Embedding(Base):
 
     embedding_value = Column(LargeBinary, nullable=False)
 
+    # lets plot queries map reduced embeddings to segments without touching embedding values
+    __table_args__ = (Index("ix_Embedding_embedding_id_segment_id", "embedding_id", "segment_id"),)
+
     segment = relationship("Segment", back_populates="embedding")
     reduced_embeddings = relationship(
         "ReducedEmbedding",
@@ -151,3 +158,97 @@ class Config(Base):
     name = Column(String(255), nullable=False)
 
     config = Column(JSON, nullable=False)
+
+
+class Counter(Base):
+    """Cached row counts of a project, e.g. rows per model, maintained by the write paths"""
+
+    __tablename__ = "Counter"
+
+    counter_key = Column(String(255), primary_key=True)
+    project_id = Column(Integer, ForeignKey("Project.project_id", ondelete="CASCADE"), index=True)
+    value = Column(Integer, nullable=False)
+
+
+class ProjectCounter(Base):
+    """Row counts of a project for /stats/project/, maintained by the write paths"""
+
+    __tablename__ = "ProjectCounter"
+
+    project_id = Column(
+        Integer, ForeignKey("Project.project_id", ondelete="CASCADE"), primary_key=True
+    )
+    dataset_count = Column(Integer, nullable=False, default=0)
+    code_count = Column(Integer, nullable=False, default=0)
+    model_count = Column(Integer, nullable=False, default=0)
+    sentence_count = Column(Integer, nullable=False, default=0)
+    segment_count = Column(Integer, nullable=False, default=0)
+    embedding_count = Column(Integer, nullable=False, default=0)
+
+
+class ProjectVersion(Base):
+    """Monotonic data version of a project, bumped by every write path"""
+
+    __tablename__ = "ProjectVersion"
+
+    project_id = Column(
+        Integer, ForeignKey("Project.project_id", ondelete="CASCADE"), primary_key=True
+    )
+    version = Column(BigInteger, nullable=False, default=0)
+    # PlotChange covers all changes after this version, older clients need a full refresh
+    change_log_start = Column(BigInteger, nullable=False, default=0)
+
+
+class PlotChange(Base):
+    """Segments whose plot point changed (or was deleted) with a project version"""
+
+    __tablename__ = "PlotChange"
+
+    change_id = Column(BigInteger, primary_key=True)
+    project_id = Column(Integer, ForeignKey("Project.project_id", ondelete="CASCADE"))
+    version = Column(BigInteger, nullable=False)
+    segment_id = Column(Integer, nullable=False)
+
+    __table_args__ = (Index("ix_PlotChange_project_id_version", "project_id", "version"),)
+
+
+class PlotPoint(Base):
+    """Denormalized plot point per reduced embedding, maintained by the pipeline and the recode paths
+
+    Deleting the reduced embedding or the segment deletes the point, deleting the code clears code_id.
+    cluster belongs to cluster_model_id, points clustered by another model count as not clustered.
+    """
+
+    __tablename__ = "PlotPoint"
+
+    reduced_embedding_id = Column(
+        Integer,
+        ForeignKey("ReducedEmbedding.reduced_embedding_id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    project_id = Column(Integer, ForeignKey("Project.project_id", ondelete="CASCADE"), nullable=False)
+    embedding_model_id = Column(Integer, nullable=False)
+    reduction_model_id = Column(Integer, nullable=False)
+    cluster_model_id = Column(Integer)
+    segment_id = Column(
+        Integer, ForeignKey("Segment.segment_id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    sentence_id = Column(Integer, nullable=False)
+    dataset_id = Column(Integer, nullable=False)
+    code_id = Column(Integer, ForeignKey("Code.code_id", ondelete="SET NULL"), index=True)
+    pos_x = Column(Float, nullable=False)
+    pos_y = Column(Float, nullable=False)
+    cluster = Column(Integer)
+
+    __table_args__ = (
+        # covers the plot rows of a reduction model in segment order without touching the heap
+        Index(
+            "ix_PlotPoint_reduction_model_id_segment_id",
+            "reduction_model_id",
+            "segment_id",
+            postgresql_include=[
+                "sentence_id", "dataset_id", "code_id", "pos_x", "pos_y", "cluster_model_id", "cluster"
+            ],
+        ),
+        Index("ix_PlotPoint_project_id_code_id", "project_id", "code_id"),
+    )
@@ -0,0 +1,21 @@
+"""
+Keyset pagination on a stable, indexed key, deep pages cost the same as the first page.
+"""
+
+
+def keyset_page(
+    query, key_column, key_name: str, page_size: int, page: int = 0, cursor=None
+):
+    """Get one page of query ordered by key_column, starting after cursor if given
+
+    Without a cursor the page number is used as offset (for old clients).
+    Returns the rows and the cursor of the next page, None on the last page.
+    """
+    query = query.order_by(key_column)
+    if cursor is not None:
+        query = query.filter(key_column > cursor)
+    else:
+        query = query.offset(page * page_size)
+    rows = query.limit(page_size).all()
+    next_cursor = getattr(rows[-1], key_name) if len(rows) == page_size else None
+    return rows, next_cursor
@@ -0,0 +1,110 @@
+"""
+Maintenance of the denormalized PlotPoint table. The reduction and cluster stages add
+points and clusters incrementally, the recode paths update codes, deletes follow the
+foreign keys.
+"""
+
+from collections import Counter
+
+from sqlalchemy import exists, literal, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from db.counters import add_count, plot_counter_key
+from db.models import Cluster, Embedding, PlotPoint, ReducedEmbedding, Segment, Sentence
+
+
+def add_plot_points(db: Session, project_id: int, reduction_model_id: int):
+    """Insert the points of the reduced embeddings without one yet; does not commit
+
+    The points with a code are added to the plot counter. Returns the number of inserted
+    points.
+    """
+    rows = (
+        select(
+            ReducedEmbedding.reduced_embedding_id,
+            literal(project_id),
+            Embedding.model_id,
+            ReducedEmbedding.model_id,
+            Segment.segment_id,
+            Segment.sentence_id,
+            Sentence.dataset_id,
+            Segment.code_id,
+            ReducedEmbedding.pos_x,
+            ReducedEmbedding.pos_y,
+        )
+        .join(Embedding, ReducedEmbedding.embedding_id == Embedding.embedding_id)
+        .join(Segment, Embedding.segment_id == Segment.segment_id)
+        .join(Sentence, Segment.sentence_id == Sentence.sentence_id)
+        .where(
+            ReducedEmbedding.model_id == reduction_model_id,
+            ~exists().where(
+                PlotPoint.reduced_embedding_id == ReducedEmbedding.reduced_embedding_id
+            ),
+        )
+    )
+    columns = [
+        "reduced_embedding_id",
+        "project_id",
+        "embedding_model_id",
+        "reduction_model_id",
+        "segment_id",
+        "sentence_id",
+        "dataset_id",
+        "code_id",
+        "pos_x",
+        "pos_y",
+    ]
+    statement = (
+        insert(PlotPoint)
+        .from_select(columns, rows)
+        .on_conflict_do_nothing()
+        .returning(PlotPoint.code_id)
+    )
+    code_ids = db.execute(statement).scalars().all()
+    add_count(
+        db,
+        plot_counter_key(reduction_model_id),
+        sum(code_id is not None for code_id in code_ids),
+    )
+    return len(code_ids)
+
+
+def update_plot_clusters(db: Session, reduction_model_id: int, cluster_model_id: int):
+    """Copy the clusters of a cluster model to the points without them; does not commit
+
+    Returns the number of updated points.
+    """
+    return db.execute(
+        update(PlotPoint)
+        .where(
+            PlotPoint.reduced_embedding_id == Cluster.reduced_embedding_id,
+            PlotPoint.reduction_model_id == reduction_model_id,
+            Cluster.model_id == cluster_model_id,
+            PlotPoint.cluster_model_id.is_distinct_from(cluster_model_id)
+            | PlotPoint.cluster.is_distinct_from(Cluster.cluster),
+        )
+        .values(cluster_model_id=cluster_model_id, cluster=Cluster.cluster)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def update_plot_codes(db: Session, code_id: int, *criteria):
+    """Set the code of the points matching criteria; does not commit
+
+    criteria are e.g. PlotPoint.segment_id == segment_id. Points that had no code are
+    added to the plot counters.
+    """
+    uncoded = db.execute(
+        update(PlotPoint)
+        .where(*criteria, PlotPoint.code_id.is_(None))
+        .values(code_id=code_id)
+        .returning(PlotPoint.reduction_model_id)
+        .execution_options(synchronize_session=False)
+    ).scalars()
+    # in key order, add_count locks the counters until the commit
+    for reduction_model_id, amount in sorted(Counter(uncoded).items()):
+        add_count(db, plot_counter_key(reduction_model_id), amount)
+    db.query(PlotPoint).filter(*criteria).update(
+        {PlotPoint.code_id: code_id}, synchronize_session=False
+    )
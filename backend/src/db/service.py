@@ -32,6 +32,10 @@ table_to_model = {
 def init_db():
     logger.info(f"Initializing tables: {Base.metadata.tables.keys()}")
     Base.metadata.create_all(bind=engine)
+    # create_all skips existing tables, add indexes that were introduced later
+    for table in Base.metadata.tables.values():
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
     return Base.metadata.tables.keys()
 
 
@@ -0,0 +1,43 @@
+"""
+Single-flight execution of pipeline stages per (project, stage, model hash), across
+threads and uvicorn workers. Callers of a stage are serialized on a Postgres advisory
+lock: the first one does the work, later ones wait for it and then find nothing left to
+do, since every stage only processes rows that have no result yet.
+"""
+
+import hashlib
+from contextlib import contextmanager
+
+from sqlalchemy import text
+
+from db.session import get_engine
+from utilities.timer import Timer
+
+
+def advisory_lock_key(*parts) -> int:
+    """A signed 64 bit key for pg_advisory_lock from the parts"""
+    digest = hashlib.blake2b(
+        "|".join(str(part) for part in parts).encode(), digest_size=8
+    )
+    return int.from_bytes(digest.digest(), "big", signed=True)
+
+
+@contextmanager
+def single_flight(project_id: int, stage: str, model_hash: str):
+    """Hold the advisory lock of a stage while the block runs, waiting for its holder
+
+    The lock is held on its own connection, so the caller's session can commit inside the
+    block.
+    """
+    key = advisory_lock_key(project_id, stage, model_hash)
+    with get_engine().connect() as connection:
+        locked = connection.execute(
+            text("SELECT pg_try_advisory_lock(:key)"), {"key": key}
+        ).scalar()
+        if not locked:
+            with Timer(f"Waiting for {stage} of project {project_id}"):
+                connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": key})
+        try:
+            yield
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
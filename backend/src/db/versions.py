@@ -0,0 +1,32 @@
+"""
+Per-project data versions. Every write path bumps the version of its project in the same
+transaction, read paths derive ETags and cache keys from it.
+"""
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from db.models import ProjectVersion
+
+
+def get_version(db: Session, project_id: int) -> int:
+    version = (
+        db.query(ProjectVersion.version)
+        .filter(ProjectVersion.project_id == project_id)
+        .scalar()
+    )
+    return version or 0
+
+
+def bump_version(db: Session, project_id: int) -> int:
+    """Increment the version of a project, call before committing the write"""
+    statement = (
+        insert(ProjectVersion)
+        .values(project_id=project_id, version=1)
+        .on_conflict_do_update(
+            index_elements=[ProjectVersion.project_id],
+            set_={"version": ProjectVersion.version + 1},
+        )
+        .returning(ProjectVersion.version)
+    )
+    return db.execute(statement).scalar()
@@ -13,6 +13,7 @@ from dynamic.service import (delete_old_reduced_embeddings,
                              extract_embeddings_reduced, train_clusters,
                              train_points_epochs)
 from embeddings.router import extract_embeddings_endpoint
+from pipeline.service import pipeline_runner
 from project.service import ProjectService
 from utilities.locks import db_lock
 from utilities.timer import Timer
@@ -81,6 +82,8 @@ async def train_for_clusters(
         delete_old_reduced_embeddings(db, dyn_red_entry, cluster_model)
         extract_embeddings_reduced(project, dyn_red_model, db)
         db.commit()
+    # the clusters of the old positions were deleted, the pipeline extracts new ones
+    pipeline_runner.trigger(project_id)
 
     # delete_old_reduced_embeddings(db, dyn_red_entry)
     # extract_embeddings_reduced(project, dyn_red_model, db)
@@ -155,4 +158,6 @@ def train_for_correction(
     )
     delete_old_reduced_embeddings(db, dyn_red_entry, cluster_model)
     extract_embeddings_reduced(project, dyn_red_model, db)
+    # the clusters of the old positions were deleted, the pipeline extracts new ones
+    pipeline_runner.trigger(project_id)
     return True
@@ -8,7 +8,10 @@ from torch.utils.data import DataLoader, Dataset
 from tqdm import tqdm
 from sqlalchemy import text
 
+from db.changes import record_changes
+from db.counters import reset_counts
 from db.models import Cluster, ReducedEmbedding
+from db.versions import bump_version
 from models.model_definitions import DynamicUmap
 from reduced_embeddings.router import extract_embeddings_reduced_endpoint
 from utilities.timer import Timer
@@ -209,7 +212,10 @@ def delete_old_reduced_embeddings(db, dyn_red_entry, cluster_model):
             with Timer("delete reduced embeddings"):
                 db.execute(text("DELETE FROM \"ReducedEmbedding\" WHERE model_id = :model_id"), {"model_id": dyn_red_entry.model_id})
 
+            project_id = dyn_red_entry.project_id
+            record_changes(db, project_id, bump_version(db, project_id))
             db.commit()
+            reset_counts(db, project_id)
         except Exception as e:
             db.rollback()
             raise e
@@ -0,0 +1,241 @@
+"""
+This module finds the segments most similar to a segment by cosine similarity of their
+embeddings. The L2-normalized float32 vectors of an embedding model are kept in
+append-only files next to the model pickle and searched exactly with a matrix product per
+block of rows, so memory stays bounded. New embeddings are appended after extraction,
+deleted ones make the next query rebuild the files. Rows of segments deleted in between
+are marked and left out of the results until then.
+"""
+
+import json
+import os
+import pickle
+import threading
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from db.counters import get_count, model_counter_key
+from db.models import Embedding
+from db.single_flight import single_flight
+from utilities.string_operations import get_project_path
+from utilities.timer import Timer
+
+SIMILARITY_BLOCK_SIZE = 65536
+SYNC_CHUNK_SIZE = 10000
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+class EmbeddingIndex:
+    """The normalized vectors and segment ids of one embedding model, stored as raw files
+
+    meta.json holds the length, so rows written after the last meta update (e.g. by a
+    crash) are ignored. A rebuild starts files of a new generation, so readers of the old
+    files keep valid mappings.
+    """
+
+    def __init__(self, project_id: int, model_hash: str):
+        self.directory = os.path.join(
+            get_project_path(project_id, "models"), f"{model_hash}_index"
+        )
+        os.makedirs(self.directory, exist_ok=True)
+        # segment id -> row of the files of this generation, extended by appends
+        self._positions = {}
+        self._positions_generation = None
+        self._positioned = 0
+        # rows to leave out of the results, reset by a rebuild
+        self.deleted = frozenset()
+        self.reload()
+
+    def _path(self, name: str):
+        return os.path.join(self.directory, name)
+
+    def _data_path(self, name: str, generation: int = None):
+        generation = self.meta["generation"] if generation is None else generation
+        return self._path(f"{name}.{generation}.bin")
+
+    def reload(self):
+        """Read meta.json again, other workers may have appended rows"""
+        self.meta = {"generation": 0, "length": 0, "dim": None, "last_embedding_id": 0}
+        meta_path = self._path("meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as file:
+                self.meta = json.load(file)
+        self._map()
+
+    def _map(self):
+        length, dim = self.meta["length"], self.meta["dim"]
+        if length == 0:
+            self.segment_ids = np.empty(0, dtype=np.int64)
+            self.vectors = np.empty((0, dim or 0), dtype=np.float32)
+        else:
+            self.segment_ids = np.memmap(
+                self._data_path("segment_ids"), np.int64, "r", shape=(length,)
+            )
+            self.vectors = np.memmap(
+                self._data_path("vectors"), np.float32, "r", shape=(length, dim)
+            )
+        self._update_positions()
+
+    def _update_positions(self):
+        """Extend the segment id -> row dict with the rows mapped since the last call"""
+        if self._positions_generation != self.meta["generation"]:
+            self._positions = {}
+            self._positions_generation = self.meta["generation"]
+            self._positioned = 0
+            self.deleted = frozenset()
+        new_ids = self.segment_ids[self._positioned :].tolist()
+        for offset, segment_id in enumerate(new_ids):
+            self._positions.setdefault(segment_id, self._positioned + offset)
+        self._positioned = len(self.segment_ids)
+
+    def __len__(self):
+        return self.meta["length"]
+
+    def _write_meta(self):
+        temporary = self._path("meta.json.tmp")
+        with open(temporary, "w") as file:
+            json.dump(self.meta, file)
+        os.replace(temporary, self._path("meta.json"))
+
+    def clear(self):
+        generation = self.meta["generation"]
+        self.meta = {
+            "generation": generation + 1,
+            "length": 0,
+            "dim": None,
+            "last_embedding_id": 0,
+        }
+        self._write_meta()
+        self._map()
+        for name in ("segment_ids", "vectors"):
+            if os.path.exists(self._data_path(name, generation)):
+                os.remove(self._data_path(name, generation))
+
+    def append(self, segment_ids, vectors, last_embedding_id: int):
+        """Append rows, the vectors are normalized here"""
+        vectors = normalize_rows(vectors)
+        if self.meta["dim"] is None:
+            self.meta["dim"] = vectors.shape[1]
+        length = self.meta["length"]
+        for name, values, row_size in (
+            ("segment_ids", np.asarray(segment_ids, dtype=np.int64), 8),
+            ("vectors", vectors, 4 * self.meta["dim"]),
+        ):
+            with open(self._data_path(name), "ab") as file:
+                # drop rows that were written but never recorded in meta.json
+                file.truncate(length * row_size)
+                file.write(values.tobytes())
+        self.meta.update(
+            {"length": length + len(vectors), "last_embedding_id": last_embedding_id}
+        )
+        self._write_meta()
+        self._map()
+
+    def position(self, segment_id: int):
+        return self._positions.get(segment_id)
+
+    def mark_deleted(self, positions):
+        """Leave rows out of the results until the next rebuild"""
+        self.deleted = self.deleted | {int(position) for position in positions}
+
+    def most_similar(self, vector: np.ndarray, k: int, exclude: int = None):
+        """Positions and cosine similarities of the k rows most similar to vector
+
+        Most similar first. Rows marked deleted and the exclude row are masked before the
+        top k are selected.
+        """
+        query = normalize_rows(vector)
+        masked = np.fromiter(
+            self.deleted | ({exclude} if exclude is not None else set()), dtype=np.int64
+        )
+        best_positions = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, len(self), SIMILARITY_BLOCK_SIZE):
+            scores = self.vectors[start : start + SIMILARITY_BLOCK_SIZE] @ query
+            block_masked = masked[(masked >= start) & (masked < start + len(scores))]
+            scores[block_masked - start] = -np.inf
+            top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+            best_positions = np.concatenate([best_positions, top + start])
+            best_scores = np.concatenate([best_scores, scores[top]])
+            if len(best_scores) > k:
+                keep = np.argpartition(-best_scores, k - 1)[:k]
+                best_positions, best_scores = best_positions[keep], best_scores[keep]
+        order = np.argsort(-best_scores, kind="stable")
+        positions, scores = best_positions[order], best_scores[order]
+        valid = np.isfinite(scores)
+        return positions[valid], scores[valid]
+
+
+class EmbeddingIndexCache:
+    """The opened index per (project, embedding model), synced with the Embedding table"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = {}
+        # one lock per (project, model hash), syncs of different indexes run concurrently
+        self._key_locks = {}
+
+    def _sync(self, db: Session, index: EmbeddingIndex, model_id: int):
+        """Append the embeddings added after the last indexed one"""
+        while True:
+            rows = (
+                db.query(
+                    Embedding.embedding_id,
+                    Embedding.segment_id,
+                    Embedding.embedding_value,
+                )
+                .filter(
+                    Embedding.model_id == model_id,
+                    Embedding.embedding_id > index.meta["last_embedding_id"],
+                )
+                .order_by(Embedding.embedding_id)
+                .limit(SYNC_CHUNK_SIZE)
+                .all()
+            )
+            if not rows:
+                return
+            vectors = np.stack([pickle.loads(value) for _, _, value in rows])
+            index.append([row.segment_id for row in rows], vectors, rows[-1].embedding_id)
+
+    def get(self, db: Session, project_id: int, model_entry):
+        """Get the synced index of a model entry, rebuilt if embeddings were deleted
+
+        Workers sync one after another, on the single-flight lock of the index.
+        """
+        key = (project_id, model_entry.model_hash)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with (
+            key_lock,
+            single_flight(project_id, "embedding_index", model_entry.model_hash),
+        ):
+            with self._lock:
+                index = self._indexes.get(key)
+            if index is None:
+                index = EmbeddingIndex(project_id, model_entry.model_hash)
+                with self._lock:
+                    self._indexes[key] = index
+            else:
+                index.reload()
+            self._sync(db, index, model_entry.model_id)
+            count = get_count(
+                db,
+                project_id,
+                model_counter_key(model_entry.model_id),
+                db.query(Embedding).filter(Embedding.model_id == model_entry.model_id),
+            )
+            if len(index) > count:
+                # deleted embeddings are still indexed
+                with Timer(f"Rebuilding embedding index for project {project_id}"):
+                    index.clear()
+                    self._sync(db, index, model_entry.model_id)
+            return index
+
+
+embedding_index_cache = EmbeddingIndexCache()
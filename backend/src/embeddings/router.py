@@ -1,14 +1,21 @@
 import logging
 import pickle
+from typing import Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy import and_, exists, not_
 from sqlalchemy.orm import Session
 
+from db.counters import add_count, add_project_counts, get_count, model_counter_key
 from db.models import Dataset, Embedding, Project, Segment, Sentence
+from db.pagination import keyset_page
 from db.schema import DeleteResponse
 from db.session import get_db
+from db.single_flight import single_flight
+from embeddings.index import embedding_index_cache
+from embeddings.schemas import SimilarSegments
 from project.service import ProjectService
+from utilities.json_response import FastJSONResponse
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -20,6 +27,7 @@ def get_embeddings_endpoint(
     all: bool = False,
     page: int = 0,
     page_size: int = 100,
+    cursor: Optional[int] = None,
     reduce_length: int = 3,
     db: Session = Depends(get_db),
 ):
@@ -27,35 +35,27 @@ def get_embeddings_endpoint(
     embeddings = []
     project = ProjectService(project_id, db)
     model_entry = project.get_model_entry("embedding_config")
-    count = db.query(Embedding).filter(Embedding.model_id == model_entry.model_id).count()
+    query = db.query(Embedding.embedding_id, Embedding.embedding_value).filter(
+        Embedding.model_id == model_entry.model_id
+    )
+    count = get_count(db, project_id, model_counter_key(model_entry.model_id), query)
 
     if all:
-        embeddings = (
-            db.query(Embedding).filter(Embedding.model_id == model_entry.model_id).all()
-        )
+        embeddings = query.all()
     else:
-        embeddings = (
-            db.query(Embedding)
-            .filter(Embedding.model_id == model_entry.model_id)
-            .offset(page * page_size)
-            .limit(page_size)
-            .all()
+        embeddings, next_cursor = keyset_page(
+            query, Embedding.embedding_id, "embedding_id", page_size, page, cursor
         )
-        return_dict.update({"page": page, "page_size": page_size})
+        return_dict.update({"page": page, "page_size": page_size, "next_cursor": next_cursor})
 
-    result = limit_embeddings_length(
-        [
-            {
-                "id": embedding.embedding_id,
-                "embedding": pickle.loads(embedding.embedding_value).tolist(),
-            }
-            for embedding in embeddings
-        ],
-        reduce_length,
-    )
+    # slice before converting, so only reduce_length values per embedding become python floats
+    result = [
+        {"id": embedding_id, "embedding": pickle.loads(value)[:reduce_length].tolist()}
+        for embedding_id, value in embeddings
+    ]
     return_dict.update({"length": len(result), "count": count, "data": result})
 
-    return return_dict
+    return FastJSONResponse(return_dict)
 
 
 @router.get("/extract")
@@ -65,6 +65,13 @@ def extract_embeddings_endpoint(
     batch_size: int = 124,
     use_disk_storage: bool = False,
 ):
+    """Embed the segments without embedding, concurrent calls for the same model run one after another"""
+    model_hash = ProjectService(project_id, db).get_model_hash("embedding_config")
+    with single_flight(project_id, "embeddings", model_hash):
+        return extract_embeddings(project_id, db, batch_size, use_disk_storage)
+
+
+def extract_embeddings(project_id: int, db: Session, batch_size: int, use_disk_storage: bool):
     logger.info(f"Extracting embeddings: Project {project_id}")
     embeddings = []
     project = ProjectService(project_id, db)
@@ -109,16 +116,58 @@ def extract_embeddings_endpoint(
         # Bulk insert embeddings
 
         db.bulk_insert_mappings(Embedding, embedding_mappings)
+        add_count(db, model_counter_key(model_entry.model_id), len(embedding_mappings))
+        add_project_counts(db, project_id, embedding_count=len(embedding_mappings))
         db.commit()
         project.save_model("embedding_config", embedding_model)
+        # appends the new rows to the similarity index
+        embedding_index_cache.get(db, project_id, model_entry)
 
     return {"data": len(embeddings)}
 
 
-def limit_embeddings_length(embeddings, reduce_length):
-    embeddings = [
-        {"id": embedding["id"], "embedding": embedding["embedding"][:reduce_length]}
-        for embedding in embeddings
+@router.get("/{segment_id}/similar")
+def get_similar_segments_endpoint(
+    project_id: int,
+    segment_id: int,
+    k: int = 10,
+    db: Session = Depends(get_db),
+) -> SimilarSegments:
+    """Get the k segments with the most similar embeddings (by cosine similarity), most similar first"""
+    if k < 1:
+        raise HTTPException(status_code=400, detail="k must be positive")
+    model_entry = ProjectService(project_id, db).get_model_entry("embedding_config")
+    if model_entry is None:
+        raise HTTPException(status_code=404, detail="No embeddings extracted yet")
+    index = embedding_index_cache.get(db, project_id, model_entry)
+    position = index.position(segment_id)
+    if position is None:
+        raise HTTPException(status_code=404, detail="Segment has no embedding")
+    while True:
+        positions, similarities = index.most_similar(index.vectors[position], k, exclude=position)
+        similar_ids = index.segment_ids[positions].tolist()
+        segments = {
+            row.segment_id: row
+            for row in db.query(Segment.segment_id, Segment.text, Segment.code_id).filter(
+                Segment.segment_id.in_(similar_ids)
+            )
+        }
+        deleted = [
+            position
+            for position, similar_id in zip(positions, similar_ids)
+            if similar_id not in segments
+        ]
+        if not deleted:
+            break
+        # segments deleted after the last sync, masked so they do not take the place of others
+        index.mark_deleted(deleted)
+    data = [
+        {
+            "id": similar_id,
+            "segment": segments[similar_id].text,
+            "code": segments[similar_id].code_id,
+            "similarity": similarity,
+        }
+        for similar_id, similarity in zip(similar_ids, similarities.tolist())
     ]
-
-    return embeddings
+    return FastJSONResponse({"id": segment_id, "length": len(data), "data": data})
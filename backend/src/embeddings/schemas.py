@@ -23,3 +23,17 @@ class EmbeddingTable(BaseModel):
 
 class EmbeddingData(BaseModel):
     embedding: List[float]
+
+
+class SimilarSegment(BaseModel):
+    id: int
+    segment: str
+    code: Optional[int]
+    # cosine similarity of the embeddings
+    similarity: float
+
+
+class SimilarSegments(BaseModel):
+    id: int
+    length: int
+    data: List[SimilarSegment]
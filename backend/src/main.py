@@ -12,6 +12,7 @@ from embeddings.router import router as embeddings_router
 from plot.router import router as plot_router
 from project.router import router as project_router
 from reduced_embeddings.router import router as reduced_embeddings_router
+from utilities.compression import CompressionMiddleware
 
 app = FastAPI()
 app.add_middleware(
@@ -20,7 +21,22 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        "X-Plot-Length",
+        "X-Plot-Count",
+        "X-Plot-Page",
+        "X-Plot-Page-Size",
+        "X-Plot-Next-Cursor",
+        "X-Plot-Limit",
+        "X-Plot-Version",
+        "X-Plot-Chunk-Size",
+        "X-Plot-Pipeline-Status",
+        "X-Plot-Pipeline-Stage",
+        "ETag",
+    ],
 )
+# added last, so it compresses the responses of all other middleware
+app.add_middleware(CompressionMiddleware)
 app.include_router(db_router, prefix="/databases", tags=["databases"])
 app.include_router(project_router, prefix="/projects", tags=["projects"])
 app.include_router(
@@ -0,0 +1,9 @@
+from typing import Literal, Optional
+
+from pydantic import BaseModel
+
+
+class PipelineStatus(BaseModel):
+    status: Literal["pending", "running", "done", "failed"]
+    stage: Optional[str]
+    error: Optional[str]
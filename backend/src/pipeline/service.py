@@ -0,0 +1,161 @@
+"""
+This module runs the embedding -> reduction -> clustering pipeline of a project in the
+background. Write paths trigger the runner, read paths only ask for its status.
+"""
+
+import logging
+import os
+import threading
+import traceback
+
+from sqlalchemy.orm import Session
+
+from clusters.router import extract_clusters_endpoint
+from db.changes import record_changes
+from db.counters import reconcile_project_counts, reset_counts
+from db.models import Cluster, Model, ReducedEmbedding
+from db.session import SessionLocal
+from db.single_flight import single_flight
+from db.versions import bump_version
+from embeddings.router import extract_embeddings_endpoint
+from plot.snapshot import PLOT_SNAPSHOT_SERVING, write_plot_snapshot
+from project.service import ProjectService
+from reduced_embeddings.router import extract_embeddings_reduced_endpoint
+from utilities.string_operations import get_file_path
+from utilities.timer import Timer
+
+logger = logging.getLogger(__name__)
+
+# stages in the order they depend on each other
+PIPELINE_STAGES = [
+    ("embeddings", extract_embeddings_endpoint),
+    ("reduced_embeddings", extract_embeddings_reduced_endpoint),
+    ("clusters", extract_clusters_endpoint),
+]
+
+
+def reset_plot_models(db: Session, project_id: int):
+    """Delete the reduced embeddings, clusters and entries of the active models
+
+    Holds the single-flight locks of both stages, so no stage writes rows of the deleted
+    models.
+    """
+    project = ProjectService(project_id, db)
+    reduction_hash = project.get_model_hash("reduction_config")
+    cluster_hash = project.get_model_hash("cluster_config")
+    with (
+        single_flight(project_id, "reduced_embeddings", reduction_hash),
+        single_flight(project_id, "clusters", cluster_hash),
+    ):
+        reduction_model = project.get_model_entry("reduction_config")
+        cluster_model = project.get_model_entry("cluster_config")
+        if cluster_model is not None:
+            db.query(Cluster).filter(Cluster.model_id == cluster_model.model_id).delete()
+        if reduction_model is not None:
+            db.query(ReducedEmbedding).filter(
+                ReducedEmbedding.model_id == reduction_model.model_id
+            ).delete()
+        for model in (cluster_model, reduction_model):
+            if model is not None:
+                db.query(Model).filter(Model.model_id == model.model_id).delete()
+        record_changes(db, project_id, bump_version(db, project_id))
+        db.commit()
+        reset_counts(db, project_id)
+        if reduction_model is not None and os.path.exists(
+            get_file_path(project_id, "models", f"{reduction_hash}.pkl")
+        ):
+            project.delete_model(reduction_hash)
+
+
+class PipelineRunner:
+    """Runs one pipeline thread per project, triggers during a run schedule a rerun"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}
+        self._rerun = set()
+        self._resets = set()
+
+    def get_status(self, project_id: int):
+        with self._lock:
+            state = self._states.get(project_id)
+            return dict(state) if state else None
+
+    def ensure(self, project_id: int):
+        """Start the pipeline of projects this process has not seen, e.g. on restart"""
+        state = self.get_status(project_id)
+        if state is None:
+            return self.trigger(project_id)
+        return state
+
+    def trigger(self, project_id: int, reset: bool = False):
+        """Start the pipeline, or rerun it after the current run
+
+        With reset, the run first deletes the results of the reduction and cluster models
+        (reset_plot_models).
+        """
+        with self._lock:
+            if reset:
+                self._resets.add(project_id)
+            state = self._states.get(project_id)
+            if state and state["status"] in ("pending", "running"):
+                self._rerun.add(project_id)
+                return dict(state)
+            state = {"status": "pending", "stage": None, "error": None}
+            self._states[project_id] = state
+            thread = threading.Thread(
+                target=self._run,
+                args=(project_id,),
+                name=f"pipeline-{project_id}",
+                daemon=True,
+            )
+            thread.start()
+            return dict(state)
+
+    def _set_state(self, project_id: int, **kwargs):
+        with self._lock:
+            self._states[project_id].update(kwargs)
+
+    def _run(self, project_id: int):
+        while True:
+            self._set_state(project_id, status="running", stage=None, error=None)
+            try:
+                self._run_stages(project_id)
+            except Exception as e:
+                logger.error(f"Pipeline failed for project {project_id}: {e}")
+                logger.debug(traceback.format_exc())
+                self._set_state(project_id, status="failed", stage=None, error=str(e))
+            else:
+                self._set_state(project_id, status="done", stage=None)
+            with self._lock:
+                if project_id not in self._rerun:
+                    return
+                self._rerun.discard(project_id)
+                self._states[project_id]["status"] = "pending"
+
+    def _run_stages(self, project_id: int):
+        db = SessionLocal()
+        try:
+            with self._lock:
+                reset = project_id in self._resets
+                self._resets.discard(project_id)
+            if reset:
+                self._set_state(project_id, stage="reset")
+                with Timer(f"Pipeline project {project_id}: reset"):
+                    reset_plot_models(db, project_id)
+            for stage, extract in PIPELINE_STAGES:
+                self._set_state(project_id, stage=stage)
+                with Timer(f"Pipeline project {project_id}: {stage}"):
+                    extract(project_id, db=db)
+                db.commit()
+            # the stages maintain the project counters, this corrects drift from elsewhere
+            reconcile_project_counts(db, project_id)
+            if PLOT_SNAPSHOT_SERVING:
+                with Timer(f"Pipeline project {project_id}: snapshot"):
+                    write_plot_snapshot(db, project_id)
+        finally:
+            db.close()
+            SessionLocal.remove()
+
+
+pipeline_runner = PipelineRunner()
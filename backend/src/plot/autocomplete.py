@@ -0,0 +1,279 @@
+"""
+This module completes partial segment and code texts from an in-memory index per project.
+Prefix matches come from a sorted list of every word suffix of the distinct texts, typos
+are matched by the trigrams the typed text shares with a text (as pg_trgm does). Ingest
+adds its texts to a built index instead of rebuilding it, any other write rebuilds it on
+the next request.
+"""
+
+import re
+import threading
+from bisect import bisect_left
+from collections import Counter, OrderedDict, defaultdict
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from db.models import Code, Dataset, Segment, Sentence
+from db.versions import get_version
+from utilities.timer import Timer
+
+AUTOCOMPLETE_CACHE_SIZE = 8
+AUTOCOMPLETE_MAX_K = 50
+# share of the trigrams of the typed text a text needs to be a typo match
+AUTOCOMPLETE_SIMILARITY = 0.5
+# prefixes up to this length match too many texts to rank per request, so their top
+# texts are precomputed
+PRECOMPUTED_PREFIX_LENGTH = 2
+# texts added since the last build are searched linearly, more trigger a rebuild in memory
+RECENT_TEXTS_LIMIT = 5000
+WORD = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    return " ".join(WORD.findall(text.casefold()))
+
+
+def trigrams(key: str, partial: bool = False):
+    """Trigrams of the words of a normalized text, without the end of a partial word"""
+    words = key.split()
+    grams = set()
+    for i, word in enumerate(words):
+        padded = "  " + word + ("" if partial and i == len(words) - 1 else " ")
+        grams.update(padded[j : j + 3] for j in range(len(padded) - 2))
+    return grams
+
+
+def word_starts(key: str):
+    return [0] + [i + 1 for i, char in enumerate(key) if char == " "]
+
+
+class AutocompleteIndex:
+    """Completions over distinct texts, texts are merged by their normalized form"""
+
+    def __init__(self, terms):
+        # normalized text -> [most frequent original text, count]
+        terms = {key: value for key, value in terms.items() if key}
+        self.keys = list(terms)
+        self.texts = [terms[key][0] for key in self.keys]
+        self.counts = np.array([terms[key][1] for key in self.keys], dtype=np.int64)
+        self.ids = {key: i for i, key in enumerate(self.keys)}
+        self.recent = {}
+
+        suffixes = [
+            (key[start:], i)
+            for i, key in enumerate(self.keys)
+            for start in word_starts(key)
+        ]
+        suffixes.sort()
+        self.suffixes = [suffix for suffix, _ in suffixes]
+        self.suffix_terms = np.array([i for _, i in suffixes], dtype=np.int64)
+
+        postings = defaultdict(list)
+        for i, key in enumerate(self.keys):
+            for gram in trigrams(key):
+                postings[gram].append(i)
+        self.postings = {
+            gram: np.array(ids, dtype=np.int64) for gram, ids in postings.items()
+        }
+
+        self.precomputed = {}
+        for length in range(1, PRECOMPUTED_PREFIX_LENGTH + 1):
+            for prefix in {
+                suffix[:length] for suffix in self.suffixes if len(suffix) >= length
+            }:
+                self.precomputed[prefix] = self._top(
+                    self._prefix_terms(prefix), AUTOCOMPLETE_MAX_K
+                )
+
+    def __len__(self):
+        return len(self.keys) + len(self.recent)
+
+    def _prefix_terms(self, prefix: str):
+        start = bisect_left(self.suffixes, prefix)
+        end = bisect_left(self.suffixes, prefix + "\U0010ffff")
+        return np.unique(self.suffix_terms[start:end])
+
+    def _top(self, ids, k: int):
+        """The k ids with the highest counts, ties by text"""
+        if len(ids) > k:
+            ids = ids[np.argpartition(-self.counts[ids], k - 1)[:k]]
+        return sorted(ids.tolist(), key=lambda i: (-self.counts[i], self.keys[i]))
+
+    def add(self, terms: Counter):
+        """Add texts (text -> number of new occurrences, 0 for texts without occurrences)
+
+        The counts and the recent texts are replaced, not changed, completions running
+        concurrently keep reading the old ones.
+        """
+        counts, recent = self.counts.copy(), dict(self.recent)
+        grown = []
+        for text, count in terms.items():
+            key = normalize(text)
+            if not key:
+                continue
+            i = self.ids.get(key)
+            if i is not None:
+                counts[i] += count
+                grown.append(i)
+            elif key in recent:
+                recent[key] = [recent[key][0], recent[key][1] + count]
+            else:
+                recent[key] = [text, count]
+        self.counts, self.recent = counts, recent
+        for i in grown:
+            self._update_precomputed(i)
+
+    def _update_precomputed(self, i: int):
+        """Rank a text whose count grew in the precomputed prefixes of its words
+
+        Counts only grow, so the text is the only one that can move up.
+        """
+        key = self.keys[i]
+        for start in word_starts(key):
+            for length in range(1, PRECOMPUTED_PREFIX_LENGTH + 1):
+                if start + length > len(key):
+                    break
+                prefix = key[start : start + length]
+                ids = self.precomputed.get(prefix, [])
+                if i not in ids:
+                    ids = ids + [i]
+                # a new list, completions running concurrently keep reading the old one
+                self.precomputed[prefix] = sorted(
+                    ids, key=lambda j: (-self.counts[j], self.keys[j])
+                )[:AUTOCOMPLETE_MAX_K]
+
+    def complete(self, text: str, k: int = 10):
+        """Top k completions as dicts with text, count and score, prefixes before typos"""
+        query = normalize(text)
+        if not query:
+            return []
+        counts, recent = self.counts, self.recent
+        results = {}
+        ids = self.precomputed.get(query)
+        if ids is None:
+            ids = self._top(self._prefix_terms(query), k)
+        for i in ids[:k]:
+            results[self.keys[i]] = (1.0, int(counts[i]), self.texts[i])
+        for key, (original, count) in recent.items():
+            if any(key.startswith(query, start) for start in word_starts(key)):
+                results[key] = (1.0, count, original)
+
+        if len(results) < k:
+            query_grams = trigrams(query, partial=True)
+            lists = [self.postings[gram] for gram in query_grams if gram in self.postings]
+            if lists:
+                candidates, shared = np.unique(np.concatenate(lists), return_counts=True)
+                scores = shared / len(query_grams)
+                matched = scores >= AUTOCOMPLETE_SIMILARITY
+                for i, score in zip(
+                    candidates[matched].tolist(), scores[matched].tolist()
+                ):
+                    if self.keys[i] not in results:
+                        results[self.keys[i]] = (score, int(counts[i]), self.texts[i])
+            for key, (original, count) in recent.items():
+                if key not in results:
+                    score = len(query_grams & trigrams(key)) / len(query_grams)
+                    if score >= AUTOCOMPLETE_SIMILARITY:
+                        results[key] = (score, count, original)
+
+        ranked = sorted(
+            results.items(), key=lambda item: (-item[1][0], -item[1][1], item[0])
+        )
+        return [
+            {"text": original, "count": count, "score": round(score, 3)}
+            for _, (score, count, original) in ranked[:k]
+        ]
+
+    def merged_terms(self):
+        terms = {
+            key: [self.texts[i], int(self.counts[i])] for i, key in enumerate(self.keys)
+        }
+        terms.update(self.recent)
+        return terms
+
+
+def count_terms(rows):
+    """Merge (text, count) rows by normalized text, keeping the most frequent text"""
+    terms = {}
+    for text, count in rows:
+        key = normalize(text)
+        term = terms.get(key)
+        if term is None:
+            terms[key] = [text, count, count]
+        else:
+            if count > term[2]:
+                term[0], term[2] = text, count
+            term[1] += count
+    return {key: [text, count] for key, (text, count, _) in terms.items()}
+
+
+class AutocompleteCache:
+    """Segment and code indexes per project, for the project version they are at"""
+
+    def __init__(self, max_projects: int = AUTOCOMPLETE_CACHE_SIZE):
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()
+        self.max_projects = max_projects
+
+    def _build(self, db: Session, project_id: int):
+        segment_rows = (
+            db.query(Segment.text, func.count())
+            .join(Sentence, Segment.sentence_id == Sentence.sentence_id)
+            .join(Dataset, Sentence.dataset_id == Dataset.dataset_id)
+            .filter(Dataset.project_id == project_id)
+            .group_by(Segment.text)
+        )
+        code_rows = (
+            db.query(Code.text, func.count(Segment.segment_id))
+            .outerjoin(Segment, Segment.code_id == Code.code_id)
+            .filter(Code.project_id == project_id)
+            .group_by(Code.code_id, Code.text)
+        )
+        return {
+            "segment": AutocompleteIndex(count_terms(segment_rows)),
+            "code": AutocompleteIndex(count_terms(code_rows)),
+        }
+
+    def get(self, db: Session, project_id: int, kind: str):
+        """Get the segment or code index of a project, rebuilt if the project changed"""
+        version = get_version(db, project_id)
+        with self._lock:
+            cached = self._indexes.get(project_id)
+            if cached is not None and cached[0] == version:
+                self._indexes.move_to_end(project_id)
+                return cached[1][kind]
+        with Timer(f"Building autocomplete index for project {project_id}"):
+            indexes = self._build(db, project_id)
+        with self._lock:
+            current = self._indexes.get(project_id)
+            if current is None or current[0] <= version:
+                self._indexes[project_id] = (version, indexes)
+                self._indexes.move_to_end(project_id)
+            while len(self._indexes) > self.max_projects:
+                self._indexes.popitem(last=False)
+        return indexes[kind]
+
+    def add(
+        self,
+        project_id: int,
+        version: int,
+        segments: Counter = None,
+        codes: Counter = None,
+    ):
+        """Add the texts of a write that bumped the project to version, if it is next"""
+        with self._lock:
+            cached = self._indexes.get(project_id)
+            if cached is None or cached[0] != version - 1:
+                return
+            indexes = cached[1]
+            for kind, terms in (("segment", segments), ("code", codes)):
+                if terms:
+                    indexes[kind].add(terms)
+                if len(indexes[kind].recent) > RECENT_TEXTS_LIMIT:
+                    indexes[kind] = AutocompleteIndex(indexes[kind].merged_terms())
+            self._indexes[project_id] = (version, indexes)
+
+
+autocomplete_cache = AutocompleteCache()
@@ -0,0 +1,126 @@
+"""
+This module pre-aggregates plot points into square-bin histograms at several resolutions.
+Level L splits the plot extent into 2**L x 2**L bins, every bin carries per-code and
+per-cluster counts. Zoomed-out views are answered from the bins instead of the points.
+"""
+
+import numpy as np
+
+from plot.encoding import NO_CLUSTER
+
+DENSITY_LEVELS = 9
+# categories (codes, clusters) share a key with their bin:
+# bin << 32 | category + CATEGORY_OFFSET
+CATEGORY_OFFSET = 2**31
+
+
+def _merge(keys, counts, new_keys, new_counts):
+    """Add sparse counts, entries that drop to zero are removed"""
+    all_keys = np.concatenate([keys, new_keys])
+    unique, inverse = np.unique(all_keys, return_inverse=True)
+    summed = np.bincount(inverse, weights=np.concatenate([counts, new_counts])).astype(
+        np.int64
+    )
+    keep = summed != 0
+    return unique[keep], summed[keep]
+
+
+def _sparse_counts(keys, weight: int):
+    unique, counts = np.unique(keys, return_counts=True)
+    return unique, counts.astype(np.int64) * weight
+
+
+class DensityPyramid:
+    """Sparse per-level histograms over a fixed square extent"""
+
+    def __init__(self, origin, size: float):
+        self.origin = origin
+        self.size = size
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        self.totals = [empty] * (DENSITY_LEVELS + 1)
+        self.codes = [empty] * (DENSITY_LEVELS + 1)
+        self.clusters = [empty] * (DENSITY_LEVELS + 1)
+
+    def copy(self):
+        pyramid = DensityPyramid(self.origin, self.size)
+        pyramid.totals = list(self.totals)
+        pyramid.codes = list(self.codes)
+        pyramid.clusters = list(self.clusters)
+        return pyramid
+
+    def _bins(self, xs, ys):
+        """Bin coordinates at the finest level"""
+        bins_per_axis = 2**DENSITY_LEVELS
+
+        def coordinate(values, origin):
+            values = np.asarray(values, dtype=np.float64)
+            return np.clip(
+                ((values - origin) / self.size * bins_per_axis).astype(np.int64),
+                0,
+                bins_per_axis - 1,
+            )
+
+        return coordinate(xs, self.origin[0]), coordinate(ys, self.origin[1])
+
+    def update(self, xs, ys, codes, clusters, weight: int = 1):
+        """Add (weight 1) or remove (weight -1) points, vectorized over all levels"""
+        if len(xs) == 0:
+            return
+        bx, by = self._bins(xs, ys)
+        codes = np.asarray(codes, dtype=np.int64) + CATEGORY_OFFSET
+        clusters = np.asarray(clusters, dtype=np.int64) + CATEGORY_OFFSET
+        for level in range(DENSITY_LEVELS + 1):
+            shift = DENSITY_LEVELS - level
+            bins = ((by >> shift) << level) + (bx >> shift)
+            self.totals[level] = _merge(
+                *self.totals[level], *_sparse_counts(bins, weight)
+            )
+            self.codes[level] = _merge(
+                *self.codes[level], *_sparse_counts((bins << 32) | codes, weight)
+            )
+            self.clusters[level] = _merge(
+                *self.clusters[level], *_sparse_counts((bins << 32) | clusters, weight)
+            )
+
+    def query(self, level: int, min_x: float, min_y: float, max_x: float, max_y: float):
+        """Get the non-empty bins of a level that overlap the bounds"""
+        level = max(0, min(level, DENSITY_LEVELS))
+        bins_per_axis = 2**level
+        bin_size = self.size / bins_per_axis
+
+        def bin_range(low, high, origin):
+            first = int(np.floor((low - origin) / bin_size))
+            last = int(np.ceil((high - origin) / bin_size)) - 1
+            return max(first, 0), min(last, bins_per_axis - 1)
+
+        bx0, bx1 = bin_range(min_x, max_x, self.origin[0])
+        by0, by1 = bin_range(min_y, max_y, self.origin[1])
+
+        def in_range(bins):
+            bx, by = bins % bins_per_axis, bins // bins_per_axis
+            return (bx >= bx0) & (bx <= bx1) & (by >= by0) & (by <= by1)
+
+        keys, counts = self.totals[level]
+        mask = in_range(keys)
+        result = {
+            int(key): {
+                "x": int(key % bins_per_axis),
+                "y": int(key // bins_per_axis),
+                "count": int(count),
+                "codes": {},
+                "clusters": {},
+            }
+            for key, count in zip(keys[mask], counts[mask])
+        }
+        for name, (keys, counts) in (
+            ("codes", self.codes[level]),
+            ("clusters", self.clusters[level]),
+        ):
+            bins = keys >> 32
+            mask = in_range(bins)
+            categories = (keys[mask] & 0xFFFFFFFF) - CATEGORY_OFFSET
+            for bin, category, count in zip(bins[mask], categories, counts[mask]):
+                if name == "clusters" and category == NO_CLUSTER:
+                    continue
+                result[int(bin)][name][int(category)] = int(count)
+        return {"level": level, "bin_size": bin_size, "bins": list(result.values())}
@@ -0,0 +1,133 @@
+"""
+This module packs plot rows into a binary columnar buffer whose arrays can be used as
+WebGL buffers directly.
+
+Layout, all values little-endian:
+    header          4s magic b"APLT", uint32 format version,
+                    uint32 point count n, uint32 string count m
+    x, y            float32[n] each
+    id, code        int32[n] each
+    cluster         int32[n], NO_CLUSTER for points without a cluster
+    segment         int32[n], index into the string table
+    sentence        int32[n], index into the string table
+    string offsets  uint32[m + 1], byte offsets into the string data
+    string data     utf-8
+Every array starts at a multiple of 4 bytes, so typed array views need no copy. Streamed
+plots are several such buffers one after another, each padded with zero bytes to a
+multiple of 4.
+
+Plots can also be streamed as newline-delimited JSON, one plot entry per line.
+"""
+
+import json
+import struct
+import sys
+from array import array
+from itertools import islice
+
+from fastapi.responses import Response, StreamingResponse
+
+PLOT_MAGIC = b"APLT"
+PLOT_FORMAT_VERSION = 1
+PLOT_MEDIA_TYPE = "application/octet-stream"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NO_CLUSTER = -2
+
+
+def _little_endian(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def encode_plot_rows(rows) -> bytes:
+    """Encode plot rows (with text) while iterating them, without intermediate dicts"""
+    xs, ys = array("f"), array("f")
+    ids, codes, clusters = array("i"), array("i"), array("i")
+    segments, sentences = array("i"), array("i")
+    strings = {}
+
+    for row in rows:
+        xs.append(row.x)
+        ys.append(row.y)
+        ids.append(row.id)
+        codes.append(row.code)
+        clusters.append(NO_CLUSTER if row.cluster is None else row.cluster)
+        segments.append(strings.setdefault(row.segment, len(strings)))
+        sentences.append(strings.setdefault(row.sentence, len(strings)))
+
+    string_data = bytearray()
+    offsets = array("I", [0])
+    for string in strings:
+        string_data += string.encode("utf-8")
+        offsets.append(len(string_data))
+
+    header = struct.pack(
+        "<4sIII", PLOT_MAGIC, PLOT_FORMAT_VERSION, len(ids), len(strings)
+    )
+    columns = (xs, ys, ids, codes, clusters, segments, sentences, offsets)
+    return b"".join(
+        [header, *(_little_endian(column) for column in columns), string_data]
+    )
+
+
+def plot_meta_headers(meta: dict) -> dict:
+    return {
+        f"X-Plot-{key.replace('_', '-').title()}": str(value)
+        for key, value in meta.items()
+        if value is not None
+    }
+
+
+def binary_plot_chunks(rows, chunk_size: int):
+    """Encode plot rows as buffers of at most chunk_size points, one without rows"""
+    rows = iter(rows)
+    chunk = list(islice(rows, chunk_size))
+    while True:
+        content = encode_plot_rows(chunk)
+        yield content + bytes(-len(content) % 4)
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+
+
+def binary_plot_response(rows, chunk_size: int = None, **meta) -> Response:
+    """Build a binary plot response, length and paging information as X-Plot-* headers
+
+    With chunk_size the rows are encoded while the response is streamed, as consecutive
+    buffers.
+    """
+    if chunk_size is not None:
+        meta["chunk_size"] = chunk_size
+        return StreamingResponse(
+            binary_plot_chunks(rows, chunk_size),
+            media_type=PLOT_MEDIA_TYPE,
+            headers=plot_meta_headers(meta),
+        )
+    content = encode_plot_rows(rows)
+    meta["length"] = struct.unpack_from("<I", content, 8)[0]
+    return Response(
+        content=content, media_type=PLOT_MEDIA_TYPE, headers=plot_meta_headers(meta)
+    )
+
+
+def ndjson_plot_response(entries, chunk_size: int, **meta) -> StreamingResponse:
+    """Stream plot entry dicts as NDJSON, paging information as X-Plot-* headers"""
+    return StreamingResponse(
+        ndjson_chunks(entries, chunk_size),
+        media_type=NDJSON_MEDIA_TYPE,
+        headers=plot_meta_headers(meta),
+    )
+
+
+def ndjson_chunks(items, chunk_size: int):
+    """Encode dicts as newline-delimited JSON, chunk_size lines per yielded chunk"""
+    lines = []
+    for item in items:
+        lines.append(json.dumps(item))
+        if len(lines) == chunk_size:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
@@ -0,0 +1,351 @@
+"""
+This module exports the plot of a project to CSV, JSON, JSONL and Parquet files in one
+pass over a server-side cursor, so memory stays bounded by one chunk of rows. Every file
+is written to a temporary file in the same directory and renamed when it is complete,
+readers never see a partial export. Scheduled dumps can run it from src with
+`python -m plot.export <project_id> --formats csv parquet`.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from itertools import islice
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from db.counters import get_count, plot_counter_key
+from db.session import SessionLocal
+from plot.encoding import ndjson_chunks
+from plot.file_operations import PLOT_CSV_HEADER, get_plot_file, plot_csv_row
+from plot.service import (
+    PLOT_STREAM_CHUNK_SIZE,
+    get_plot_model_ids,
+    plot_rows_query,
+    plot_rows_to_dicts,
+    stream_plot_rows,
+)
+from project.service import ProjectService
+from utilities.timer import Timer
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet exports are unavailable
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("csv", "json", "jsonl", "parquet")
+# rows per chunk, a chunk is one Parquet row group and one progress update
+EXPORT_CHUNK_SIZE = PLOT_STREAM_CHUNK_SIZE
+
+
+class ExportWriter(ABC):
+    """Writes chunks of plot entry dicts to the file of one format"""
+
+    binary = False
+
+    def __init__(self, path: str):
+        if self.binary:
+            self.file = open(path, "wb")
+        else:
+            self.file = open(path, "w", newline="", encoding="utf-8")
+
+    @abstractmethod
+    def write(self, entries):
+        """Write a chunk of plot entry dicts"""
+
+    def finish(self):
+        """Write the end of the file and close it, flushed to disk"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+    def close(self):
+        self.file.close()
+
+
+class CsvExportWriter(ExportWriter):
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(PLOT_CSV_HEADER)
+
+    def write(self, entries):
+        self.writer.writerows(plot_csv_row(entry) for entry in entries)
+
+
+class JsonExportWriter(ExportWriter):
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.file.write("[")
+        self.empty = True
+
+    def write(self, entries):
+        if entries and not self.empty:
+            self.file.write(", ")
+        self.file.write(", ".join(json.dumps(entry) for entry in entries))
+        self.empty = self.empty and not entries
+
+    def finish(self):
+        self.file.write("]")
+        super().finish()
+
+
+class JsonlExportWriter(ExportWriter):
+    def write(self, entries):
+        self.file.writelines(ndjson_chunks(entries, EXPORT_CHUNK_SIZE))
+
+
+class ParquetExportWriter(ExportWriter):
+    """Writes one row group per chunk, the positions flattened to x and y columns"""
+
+    binary = True
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.schema = pyarrow.schema(
+            [
+                ("id", pyarrow.int64()),
+                ("sentence", pyarrow.string()),
+                ("segment", pyarrow.string()),
+                ("start_position", pyarrow.int64()),
+                ("code", pyarrow.int64()),
+                ("x", pyarrow.float64()),
+                ("y", pyarrow.float64()),
+                ("cluster", pyarrow.int64()),
+            ]
+        )
+        self.writer = pyarrow.parquet.ParquetWriter(self.file, self.schema)
+
+    def write(self, entries):
+        columns = {name: [] for name in self.schema.names}
+        for entry in entries:
+            for name in (
+                "id",
+                "sentence",
+                "segment",
+                "start_position",
+                "code",
+                "cluster",
+            ):
+                columns[name].append(entry[name])
+            columns["x"].append(entry["reduced_embedding"]["x"])
+            columns["y"].append(entry["reduced_embedding"]["y"])
+        self.writer.write_table(pyarrow.table(columns, schema=self.schema))
+
+    def finish(self):
+        self.writer.close()
+        super().finish()
+
+    def close(self):
+        self.writer.close()
+        super().close()
+
+
+EXPORT_WRITERS = {
+    "csv": CsvExportWriter,
+    "json": JsonExportWriter,
+    "jsonl": JsonlExportWriter,
+    "parquet": ParquetExportWriter,
+}
+
+
+def check_export_formats(formats):
+    if not formats:
+        raise HTTPException(status_code=400, detail="No export format given")
+    unknown = set(formats) - set(EXPORT_FORMATS)
+    if unknown:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown export formats {sorted(unknown)}"
+        )
+    if "parquet" in formats and pyarrow is None:
+        raise HTTPException(
+            status_code=400, detail="Parquet exports need pyarrow installed"
+        )
+
+
+def export_plot(
+    db: Session,
+    project_id: int,
+    formats=("json", "csv"),
+    directory: str = None,
+    progress=None,
+):
+    """Write the plot of a project to one file per format, by default in its plots folder
+
+    progress(rows, total) is called after every chunk. Returns the number of rows and the
+    path per format.
+    """
+    formats = list(dict.fromkeys(formats))
+    check_export_formats(formats)
+    reduction_model_id, cluster_model_id = get_plot_model_ids(
+        ProjectService(project_id, db)
+    )
+    total = 0
+    rows = []
+    if reduction_model_id is not None:
+        # counted from the query that is streamed
+        total = get_count(
+            db,
+            project_id,
+            plot_counter_key(reduction_model_id),
+            plot_rows_query(db, reduction_model_id, cluster_model_id),
+        )
+        rows = stream_plot_rows(reduction_model_id, cluster_model_id)
+
+    paths = {}
+    temporaries = {}
+    writers = {}
+    try:
+        for format in formats:
+            path = get_plot_file(project_id, suffix=format)
+            if directory is not None:
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, os.path.basename(path))
+            paths[format] = path
+            handle, temporaries[format] = tempfile.mkstemp(
+                prefix=f".{os.path.basename(path)}.",
+                suffix=".tmp",
+                dir=os.path.dirname(path),
+            )
+            os.close(handle)
+            # mkstemp creates the file readable by the owner only
+            os.chmod(temporaries[format], 0o644)
+            writers[format] = EXPORT_WRITERS[format](temporaries[format])
+
+        count = 0
+        if progress is not None:
+            progress(count, total)
+        rows = iter(rows)
+        while chunk := list(islice(rows, EXPORT_CHUNK_SIZE)):
+            entries = plot_rows_to_dicts(chunk)
+            for writer in writers.values():
+                writer.write(entries)
+            count += len(entries)
+            if progress is not None:
+                progress(count, total)
+
+        for writer in writers.values():
+            writer.finish()
+        for format, path in paths.items():
+            os.replace(temporaries.pop(format), path)
+    finally:
+        if hasattr(rows, "close"):
+            rows.close()
+        for format, temporary in temporaries.items():
+            if format in writers:
+                writers[format].close()
+            os.remove(temporary)
+    return count, paths
+
+
+class ExportRunner:
+    """Runs at most one background export per project and keeps its progress"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}
+
+    def get_status(self, project_id: int):
+        with self._lock:
+            state = self._states.get(project_id)
+            return dict(state) if state else None
+
+    def start(self, project_id: int, formats):
+        """Start an export, returns the status of the running export if there is one"""
+        check_export_formats(formats)
+        with self._lock:
+            state = self._states.get(project_id)
+            if state and state["status"] == "running":
+                return dict(state)
+            state = {
+                "status": "running",
+                "formats": list(formats),
+                "rows": 0,
+                "total": None,
+                "files": {},
+                "error": None,
+            }
+            self._states[project_id] = state
+            thread = threading.Thread(
+                target=self._run,
+                args=(project_id, formats),
+                name=f"export-{project_id}",
+                daemon=True,
+            )
+            thread.start()
+            return dict(state)
+
+    def _set_state(self, project_id: int, **kwargs):
+        with self._lock:
+            self._states[project_id].update(kwargs)
+
+    def _run(self, project_id: int, formats):
+        db = SessionLocal()
+        try:
+            with Timer(f"Exporting plot of project {project_id}"):
+                count, paths = export_plot(
+                    db,
+                    project_id,
+                    formats,
+                    progress=lambda rows, total: self._set_state(
+                        project_id, rows=rows, total=total
+                    ),
+                )
+            self._set_state(project_id, status="done", rows=count, files=paths)
+        except Exception as e:
+            logger.error(f"Export failed for project {project_id}: {e}")
+            error = e.detail if isinstance(e, HTTPException) else str(e)
+            self._set_state(project_id, status="failed", error=error)
+        finally:
+            db.close()
+            SessionLocal.remove()
+
+
+export_runner = ExportRunner()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the plot of a project")
+    parser.add_argument("project_id", type=int)
+    parser.add_argument(
+        "--formats", nargs="+", choices=EXPORT_FORMATS, default=["csv", "jsonl"]
+    )
+    parser.add_argument(
+        "--output",
+        help="directory of the files, the plots folder of the project by default",
+    )
+    args = parser.parse_args()
+
+    logged = [-1]
+
+    def log_progress(rows: int, total: int):
+        # log every 10 percent
+        step = rows * 10 // total if total else 10
+        if step > logged[0]:
+            logged[0] = step
+            logger.info(f"Exported {rows}/{total} rows of project {args.project_id}")
+
+    db = SessionLocal()
+    try:
+        count, paths = export_plot(
+            db, args.project_id, args.formats, args.output, log_progress
+        )
+    except HTTPException as e:
+        parser.error(e.detail)
+    finally:
+        db.close()
+    for path in paths.values():
+        logger.info(f"Wrote {count} rows to {path}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,72 @@
+"""
+This module filters the points of a PlotIndex with packed bitsets, one per code
+(optionally with its subtree), cluster and dataset. Combined filters are a few vectorized
+OR/AND operations instead of a join per filter.
+"""
+
+from collections import defaultdict
+from functools import reduce
+
+import numpy as np
+
+
+class PlotFilters:
+    """Bitsets over the points of a PlotIndex, each computed on first use"""
+
+    def __init__(self, index):
+        self._index = index
+        self._children = defaultdict(list)
+        for code_id, parent_code_id in index.code_parents.items():
+            if parent_code_id is not None:
+                self._children[parent_code_id].append(code_id)
+        self._bitsets = {}
+
+    def _bitset(self, column: str, value: int):
+        key = (column, value)
+        bitset = self._bitsets.get(key)
+        if bitset is None:
+            bitset = np.packbits(getattr(self._index, column) == value)
+            self._bitsets[key] = bitset
+        return bitset
+
+    def subtree_codes(self, code_id: int):
+        """The code and all of its descendants"""
+        codes, stack = set(), [code_id]
+        while stack:
+            code = stack.pop()
+            if code not in codes:
+                codes.add(code)
+                stack.extend(self._children[code])
+        return codes
+
+    def code(self, code_id: int, subtree: bool = True):
+        if not subtree:
+            return self._bitset("codes", code_id)
+        key = ("subtree", code_id)
+        bitset = self._bitsets.get(key)
+        if bitset is None:
+            bitset = reduce(
+                np.bitwise_or,
+                (self._bitset("codes", code) for code in self.subtree_codes(code_id)),
+            )
+            self._bitsets[key] = bitset
+        return bitset
+
+    def cluster(self, cluster: int):
+        return self._bitset("clusters", cluster)
+
+    def dataset(self, dataset_id: int):
+        return self._bitset("datasets", dataset_id)
+
+    def select(self, code_ids=(), clusters=(), dataset_ids=(), subtree: bool = True):
+        """Sorted indexes of the points matching any value of every given filter"""
+        groups = [
+            [self.code(code_id, subtree) for code_id in code_ids or ()],
+            [self.cluster(cluster) for cluster in clusters or ()],
+            [self.dataset(dataset_id) for dataset_id in dataset_ids or ()],
+        ]
+        unions = [reduce(np.bitwise_or, group) for group in groups if group]
+        if not unions:
+            return np.arange(len(self._index))
+        selected = reduce(np.bitwise_and, unions)
+        return np.nonzero(np.unpackbits(selected, count=len(self._index)))[0]
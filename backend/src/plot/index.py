@@ -0,0 +1,421 @@
+"""
+This module keeps the plot points of a project in memory, as numpy arrays with a uniform
+grid index over the positions. Viewport queries (tiles, bounding boxes) are answered from
+the grid instead of a table scan.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from db.models import Code, PlotPoint
+from db.versions import get_version
+from plot.density import CATEGORY_OFFSET, DensityPyramid
+from plot.encoding import NO_CLUSTER
+from plot.filters import PlotFilters
+from plot.service import get_plot_model_ids, plot_rows_query
+from plot.snapshot import PLOT_SNAPSHOT_SERVING, plot_snapshot_cache
+from project.service import ProjectService
+from utilities.timer import Timer
+
+logger = logging.getLogger(__name__)
+
+GRID_SIZE = 256
+PLOT_INDEX_CACHE_SIZE = 8
+# points every code/cluster stratum keeps in a sample, if the budget allows
+SAMPLE_STRATUM_MINIMUM = 20
+SAMPLE_CACHE_SIZE = 8
+
+
+class PlotIndex:
+    """Plot points of one reduction/cluster model pair, sorted by segment id
+
+    If a previous index is given and its extent still covers all points, the extent is
+    kept and its density aggregates are updated with the changed points only.
+    """
+
+    def __init__(
+        self, ids, xs, ys, codes, clusters, datasets=None, previous: "PlotIndex" = None
+    ):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.xs = np.asarray(xs, dtype=np.float32)
+        self.ys = np.asarray(ys, dtype=np.float32)
+        self.codes = np.asarray(codes, dtype=np.int64)
+        self.clusters = np.asarray(clusters, dtype=np.int64)
+        if datasets is None:
+            datasets = np.zeros(len(self.ids))
+        self.datasets = np.asarray(datasets, dtype=np.int64)
+        # code id -> parent code id, set by PlotIndexCache for the filter bitsets
+        self.code_parents = {}
+        self._filters = None
+        # fixed random order, so points kept under a budget at one zoom level stay
+        # visible when zooming in
+        self.rank = np.random.default_rng(0).permutation(len(self.ids))
+        self._density = None
+        self._samples = {}
+        if previous is not None and previous.covers(self.xs, self.ys):
+            self.origin, self.size = previous.origin, previous.size
+            if previous._density is not None:
+                self._density = previous._density.copy()
+                self._apply_changes(previous)
+        else:
+            self._set_extent()
+        self._build_grid()
+
+    @classmethod
+    def from_rows(cls, rows, previous: "PlotIndex" = None):
+        ids, xs, ys, codes, clusters, datasets = [], [], [], [], [], []
+        for row in rows:
+            ids.append(row.id)
+            xs.append(row.x)
+            ys.append(row.y)
+            codes.append(row.code)
+            clusters.append(NO_CLUSTER if row.cluster is None else row.cluster)
+            datasets.append(row.dataset)
+        return cls(ids, xs, ys, codes, clusters, datasets, previous=previous)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _set_extent(self):
+        if len(self) == 0:
+            self.origin = (0.0, 0.0)
+            self.size = 1.0
+        else:
+            self.origin = (float(self.xs.min()), float(self.ys.min()))
+            extent = max(
+                float(self.xs.max()) - self.origin[0],
+                float(self.ys.max()) - self.origin[1],
+            )
+            # square extent, slightly enlarged so the maximum lies inside the last cell
+            self.size = extent * (1 + 1e-6) if extent > 0 else 1.0
+
+    def covers(self, xs, ys):
+        if len(self) == 0:
+            return False
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        return bool(
+            np.all(xs >= self.origin[0])
+            and np.all(xs < self.origin[0] + self.size)
+            and np.all(ys >= self.origin[1])
+            and np.all(ys < self.origin[1] + self.size)
+        )
+
+    def _apply_changes(self, previous: "PlotIndex"):
+        """Update the copied density aggregates with the points changed since previous"""
+        positions = np.clip(
+            np.searchsorted(self.ids, previous.ids), 0, max(len(self) - 1, 0)
+        )
+        present = (
+            self.ids[positions] == previous.ids
+            if len(self)
+            else np.zeros(len(previous), bool)
+        )
+        old, new = np.nonzero(present)[0], positions[present]
+        unchanged = (
+            (previous.xs[old] == self.xs[new])
+            & (previous.ys[old] == self.ys[new])
+            & (previous.codes[old] == self.codes[new])
+            & (previous.clusters[old] == self.clusters[new])
+        )
+        removed = np.ones(len(previous), dtype=bool)
+        removed[old[unchanged]] = False
+        added = np.ones(len(self), dtype=bool)
+        added[new[unchanged]] = False
+        self._density.update(
+            previous.xs[removed],
+            previous.ys[removed],
+            previous.codes[removed],
+            previous.clusters[removed],
+            weight=-1,
+        )
+        self._density.update(
+            self.xs[added], self.ys[added], self.codes[added], self.clusters[added]
+        )
+
+    @property
+    def density(self) -> DensityPyramid:
+        """Density aggregates of all points, computed on first use"""
+        if self._density is None:
+            density = DensityPyramid(self.origin, self.size)
+            density.update(self.xs, self.ys, self.codes, self.clusters)
+            self._density = density
+        return self._density
+
+    @property
+    def filters(self) -> PlotFilters:
+        """Code/cluster/dataset bitsets of the points, computed on first use"""
+        if self._filters is None:
+            self._filters = PlotFilters(self)
+        return self._filters
+
+    def _build_grid(self):
+        cells = self._cell(self.xs, self.ys)
+        self.order = np.argsort(cells, kind="stable")
+        self.cell_starts = np.searchsorted(
+            cells[self.order], np.arange(GRID_SIZE * GRID_SIZE + 1)
+        )
+
+    def _grid_coordinate(self, values, origin):
+        # float64 for points and query bounds alike, so both map to cells the same way
+        values = np.asarray(values, dtype=np.float64)
+        return np.clip(
+            ((values - origin) / self.size * GRID_SIZE).astype(np.int64), 0, GRID_SIZE - 1
+        )
+
+    def _cell(self, xs, ys):
+        return self._grid_coordinate(
+            ys, self.origin[1]
+        ) * GRID_SIZE + self._grid_coordinate(xs, self.origin[0])
+
+    def tile_bounds(self, z: int, x: int, y: int):
+        """Bounds of tile x/y at zoom z, zoom 0 is the whole extent, y grows with pos_y"""
+        tile_size = self.size / (2**z)
+        min_x = self.origin[0] + x * tile_size
+        min_y = self.origin[1] + y * tile_size
+        return min_x, min_y, min_x + tile_size, min_y + tile_size
+
+    def query_bbox(self, min_x: float, min_y: float, max_x: float, max_y: float):
+        """Indexes of the points with min <= position < max"""
+        if len(self) == 0 or max_x <= min_x or max_y <= min_y:
+            return np.empty(0, dtype=np.int64)
+        cx0, cx1 = self._grid_coordinate(np.array([min_x, max_x]), self.origin[0])
+        cy0, cy1 = self._grid_coordinate(np.array([min_y, max_y]), self.origin[1])
+        # the cells of one grid row are contiguous in self.order
+        candidates = np.concatenate(
+            [
+                self.order[
+                    self.cell_starts[cy * GRID_SIZE + cx0] : self.cell_starts[
+                        cy * GRID_SIZE + cx1 + 1
+                    ]
+                ]
+                for cy in range(cy0, cy1 + 1)
+            ]
+        )
+        xs, ys = self.xs[candidates], self.ys[candidates]
+        mask = (xs >= min_x) & (xs < max_x) & (ys >= min_y) & (ys < max_y)
+        return candidates[mask]
+
+    def query_polygon(self, vertices):
+        """Sorted indexes of the points inside a polygon [[x, y], ...], even-odd rule"""
+        vertices = np.asarray(vertices, dtype=np.float64)
+        if len(vertices) < 3:
+            return np.empty(0, dtype=np.int64)
+        (min_x, min_y), (max_x, max_y) = vertices.min(axis=0), vertices.max(axis=0)
+        candidates = self.query_bbox(
+            min_x, min_y, np.nextafter(max_x, np.inf), np.nextafter(max_y, np.inf)
+        )
+        xs = self.xs[candidates].astype(np.float64)
+        ys = self.ys[candidates].astype(np.float64)
+        inside = np.zeros(len(candidates), dtype=bool)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for (x0, y0), (x1, y1) in zip(vertices, np.roll(vertices, 1, axis=0)):
+                crosses = (y0 > ys) != (y1 > ys)
+                inside ^= crosses & (xs < (x1 - x0) * (ys - y0) / (y1 - y0) + x0)
+        return np.sort(candidates[inside])
+
+    def query_circle(self, x: float, y: float, radius: float):
+        """Sorted indexes of the points within radius of x/y"""
+        candidates = self.query_bbox(
+            x - radius,
+            y - radius,
+            np.nextafter(x + radius, np.inf),
+            np.nextafter(y + radius, np.inf),
+        )
+        distances = np.hypot(self.xs[candidates] - x, self.ys[candidates] - y)
+        return np.sort(candidates[distances <= radius])
+
+    def position(self, segment_id: int):
+        """Index of a segment, None if it is not in the plot"""
+        i = int(np.searchsorted(self.ids, segment_id))
+        if i < len(self) and self.ids[i] == segment_id:
+            return i
+        return None
+
+    def nearest(self, i: int, k: int):
+        """Indexes and distances of the k points closest to point i (without i)
+
+        Closest first. Grows a square around the point until it contains k points and the
+        k-th distance.
+        """
+        x, y = float(self.xs[i]), float(self.ys[i])
+        half = self.size / GRID_SIZE
+        while True:
+            candidates = self.query_bbox(x - half, y - half, x + half, y + half)
+            candidates = candidates[candidates != i]
+            distances = np.hypot(self.xs[candidates] - x, self.ys[candidates] - y)
+            if len(candidates) >= k:
+                order = np.argsort(distances, kind="stable")[:k]
+                # every point closer than the k-th one lies inside the square
+                if distances[order[-1]] < half:
+                    return candidates[order], distances[order]
+                half = float(distances[order[-1]]) * (1 + 1e-6)
+            elif half >= 2 * self.size:
+                order = np.argsort(distances, kind="stable")
+                return candidates[order], distances[order]
+            else:
+                half *= 2
+
+    def limit(self, indexes, budget: int):
+        """Keep at most budget points, always the same ones for the same input"""
+        if budget is None or len(indexes) <= budget:
+            return indexes
+        ranks = self.rank[indexes]
+        return indexes[np.argpartition(ranks, budget - 1)[:budget]]
+
+    def sample(self, max_points: int):
+        """Indexes of a deterministic sample of at most max_points points
+
+        The points are stratified by code and cluster. Every stratum keeps a minimum of
+        points, the rest of the budget is split proportionally, so rare codes stay
+        visible. Within a stratum the points of lowest rank are kept.
+        """
+        if max_points >= len(self):
+            return np.arange(len(self))
+        if max_points in self._samples:
+            return self._samples[max_points]
+        _, strata = np.unique(
+            (self.codes << 32) | (self.clusters + CATEGORY_OFFSET), return_inverse=True
+        )
+        counts = np.bincount(strata)
+        quotas = np.minimum(
+            counts, min(SAMPLE_STRATUM_MINIMUM, max_points // len(counts))
+        )
+        spare = counts - quotas
+        shares = (max_points - quotas.sum()) * spare / max(spare.sum(), 1)
+        extra = np.floor(shares).astype(np.int64)
+        # largest remainder for the points left after rounding down
+        left = max_points - quotas.sum() - extra.sum()
+        extra[np.argsort(extra - shares, kind="stable")[:left]] += 1
+        quotas += np.minimum(extra, spare)
+
+        order = np.lexsort((self.rank, strata))
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        offsets = np.arange(len(self)) - starts[strata[order]]
+        indexes = np.sort(order[offsets < quotas[strata[order]]])
+        if len(self._samples) >= SAMPLE_CACHE_SIZE:
+            self._samples.pop(next(iter(self._samples)))
+        self._samples[max_points] = indexes
+        return indexes
+
+    def to_dicts(self, indexes):
+        indexes = np.asarray(indexes, dtype=np.int64)
+        columns = zip(
+            self.ids[indexes].tolist(),
+            self.codes[indexes].tolist(),
+            self.clusters[indexes].tolist(),
+            self.xs[indexes].tolist(),
+            self.ys[indexes].tolist(),
+        )
+        return [
+            {
+                "id": id,
+                "code": code,
+                "cluster": None if cluster == NO_CLUSTER else cluster,
+                "reduced_embedding": {"x": x, "y": y},
+            }
+            for id, code, cluster, x, y in columns
+        ]
+
+
+class PlotIndexCache:
+    """One PlotIndex per project, rebuilt when the models or the project version change
+
+    The outdated index is passed to the rebuild as previous index, so aggregates refresh
+    incrementally. Only the indexes of the max_projects most recently used projects are
+    kept.
+    """
+
+    def __init__(self, max_projects: int = PLOT_INDEX_CACHE_SIZE):
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()
+        self.max_projects = max_projects
+
+    def _build(
+        self, db: Session, project_id: int, reduction_model_id, cluster_model_id, previous
+    ):
+        rows = (
+            plot_rows_query(
+                db,
+                reduction_model_id,
+                cluster_model_id,
+                with_text=False,
+                with_dataset=True,
+            )
+            .order_by(PlotPoint.segment_id)
+            .all()
+        )
+        index = PlotIndex.from_rows(rows, previous=previous)
+        index.code_parents = dict(
+            db.query(Code.code_id, Code.parent_code_id).filter(
+                Code.project_id == project_id
+            )
+        )
+        return index
+
+    def _build_from_snapshot(self, snapshot, previous):
+        index = PlotIndex(
+            snapshot.ids,
+            snapshot.xs,
+            snapshot.ys,
+            snapshot.codes,
+            snapshot.clusters,
+            snapshot.datasets,
+            previous=previous,
+        )
+        index.code_parents = dict(snapshot.meta["code_parents"])
+        return index
+
+    def get(self, db: Session, project_id: int):
+        """Get the index of the active models, None if there are no reduced embeddings yet
+
+        In snapshot serving mode the index is built from the latest snapshot, if it is
+        current.
+        """
+        snapshot = None
+        if PLOT_SNAPSHOT_SERVING:
+            snapshot = plot_snapshot_cache.get_current(db, project_id)
+        if snapshot is not None:
+            reduction_model_id = snapshot.meta["reduction_model_id"]
+            cluster_model_id = snapshot.meta["cluster_model_id"]
+            key = (reduction_model_id, cluster_model_id, snapshot.version)
+        else:
+            reduction_model_id, cluster_model_id = get_plot_model_ids(
+                ProjectService(project_id, db)
+            )
+            if reduction_model_id is None:
+                return None
+            key = (reduction_model_id, cluster_model_id, get_version(db, project_id))
+        with self._lock:
+            cached = self._indexes.get(project_id)
+            if cached is not None:
+                self._indexes.move_to_end(project_id)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        previous = None
+        if cached is not None and cached[0][0] == reduction_model_id:
+            previous = cached[1]
+
+        with Timer(f"Building plot index for project {project_id}"):
+            if snapshot is not None:
+                index = self._build_from_snapshot(snapshot, previous)
+            else:
+                index = self._build(
+                    db, project_id, reduction_model_id, cluster_model_id, previous
+                )
+        with self._lock:
+            # overlapping builds keep the index of the newest version
+            current = self._indexes.get(project_id)
+            if current is None or current[0][2] <= key[2]:
+                self._indexes[project_id] = (key, index)
+                self._indexes.move_to_end(project_id)
+            while len(self._indexes) > self.max_projects:
+                self._indexes.popitem(last=False)
+        return index
+
+
+plot_index_cache = PlotIndexCache()
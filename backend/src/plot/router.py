@@ -1,36 +1,79 @@
-from fastapi import APIRouter, Depends, UploadFile
-from sqlalchemy import and_
-from sqlalchemy.orm import Session, aliased
-import threading
+from typing import List, Optional, Union
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, UploadFile
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from clusters.router import extract_clusters_endpoint
 from dataset.router import upload_dataset
 from db.models import (
-    Cluster,
-    Code,
-    Dataset,
-    Embedding,
-    Model,
+    PlotPoint,
     Project,
-    ReducedEmbedding,
     Segment,
-    Sentence,
 )
+from db.changes import record_changes
+from db.counters import (
+    get_count,
+    get_project_counts,
+    plot_counter_key,
+    reconcile_project_counts,
+    reset_counts,
+)
+from db.pagination import keyset_page
+from db.plot_points import update_plot_codes
 from db.session import get_db
+from db.versions import bump_version, get_version
 from embeddings.router import extract_embeddings_endpoint
-from plot.file_operations import extract_plot
-from plot.schemas import PlotTable
+from plot.export import export_plot, export_runner
+from plot.encoding import binary_plot_response, ndjson_plot_response
+from plot.autocomplete import AUTOCOMPLETE_MAX_K, autocomplete_cache
+from plot.index import plot_index_cache
+from plot.search import search_plot, search_rows_to_dicts
+from plot.stats import compute_cluster_stats, compute_code_stats, stats_cache
+from plot.snapshot import PLOT_SNAPSHOT_SERVING, plot_snapshot_cache, write_plot_snapshot
+from plot.schemas import (
+    CompletionKind,
+    Completions,
+    DensityTile,
+    ExportFormat,
+    ExportStatus,
+    NormalizedPlotTable,
+    PlotChanges,
+    PlotExtent,
+    PlotFormat,
+    PlotNeighbors,
+    PlotSelection,
+    PlotTable,
+    PlotTile,
+    SearchField,
+    SearchResults,
+    SelectionArea,
+    SentenceTexts,
+)
+from plot.service import (
+    PLOT_STREAM_CHUNK_SIZE,
+    get_plot_changes,
+    get_plot_model_ids,
+    get_plot_rows_by_ids,
+    get_sentence_texts,
+    plot_row_to_dict,
+    plot_rows_query,
+    plot_rows_to_dicts,
+    plot_rows_to_normalized,
+    stream_plot_rows,
+)
 from project.router import create_project_route
 from project.service import ProjectService
 from reduced_embeddings.router import extract_embeddings_reduced_endpoint
 from utilities.locks import db_lock
+from pipeline.schemas import PipelineStatus
+from pipeline.service import pipeline_runner
 
-from utilities.timer import Timer
+from utilities.etag import check_etag, check_project_etag, etag_headers, version_etag
+from utilities.json_response import FastJSONResponse
 
 # TODO: dont use the router, move stuff to services
 router = APIRouter()
-from sqlalchemy import func
-import gc
 
 @router.get("/")
 async def get_plot_endpoint(
@@ -38,113 +81,347 @@ async def get_plot_endpoint(
     all: bool = False,
     page: int = 0,
     page_size: int = 100,
+    cursor: Optional[int] = None,
+    format: PlotFormat = "json",
+    max_points: Optional[int] = None,
+    request: Request = None,
+    http_response: Response = None,
     db: Session = Depends(get_db),
-) -> PlotTable:
-    clusters = True
-
-    extract_embeddings_endpoint(project_id, db = db)
-    extract_embeddings_reduced_endpoint(project_id, db = db)
-    if clusters:
-        with Timer("Extracting clusters"):
-            extract_clusters_endpoint(project_id, db = db)
-
-    db.commit()
-    gc.collect()
-
-    if clusters:
-        async with db_lock:
-            ReducedEmbeddingAlias = aliased(ReducedEmbedding)
-            EmbeddingAlias = aliased(Embedding)
-            SegmentAlias = aliased(Segment)
-            SentenceAlias = aliased(Sentence)
-            CodeAlias = aliased(Code)
-            ProjectAlias = aliased(Project)
-            # get config id from project id
-            project: ProjectService = ProjectService(project_id, db)
-            model_entry = project.get_model_entry("cluster_config")
-            query = (
-                db.query(
-                    Cluster,
-                    ReducedEmbeddingAlias,
-                    EmbeddingAlias,
-                    SegmentAlias,
-                    SentenceAlias,
-                    CodeAlias,
-                    ProjectAlias,
-                )
-                .filter(ProjectAlias.project_id == project_id)
-                .filter(Cluster.model_id == model_entry.model_id)
-                .join(
-                    ReducedEmbeddingAlias,
-                    Cluster.reduced_embedding_id == ReducedEmbeddingAlias.reduced_embedding_id,
-                )
-                .join(
-                    EmbeddingAlias,
-                    ReducedEmbeddingAlias.embedding_id == EmbeddingAlias.embedding_id,
-                )
-                .join(SegmentAlias, EmbeddingAlias.segment_id == SegmentAlias.segment_id)
-                .join(SentenceAlias, SegmentAlias.sentence_id == SentenceAlias.sentence_id)
-                .join(CodeAlias, SegmentAlias.code_id == CodeAlias.code_id)
-                .join(ProjectAlias, CodeAlias.project_id == ProjectAlias.project_id)
-            )
+) -> Union[NormalizedPlotTable, PlotTable]:
+    """Get the plot of a project, only reads what the background pipeline has written so far
+
+    Pages are ordered by segment id, pass next_cursor as cursor to get the following page.
+
+    format=normalized returns points with a sentence_id and one sentence dictionary per page,
+    format=binary returns the packed columnar layout of plot.encoding instead of JSON,
+    format=ndjson streams one plot entry per line. With all, both read from a server-side cursor
+    and binary plots are streamed as consecutive buffers of PLOT_STREAM_CHUNK_SIZE points.
+
+    max_points returns a deterministic sample of all points instead of a page, stratified by code and cluster.
+    Responses carry an ETag of the project version, If-None-Match is answered with 304.
+    The version can be passed to /changes/ as since to update the plot later.
+    In snapshot serving mode the plot is read from the latest snapshot of the project, if it is current.
+    """
+    if max_points is not None and max_points < 1:
+        raise HTTPException(status_code=400, detail="max_points must be positive")
+
+    snapshot = None
+    if PLOT_SNAPSHOT_SERVING:
+        snapshot = plot_snapshot_cache.get_current(db, project_id)
+    if snapshot is not None:
+        version, pipeline = snapshot.version, None
+        etag_parts = ("snapshot",)
     else:
-        async with db_lock:
-            EmbeddingAlias = aliased(Embedding)
-            SegmentAlias = aliased(Segment)
-            SentenceAlias = aliased(Sentence)
-            CodeAlias = aliased(Code)
-            ProjectAlias = aliased(Project)
-            # get config id from project id
-            project: ProjectService = ProjectService(project_id, db)
-            model_entry = project.get_model_entry("reduction_config")
-            query = (
-                db.query(
-                    ReducedEmbedding,
-                    EmbeddingAlias,
-                    SegmentAlias,
-                    SentenceAlias,
-                    CodeAlias,
-                    ProjectAlias,
-                )
-                .filter(ProjectAlias.project_id == project_id)
-                .filter(ReducedEmbedding.model_id == model_entry.model_id)
-                .join(
-                    EmbeddingAlias,
-                    ReducedEmbedding.embedding_id == EmbeddingAlias.embedding_id,
-                )
-                .join(SegmentAlias, EmbeddingAlias.segment_id == SegmentAlias.segment_id)
-                .join(SentenceAlias, SegmentAlias.sentence_id == SentenceAlias.sentence_id)
-                .join(CodeAlias, SegmentAlias.code_id == CodeAlias.code_id)
-                .join(ProjectAlias, CodeAlias.project_id == ProjectAlias.project_id)
+        project: ProjectService = ProjectService(project_id, db)
+        reduction_model_id, cluster_model_id = get_plot_model_ids(project)
+        pipeline = pipeline_runner.ensure(project_id)
+        # read before the rows, so changes written in between are replayed by /changes/
+        version = get_version(db, project_id)
+        etag_parts = (pipeline["status"], pipeline["stage"])
+    etag = None
+    if request is not None:
+        etag = version_etag(request, version, *etag_parts)
+        not_modified = check_etag(request, http_response, etag)
+        if not_modified:
+            return not_modified
+
+    response: PlotTable = {"version": version}
+    if not all and max_points is None:
+        response.update({"page": page, "page_size": page_size})
+    if snapshot is not None:
+        count = len(snapshot)
+        if max_points is not None:
+            index = await run_in_threadpool(plot_index_cache.get, db, project_id)
+            plots = snapshot.rows(index.sample(max_points))
+        elif all:
+            plots = snapshot.rows(range(count))
+        else:
+            indexes, response["next_cursor"] = snapshot.page(page, page_size, cursor)
+            plots = snapshot.rows(indexes)
+        if format not in ("binary", "ndjson"):
+            plots = list(plots)
+        return plot_response(
+            plots, response, format, etag, count, pipeline, stream=all and max_points is None
+        )
+    if reduction_model_id is None:
+        return plot_response([], response, format, etag, 0, pipeline)
+
+    if max_points is not None:
+        # the first request after a write builds the index, off the event loop
+        index = await run_in_threadpool(plot_index_cache.get, db, project_id)
+    async with db_lock:
+        query = plot_rows_query(db, reduction_model_id, cluster_model_id)
+        # the rows of the plot, counted from the same query as the pages
+        count = get_count(db, project_id, plot_counter_key(reduction_model_id), query)
+        if max_points is not None:
+            sample_ids = index.ids[index.sample(max_points)].tolist()
+            plots = (
+                query.filter(PlotPoint.segment_id.in_(sample_ids))
+                .order_by(PlotPoint.segment_id)
+                .all()
+            )
+        elif all and format in ("binary", "ndjson"):
+            plots = stream_plot_rows(reduction_model_id, cluster_model_id)
+        elif all:
+            plots = query.order_by(PlotPoint.segment_id).all()
+        else:
+            plots, next_cursor = keyset_page(
+                query, PlotPoint.segment_id, "id", page_size, page, cursor
             )
+            response["next_cursor"] = next_cursor
+    return plot_response(
+        plots, response, format, etag, count, pipeline, stream=all and max_points is None
+    )
+
 
-    count = query.count()
-    response: PlotTable = {}
-    if all:
-        plots = query.all()
+def plot_response(
+    plots,
+    response: dict,
+    format: PlotFormat,
+    etag: str,
+    count: int,
+    pipeline,
+    stream: bool = False,
+):
+    """Format the plot rows of get_plot_endpoint, response holds the version and paging information
+
+    With stream, binary plots are encoded chunk by chunk while the response is sent.
+    Binary and NDJSON plots send the pipeline status and stage as X-Plot-Pipeline-* headers.
+    """
+    meta = {
+        "count": count,
+        "page": response.get("page"),
+        "page_size": response.get("page_size"),
+        "next_cursor": response.get("next_cursor"),
+        "version": response["version"],
+    }
+    if pipeline is not None:
+        meta.update(pipeline_status=pipeline["status"], pipeline_stage=pipeline["stage"])
+    if format == "binary":
+        chunk_size = PLOT_STREAM_CHUNK_SIZE if stream else None
+        binary = binary_plot_response(plots, chunk_size, **meta)
+        if etag:
+            binary.headers.update(etag_headers(etag))
+        return binary
+    if format == "ndjson":
+        ndjson = ndjson_plot_response(
+            (plot_row_to_dict(row) for row in plots), PLOT_STREAM_CHUNK_SIZE, **meta
+        )
+        if etag:
+            ndjson.headers.update(etag_headers(etag))
+        return ndjson
+    if format == "normalized":
+        result_dicts, sentences = plot_rows_to_normalized(plots)
+        response["sentences"] = sentences
     else:
-        plots = query.offset(page * page_size).limit(page_size).all()
-        response.update({"page": page, "page_size": page_size})
+        result_dicts = plot_rows_to_dicts(plots)
+    response.update(
+        {
+            "data": result_dicts,
+            "length": len(result_dicts),
+            "count": count,
+            "pipeline": pipeline,
+        }
+    )
+    return FastJSONResponse(response, headers=etag_headers(etag) if etag else None)
+
+
+def search_response(plots, limit: int, format: PlotFormat, etag: str, count: int = None):
+    if format == "binary":
+        binary = binary_plot_response(plots, limit=limit, count=count)
+        binary.headers.update(etag_headers(etag))
+        return binary
+    if format == "ndjson":
+        ndjson = ndjson_plot_response(
+            plot_rows_to_dicts(plots), PLOT_STREAM_CHUNK_SIZE, limit=limit, count=count
+        )
+        ndjson.headers.update(etag_headers(etag))
+        return ndjson
+    if format == "normalized":
+        result_dicts, sentences = plot_rows_to_normalized(plots)
+        response = {"data": result_dicts, "sentences": sentences}
+    else:
+        result_dicts = plot_rows_to_dicts(plots)
+        response = {"data": result_dicts}
+    response.update({"length": len(result_dicts), "limit": limit, "count": count})
+    return FastJSONResponse(response, headers=etag_headers(etag))
+
+
+def filter_plot_rows(db: Session, project_id: int, limit: int, **filters):
+    """Get the first limit plot rows matching PlotFilters.select(**filters) and the number of all matches"""
+    index = plot_index_cache.get(db, project_id)
+    if index is None:
+        return [], 0
+    indexes = index.filters.select(**filters)
+    plots = get_plot_rows_by_ids(db, project_id, index.ids[indexes[:limit]].tolist())
+    return plots, len(indexes)
+
+
+@router.get("/changes/")
+def get_plot_changes_route(
+    project_id: int,
+    since: int,
+    db: Session = Depends(get_db),
+) -> PlotChanges:
+    """Get the points changed after version since, pass the returned version as since next time
+
+    Refetch the whole plot if full_refresh is set.
+    """
+    return FastJSONResponse(get_plot_changes(db, project_id, since))
+
+
+@router.get("/sentences/")
+def get_sentences_route(
+    project_id: int,
+    start_id: int,
+    end_id: int,
+    db: Session = Depends(get_db),
+) -> SentenceTexts:
+    """Get sentence texts by id range, to resolve sentence_ids of normalized plots lazily"""
+    return {"sentences": get_sentence_texts(db, project_id, start_id, end_id)}
+
 
-    index = 0
-    if not clusters:
-        index = -1
-    result_dicts = [
+def tile_response(index, bounds, budget: int):
+    indexes = index.query_bbox(*bounds)
+    selected = index.limit(indexes, budget)
+    return FastJSONResponse(
         {
-            "id": row[index + 3].segment_id,
-            "sentence": row[index + 4].text,
-            "segment": row[index + 3].text,
-            "start_position": row[index + 3].start_position,
-            "code": row[index + 5].code_id,
-            "reduced_embedding": {"x": row[index + 1].pos_x, "y": row[index + 1].pos_y},
-            "cluster": row[index + 0].cluster if clusters else -1,
+            "bounds": list(bounds),
+            "count": len(indexes),
+            "length": len(selected),
+            "data": index.to_dicts(selected),
         }
-        for row in plots
-    ]
+    )
+
+
+@router.get("/tiles/")
+def get_plot_extent(project_id: int, db: Session = Depends(get_db)) -> PlotExtent:
+    """Get the extent covered by tile 0/0/0"""
+    index = plot_index_cache.get(db, project_id)
+    if index is None:
+        return {"min_x": 0.0, "min_y": 0.0, "size": 1.0, "count": 0}
+    return {"min_x": index.origin[0], "min_y": index.origin[1], "size": index.size, "count": len(index)}
+
+
+@router.get("/tiles/{z}/{x}/{y}")
+def get_plot_tile(
+    project_id: int,
+    z: int,
+    x: int,
+    y: int,
+    budget: int = 5000,
+    db: Session = Depends(get_db),
+) -> PlotTile:
+    """Get the points of a tile, at most budget of them; zoom 0 is the whole extent, y grows with pos_y"""
+    index = plot_index_cache.get(db, project_id)
+    if index is None:
+        return {"bounds": [], "count": 0, "length": 0, "data": []}
+    return tile_response(index, index.tile_bounds(z, x, y), budget)
+
 
-    response.update({"data": result_dicts, "length": len(result_dicts), "count": count})
-    print({"length": len(result_dicts), "count": count})
-    return response
+@router.get("/density/{z}/{x}/{y}")
+def get_density_tile(
+    project_id: int,
+    z: int,
+    x: int,
+    y: int,
+    resolution: int = 64,
+    db: Session = Depends(get_db),
+) -> DensityTile:
+    """Get pre-aggregated bins of a tile, with about resolution x resolution bins per tile
+
+    Bin x/y are counted from min_x/min_y in steps of bin_size.
+    """
+    index = plot_index_cache.get(db, project_id)
+    if index is None:
+        return {"level": 0, "bin_size": 1.0, "min_x": 0.0, "min_y": 0.0, "bins": []}
+    level = z + max(resolution, 1).bit_length() - 1
+    density = index.density.query(level, *index.tile_bounds(z, x, y))
+    density.update({"min_x": index.origin[0], "min_y": index.origin[1]})
+    return FastJSONResponse(density)
+
+
+@router.get("/bbox/")
+def get_plot_bbox(
+    project_id: int,
+    min_x: float,
+    min_y: float,
+    max_x: float,
+    max_y: float,
+    budget: int = 5000,
+    db: Session = Depends(get_db),
+) -> PlotTile:
+    """Get the points inside a bounding box, at most budget of them"""
+    index = plot_index_cache.get(db, project_id)
+    if index is None:
+        return {"bounds": [], "count": 0, "length": 0, "data": []}
+    return tile_response(index, (min_x, min_y, max_x, max_y), budget)
+
+
+@router.post("/select/")
+def select_plot_area(
+    project_id: int, area: SelectionArea, db: Session = Depends(get_db)
+) -> PlotSelection:
+    """Get the points inside a polygon ([[x, y], ...]) or circle, with code and cluster for recoding"""
+    if (area.polygon is None) == (area.circle is None):
+        raise HTTPException(status_code=400, detail="Pass either a polygon or a circle")
+    index = plot_index_cache.get(db, project_id)
+    if index is None:
+        return {"length": 0, "data": []}
+    if area.polygon is not None:
+        if any(len(vertex) != 2 for vertex in area.polygon):
+            raise HTTPException(status_code=400, detail="Polygon vertices must be [x, y] pairs")
+        indexes = index.query_polygon(area.polygon)
+    else:
+        indexes = index.query_circle(area.circle.x, area.circle.y, area.circle.radius)
+    data = [
+        {"id": point["id"], "code": point["code"], "cluster": point["cluster"]}
+        for point in index.to_dicts(indexes)
+    ]
+    return FastJSONResponse({"length": len(data), "data": data})
+
+
+@router.get("/segment/{segment_id}/neighbors")
+def get_segment_neighbors(
+    project_id: int, segment_id: int, k: int = 10, db: Session = Depends(get_db)
+) -> PlotNeighbors:
+    """Get the k points closest to a segment in the plot, closest first"""
+    if k < 1:
+        raise HTTPException(status_code=400, detail="k must be positive")
+    index = plot_index_cache.get(db, project_id)
+    position = index.position(segment_id) if index is not None else None
+    if position is None:
+        raise HTTPException(status_code=404, detail="Segment not found in the plot")
+    indexes, distances = index.nearest(position, k)
+    data = index.to_dicts(indexes)
+    for point, distance in zip(data, distances):
+        point["distance"] = float(distance)
+    return FastJSONResponse({"id": segment_id, "length": len(data), "data": data})
+
+
+@router.post("/snapshot/")
+def write_plot_snapshot_route(project_id: int, db: Session = Depends(get_db)):
+    """Write the plot snapshot of the current models and version, served in snapshot serving mode"""
+    ProjectService(project_id, db).get_project()
+    directory = write_plot_snapshot(db, project_id)
+    if directory is None:
+        raise HTTPException(status_code=404, detail="The project has no plot yet")
+    version = plot_snapshot_cache.get(project_id).version
+    return {"message": "Plot snapshot written successfully", "version": version}
+
+
+@router.get("/pipeline/")
+def get_pipeline_status(project_id: int, db: Session = Depends(get_db)) -> PipelineStatus:
+    """Get the status of the background pipeline of a project"""
+    ProjectService(project_id, db).get_project()
+    return pipeline_runner.ensure(project_id)
+
+
+@router.post("/pipeline/")
+def trigger_pipeline(project_id: int, db: Session = Depends(get_db)) -> PipelineStatus:
+    """Start the background pipeline of a project, reruns it if it is already running"""
+    ProjectService(project_id, db).get_project()
+    return pipeline_runner.trigger(project_id)
 
 
 @router.get("/test/")
@@ -165,189 +442,88 @@ async def setup_test_environment(db: Session = Depends(get_db)):
 def search_sentence_route(
     project_id: int,
     search_query: str,
+    request: Request,
+    response: Response,
     limit: int = 100,
+    format: PlotFormat = "json",
     db: Session = Depends(get_db),
-) -> PlotTable:
-    """Search for sentences in a project"""
-    plots = []
-    ProjectAlias = aliased(Project)
-    SentenceAlias = aliased(Sentence)
-    SegmentAlias = aliased(Segment)
-    DatasetAlias = aliased(Dataset)
-    ReducedEmbeddingAlias = aliased(ReducedEmbedding)
-    EmbeddingAlias = aliased(Embedding)
-    CodeAlias = aliased(Code)
-    ClusterAlias = aliased(Cluster)
-
-    datasets = db.query(DatasetAlias).filter(DatasetAlias.project_id == project_id).all()
-    dataset_ids = [dataset.dataset_id for dataset in datasets]
-    query = (
-        db.query(
-            ClusterAlias,
-            ReducedEmbeddingAlias,
-            EmbeddingAlias,
-            SegmentAlias,
-            SentenceAlias,
-            CodeAlias,
-            ProjectAlias,
-        )
-        .filter(ProjectAlias.project_id == project_id)
-        .filter(SentenceAlias.dataset_id.in_(dataset_ids))
-        .where(SentenceAlias.text_tsv.match(search_query, postgresql_regconfig="english"))
-        .join(
-            ReducedEmbeddingAlias,
-            ClusterAlias.reduced_embedding_id
-            == ReducedEmbeddingAlias.reduced_embedding_id,
-        )
-        .join(
-            EmbeddingAlias,
-            ReducedEmbeddingAlias.embedding_id == EmbeddingAlias.embedding_id,
-        )
-        .join(SegmentAlias, EmbeddingAlias.segment_id == SegmentAlias.segment_id)
-        .join(SentenceAlias, SegmentAlias.sentence_id == SentenceAlias.sentence_id)
-        .join(CodeAlias, SegmentAlias.code_id == CodeAlias.code_id)
-        .join(ProjectAlias, CodeAlias.project_id == ProjectAlias.project_id)
-        .limit(limit)
-    )
-
-    plots = query.all()
-    result_dicts = [
-        {
-            "id": row[3].segment_id,
-            "sentence": row[4].text,
-            "segment": row[3].text,
-            "code": row[5].code_id,
-            "reduced_embedding": {"x": row[1].pos_x, "y": row[1].pos_y},
-            "cluster": row[0].cluster,
-        }
-        for row in plots
-    ]
-    return {"data": result_dicts, "length": len(result_dicts), "limit": limit}
+) -> Union[NormalizedPlotTable, PlotTable]:
+    """Search for sentences in a project, best ranked first"""
+    etag, not_modified = check_project_etag(request, response, db, project_id)
+    if not_modified:
+        return not_modified
+    plots, _ = search_plot(db, project_id, search_query, "sentence", limit=limit)
+    return search_response(plots, limit, format, etag)
 
 
 @router.get("/code/")
 def search_code_route(
-    project_id: int, search_code_id: int, limit: int = 100, db: Session = Depends(get_db)
-) -> PlotTable:
+    project_id: int,
+    search_code_id: int,
+    request: Request,
+    response: Response,
+    limit: int = 100,
+    format: PlotFormat = "json",
+    db: Session = Depends(get_db),
+) -> Union[NormalizedPlotTable, PlotTable]:
     """Search for code in a project"""
-    plots = []
-    ProjectAlias = aliased(Project)
-    SentenceAlias = aliased(Sentence)
-    SegmentAlias = aliased(Segment)
-    DatasetAlias = aliased(Dataset)
-    ReducedEmbeddingAlias = aliased(ReducedEmbedding)
-    EmbeddingAlias = aliased(Embedding)
-    CodeAlias = aliased(Code)
-    ClusterAlias = aliased(Cluster)
-
-    datasets = db.query(DatasetAlias).filter(DatasetAlias.project_id == project_id).all()
-    dataset_ids = [dataset.dataset_id for dataset in datasets]
-    query = (
-        db.query(
-            ClusterAlias,
-            ReducedEmbeddingAlias,
-            EmbeddingAlias,
-            SegmentAlias,
-            SentenceAlias,
-            CodeAlias,
-            ProjectAlias,
-        )
-        .filter(ProjectAlias.project_id == project_id)
-        .filter(SentenceAlias.dataset_id.in_(dataset_ids))
-        .where(CodeAlias.code_id == search_code_id)
-        .join(
-            ReducedEmbeddingAlias,
-            ClusterAlias.reduced_embedding_id
-            == ReducedEmbeddingAlias.reduced_embedding_id,
-        )
-        .join(
-            EmbeddingAlias,
-            ReducedEmbeddingAlias.embedding_id == EmbeddingAlias.embedding_id,
-        )
-        .join(SegmentAlias, EmbeddingAlias.segment_id == SegmentAlias.segment_id)
-        .join(SentenceAlias, SegmentAlias.sentence_id == SentenceAlias.sentence_id)
-        .join(CodeAlias, SegmentAlias.code_id == CodeAlias.code_id)
-        .join(ProjectAlias, CodeAlias.project_id == ProjectAlias.project_id)
-        .limit(limit)
+    etag, not_modified = check_project_etag(request, response, db, project_id)
+    if not_modified:
+        return not_modified
+    plots, count = filter_plot_rows(
+        db, project_id, limit, code_ids=[search_code_id], subtree=False
     )
-
-    plots = query.all()
-    result_dicts = [
-        {
-            "id": row[3].segment_id,
-            "sentence": row[4].text,
-            "segment": row[3].text,
-            "code": row[5].code_id,
-            "reduced_embedding": {"x": row[1].pos_x, "y": row[1].pos_y},
-            "cluster": row[0].cluster,
-        }
-        for row in plots
-    ]
-    return {"data": result_dicts, "length": len(result_dicts), "limit": limit}
+    return search_response(plots, limit, format, etag, count)
 
 
 @router.get("/cluster/")
 def search_clusters_route(
     project_id: int,
     search_cluster_id: int,
+    request: Request,
+    response: Response,
     limit: int = 100,
+    format: PlotFormat = "json",
     db: Session = Depends(get_db),
-) -> PlotTable:
+) -> Union[NormalizedPlotTable, PlotTable]:
     """Search for clusters in a project"""
-    plots = []
-    ProjectAlias = aliased(Project)
-    SentenceAlias = aliased(Sentence)
-    SegmentAlias = aliased(Segment)
-    DatasetAlias = aliased(Dataset)
-    ReducedEmbeddingAlias = aliased(ReducedEmbedding)
-    EmbeddingAlias = aliased(Embedding)
-    CodeAlias = aliased(Code)
-    ClusterAlias = aliased(Cluster)
-
-    datasets = db.query(DatasetAlias).filter(DatasetAlias.project_id == project_id).all()
-    dataset_ids = [dataset.dataset_id for dataset in datasets]
-    query = (
-        db.query(
-            ClusterAlias,
-            ReducedEmbeddingAlias,
-            EmbeddingAlias,
-            SegmentAlias,
-            SentenceAlias,
-            CodeAlias,
-            ProjectAlias,
-        )
-        .filter(ProjectAlias.project_id == project_id)
-        .filter(SentenceAlias.dataset_id.in_(dataset_ids))
-        .where(search_cluster_id == ClusterAlias.cluster)
-        .join(
-            ReducedEmbeddingAlias,
-            ClusterAlias.reduced_embedding_id
-            == ReducedEmbeddingAlias.reduced_embedding_id,
-        )
-        .join(
-            EmbeddingAlias,
-            ReducedEmbeddingAlias.embedding_id == EmbeddingAlias.embedding_id,
-        )
-        .join(SegmentAlias, EmbeddingAlias.segment_id == SegmentAlias.segment_id)
-        .join(SentenceAlias, SegmentAlias.sentence_id == SentenceAlias.sentence_id)
-        .join(CodeAlias, SegmentAlias.code_id == CodeAlias.code_id)
-        .join(ProjectAlias, CodeAlias.project_id == ProjectAlias.project_id)
-        .limit(limit)
-    )
+    etag, not_modified = check_project_etag(request, response, db, project_id)
+    if not_modified:
+        return not_modified
+    plots, count = filter_plot_rows(db, project_id, limit, clusters=[search_cluster_id])
+    return search_response(plots, limit, format, etag, count)
 
-    plots = query.all()
-    result_dicts = [
-        {
-            "id": row[3].segment_id,
-            "sentence": row[4].text,
-            "segment": row[3].text,
-            "code": row[5].code_id,
-            "reduced_embedding": {"x": row[1].pos_x, "y": row[1].pos_y},
-            "cluster": row[0].cluster,
-        }
-        for row in plots
-    ]
-    return {"data": result_dicts, "length": len(result_dicts), "limit": limit}
+
+@router.get("/filter/")
+def filter_plot_route(
+    project_id: int,
+    request: Request,
+    response: Response,
+    code_id: List[int] = Query(None),
+    cluster: List[int] = Query(None),
+    dataset_id: List[int] = Query(None),
+    subtree: bool = True,
+    limit: int = 100,
+    format: PlotFormat = "json",
+    db: Session = Depends(get_db),
+) -> Union[NormalizedPlotTable, PlotTable]:
+    """Filter the plot by codes (with their subcodes unless subtree is false), clusters and datasets
+
+    Values of one filter are OR-ed, different filters are AND-ed, count is the number of all matches.
+    """
+    etag, not_modified = check_project_etag(request, response, db, project_id)
+    if not_modified:
+        return not_modified
+    plots, count = filter_plot_rows(
+        db,
+        project_id,
+        limit,
+        code_ids=code_id,
+        clusters=cluster,
+        dataset_ids=dataset_id,
+        subtree=subtree,
+    )
+    return search_response(plots, limit, format, etag, count)
 
 
 @router.get("/code/{code_id}/search")
@@ -355,329 +531,221 @@ def search_code_segments_route(
     project_id: int,
     code_id: int,
     search_segment_query: str,
+    request: Request,
+    response: Response,
     limit: int = 100,
+    format: PlotFormat = "json",
     db: Session = Depends(get_db),
-) -> PlotTable:
-    """Search for segments text in a code"""
-    plots = []
-    ProjectAlias = aliased(Project)
-    SentenceAlias = aliased(Sentence)
-    SegmentAlias = aliased(Segment)
-    DatasetAlias = aliased(Dataset)
-    ReducedEmbeddingAlias = aliased(ReducedEmbedding)
-    EmbeddingAlias = aliased(Embedding)
-    CodeAlias = aliased(Code)
-    ClusterAlias = aliased(Cluster)
-
-    datasets = db.query(DatasetAlias).filter(DatasetAlias.project_id == project_id).all()
-    dataset_ids = [dataset.dataset_id for dataset in datasets]
-    query = (
-        db.query(
-            ClusterAlias,
-            ReducedEmbeddingAlias,
-            EmbeddingAlias,
-            SegmentAlias,
-            SentenceAlias,
-            CodeAlias,
-            ProjectAlias,
-        )
-        .filter(ProjectAlias.project_id == project_id)
-        .filter(SentenceAlias.dataset_id.in_(dataset_ids))
-        .where(CodeAlias.code_id == code_id)
-        .where(
-            SegmentAlias.text_tsv.match(
-                search_segment_query, postgresql_regconfig="english"
-            )
-        )
-        .join(
-            ReducedEmbeddingAlias,
-            ClusterAlias.reduced_embedding_id
-            == ReducedEmbeddingAlias.reduced_embedding_id,
-        )
-        .join(
-            EmbeddingAlias,
-            ReducedEmbeddingAlias.embedding_id == EmbeddingAlias.embedding_id,
-        )
-        .join(SegmentAlias, EmbeddingAlias.segment_id == SegmentAlias.segment_id)
-        .join(SentenceAlias, SegmentAlias.sentence_id == SentenceAlias.sentence_id)
-        .join(CodeAlias, SegmentAlias.code_id == CodeAlias.code_id)
-        .join(ProjectAlias, CodeAlias.project_id == ProjectAlias.project_id)
-        .limit(limit)
+) -> Union[NormalizedPlotTable, PlotTable]:
+    """Search for segments text in a code, best ranked first"""
+    etag, not_modified = check_project_etag(request, response, db, project_id)
+    if not_modified:
+        return not_modified
+    plots, _ = search_plot(
+        db, project_id, search_segment_query, code_ids=[code_id], subtree=False, limit=limit
     )
-
-    plots = query.all()
-    result_dicts = [
-        {
-            "id": row[3].segment_id,
-            "sentence": row[4].text,
-            "segment": row[3].text,
-            "code": row[5].code_id,
-            "reduced_embedding": {"x": row[1].pos_x, "y": row[1].pos_y},
-            "cluster": row[0].cluster,
-        }
-        for row in plots
-    ]
-    return {"data": result_dicts, "length": len(result_dicts), "limit": limit}
+    return search_response(plots, limit, format, etag)
 
 
 @router.get("/segment")
 def search_segment_route(
     project_id: int,
     search_segment_query: str,
+    request: Request,
+    response: Response,
     limit: int = 100,
+    format: PlotFormat = "json",
     db: Session = Depends(get_db),
-) -> PlotTable:
-    """Search for segments in a project"""
-    plots = []
-    ProjectAlias = aliased(Project)
-    SentenceAlias = aliased(Sentence)
-    SegmentAlias = aliased(Segment)
-    DatasetAlias = aliased(Dataset)
-    ReducedEmbeddingAlias = aliased(ReducedEmbedding)
-    EmbeddingAlias = aliased(Embedding)
-    CodeAlias = aliased(Code)
-    ClusterAlias = aliased(Cluster)
-
-    datasets = db.query(DatasetAlias).filter(DatasetAlias.project_id == project_id).all()
-    dataset_ids = [dataset.dataset_id for dataset in datasets]
-    search_segment_query = (
-        db.query(
-            ClusterAlias,
-            ReducedEmbeddingAlias,
-            EmbeddingAlias,
-            SegmentAlias,
-            SentenceAlias,
-            CodeAlias,
-            ProjectAlias,
-        )
-        .filter(ProjectAlias.project_id == project_id)
-        .filter(SentenceAlias.dataset_id.in_(dataset_ids))
-        .where(
-            SegmentAlias.text_tsv.match(
-                search_segment_query, postgresql_regconfig="english"
-            )
-        )
-        .join(
-            ReducedEmbeddingAlias,
-            ClusterAlias.reduced_embedding_id
-            == ReducedEmbeddingAlias.reduced_embedding_id,
-        )
-        .join(
-            EmbeddingAlias,
-            ReducedEmbeddingAlias.embedding_id == EmbeddingAlias.embedding_id,
-        )
-        .join(SegmentAlias, EmbeddingAlias.segment_id == SegmentAlias.segment_id)
-        .join(SentenceAlias, SegmentAlias.sentence_id == SentenceAlias.sentence_id)
-        .join(CodeAlias, SegmentAlias.code_id == CodeAlias.code_id)
-        .join(ProjectAlias, CodeAlias.project_id == ProjectAlias.project_id)
-        .limit(limit)
+) -> Union[NormalizedPlotTable, PlotTable]:
+    """Search for segments in a project, best ranked first"""
+    etag, not_modified = check_project_etag(request, response, db, project_id)
+    if not_modified:
+        return not_modified
+    plots, _ = search_plot(db, project_id, search_segment_query, limit=limit)
+    return search_response(plots, limit, format, etag)
+
+
+@router.get("/search/")
+def search_plot_route(
+    project_id: int,
+    request: Request,
+    response: Response,
+    query: Optional[str] = None,
+    field: SearchField = "segment",
+    code_id: List[int] = Query(None),
+    cluster: List[int] = Query(None),
+    dataset_id: List[int] = Query(None),
+    subtree: bool = True,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+) -> SearchResults:
+    """Search the segment (or sentence) texts, combined with code, cluster and dataset filters
+
+    Results are ordered by ts_rank (by segment id without a query), pass next_cursor as cursor to get
+    the following page. Highlights are the character offsets of the matches in the searched text.
+    """
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    etag, not_modified = check_project_etag(request, response, db, project_id)
+    if not_modified:
+        return not_modified
+    plots, next_cursor = search_plot(
+        db,
+        project_id,
+        query,
+        field,
+        code_ids=code_id,
+        clusters=cluster,
+        dataset_ids=dataset_id,
+        subtree=subtree,
+        limit=limit,
+        cursor=cursor,
+    )
+    data = search_rows_to_dicts(db, plots, query, field)
+    return FastJSONResponse(
+        {"length": len(data), "limit": limit, "next_cursor": next_cursor, "data": data},
+        headers=etag_headers(etag),
     )
 
-    plots = search_segment_query.all()
-    result_dicts = [
-        {
-            "id": row[3].segment_id,
-            "sentence": row[4].text,
-            "segment": row[3].text,
-            "code": row[5].code_id,
-            "reduced_embedding": {"x": row[1].pos_x, "y": row[1].pos_y},
-            "cluster": row[0].cluster,
-        }
-        for row in plots
-    ]
-    return {"data": result_dicts, "length": len(result_dicts), "limit": limit}
+
+@router.get("/autocomplete/")
+def autocomplete_route(
+    project_id: int,
+    query: str,
+    kind: CompletionKind = "segment",
+    k: int = 10,
+    db: Session = Depends(get_db),
+) -> Completions:
+    """Complete a partial segment or code text, prefixes of any word match and typos are tolerated
+
+    Completions are the distinct texts with their number of segments, prefix matches first.
+    """
+    if not 1 <= k <= AUTOCOMPLETE_MAX_K:
+        raise HTTPException(status_code=400, detail=f"k must be between 1 and {AUTOCOMPLETE_MAX_K}")
+    data = autocomplete_cache.get(db, project_id, kind).complete(query, k)
+    return FastJSONResponse({"kind": kind, "length": len(data), "data": data})
 
 
 @router.get("/exportToFiles/")
-async def export_plot_endpoint(
+def export_plot_endpoint(
     project_id: int,
+    formats: List[ExportFormat] = Query(["json", "csv"]),
     db: Session = Depends(get_db),
 ):
-    """Extract plot data to files"""
-    plots = await get_plot_endpoint(project_id=project_id, all=True, db=db)
-    extract_plot(project_id=project_id, plots=plots["data"])
-    return {"message": "Plot data extracted successfully"}
+    """Extract plot data to one file per format in the plots folder of the project"""
+    count, paths = export_plot(db, project_id, formats)
+    return {"message": "Plot data extracted successfully", "rows": count, "files": paths}
+
+
+@router.get("/export/")
+def get_export_status(project_id: int, db: Session = Depends(get_db)) -> Optional[ExportStatus]:
+    """Get the progress of the last background export of a project, None if there was none"""
+    ProjectService(project_id, db).get_project()
+    return export_runner.get_status(project_id)
+
+
+@router.post("/export/")
+def start_export(
+    project_id: int,
+    formats: List[ExportFormat] = Query(["csv", "jsonl"]),
+    db: Session = Depends(get_db),
+) -> ExportStatus:
+    """Export the plot of a project in the background, poll GET /export/ for the progress"""
+    ProjectService(project_id, db).get_project()
+    return export_runner.start(project_id, formats)
 
 
 @router.get("/stats/project/")
-async def project_endpoint(project_id: int, db: Session = Depends(get_db)):
-    """Get project statistics"""
+async def project_endpoint(
+    project_id: int, request: Request, response: Response, db: Session = Depends(get_db)
+):
+    """Get project statistics, read from the maintained project counters
+
+    Embedding and model writes change the counters without a new project version,
+    so the counters are part of the ETag.
+    """
     async with db_lock:
         project = db.query(Project).filter(Project.project_id == project_id).first()
-        if project:
-            dataset_count = len(project.datasets)
-            code_count = len(project.codes)
-            model_count = len(project.models)
-            sentence_count = (
-                db.query(Sentence)
-                .join(Dataset)
-                .filter(Dataset.project_id == project_id)
-                .count()
-            )
-            segment_count = (
-                db.query(Segment)
-                .join(Sentence)
-                .join(Dataset)
-                .filter(Dataset.project_id == project_id)
-                .count()
-            )
-            embedding_count = (
-                db.query(Embedding)
-                .join(Segment)
-                .join(Sentence)
-                .join(Dataset)
-                .filter(Dataset.project_id == project_id)
-                .count()
-            )
-
-            result = {
-                "project_id": project.project_id,
-                "project_name": project.project_name,
-                "dataset_count": dataset_count,
-                "code_count": code_count,
-                "model_count": model_count,
-                "sentence_count": sentence_count,
-                "segment_count": segment_count,
-                "embedding_count": embedding_count,
-            }
+        if not project:
+            return {"error": f"Project with ID {project_id} not found."}
+        result = {"project_id": project.project_id, "project_name": project.project_name}
+        result.update(get_project_counts(db, project_id))
+    etag, not_modified = check_project_etag(
+        request, response, db, project_id, *result.values()
+    )
+    if not_modified:
+        return not_modified
+    return result
 
-            return result
 
-        else:
-            return {"error": f"Project with ID {project_id} not found."}
+@router.post("/stats/project/reconcile/")
+async def reconcile_project_endpoint(project_id: int, db: Session = Depends(get_db)):
+    """Recount the project counters, returns the counters that had drifted by how much"""
+    async with db_lock:
+        ProjectService(project_id, db).get_project()
+        return {"project_id": project_id, "drift": reconcile_project_counts(db, project_id)}
 
 
 @router.get("/stats/code/")
-async def stats_endpoint(project_id: int, db: Session = Depends(get_db)):
-    """Get code statistics for a project"""
+async def stats_endpoint(
+    project_id: int,
+    request: Request,
+    response: Response,
+    subtree: bool = False,
+    db: Session = Depends(get_db),
+):
+    """Get code statistics for a project: segment counts, plot centroids and bounding boxes
+
+    With subtree, every code also gets the statistics of itself and all of its descendants.
+    """
+    etag, not_modified = check_project_etag(request, response, db, project_id)
+    if not_modified:
+        return not_modified
     async with db_lock:
         project = db.query(Project).filter(Project.project_id == project_id).first()
-        if project:
-            project_service: ProjectService = ProjectService(project_id, db)
-            model_entry = project_service.get_model_entry("cluster_config")
-            reduced_model_entry = project_service.get_model_entry("reduction_config")
-            embedding_model_entry = project_service.get_model_entry("embedding_config")
-            code_segments_count = {}
-            code_segments_count["codes"] = []
-            if project.codes:
-                print(project.codes)
-                for code in project.codes:
-                    average_position = (
-                        db.query(
-                            func.avg(ReducedEmbedding.pos_x).label('avg_x'),
-                            func.avg(ReducedEmbedding.pos_y).label('avg_y')
-                        )
-                        .join(Embedding, Embedding.embedding_id == ReducedEmbedding.embedding_id)
-                        .join(Segment, Segment.segment_id == Embedding.segment_id)
-                        .filter(
-                            Segment.code_id == code.code_id,
-                            Embedding.model_id == embedding_model_entry.model_id,
-                            ReducedEmbedding.model_id == reduced_model_entry.model_id
-                        )
-                        .one()
-                    )
-                    code_segments_count["codes"].append({
-                        "code_id": code.code_id,
-                        "text": code.text,
-                        "segment_count": len(code.segments),
-                        "average_position": {
-                            "x": average_position.avg_x or 0,
-                            "y": average_position.avg_y or 0
-                        },
-                    })
-            result = {
-                "code_segments_count": code_segments_count,
-            }
-
-            return result
-
-        else:
+        if not project:
             return {"error": f"Project with ID {project_id} not found."}
+        code_stats = stats_cache.get(
+            db, project_id, ("code", subtree), lambda: compute_code_stats(db, project_id, subtree)
+        )
+    return FastJSONResponse({"code_segments_count": code_stats}, headers=etag_headers(etag))
 
 
 @router.get("/stats/cluster/")
-async def cluster_endpoint(project_id: int, db: Session = Depends(get_db)):
-    """Get cluster statistics for a project"""
+async def cluster_endpoint(
+    project_id: int, request: Request, response: Response, db: Session = Depends(get_db)
+):
+    """Get cluster statistics of the active cluster model: size, centroid, dominant code and purity"""
+    etag, not_modified = check_project_etag(request, response, db, project_id)
+    if not_modified:
+        return not_modified
     async with db_lock:
         project = db.query(Project).filter(Project.project_id == project_id).first()
-        if project:
-            clusters = (
-                db.query(Cluster)
-                .join(ReducedEmbedding)
-                .join(Embedding)
-                .join(Segment)
-                .join(Sentence)
-                .join(Dataset)
-                .filter(Dataset.project_id == project_id)
-                .all()
-            )
-
-            cluster_count = len(clusters)
-            unique_clusters = set()
-            cluster_segments_count = {}
-
-            for cluster in clusters:
-                cluster_value = cluster.cluster
-                if cluster_value is not None:
-                    unique_clusters.add(cluster_value)
-                    if cluster_value not in cluster_segments_count:
-                        cluster_segments_count[cluster_value] = 1
-                    else:
-                        cluster_segments_count[cluster_value] += 1
-
-            unique_cluster_count = len(unique_clusters)
-
-            # Convert cluster_segments_count to a list of dictionaries for JSON response
-            cluster_info = [
-                {"cluster_value": cluster_value, "segment_count": segment_count}
-                for cluster_value, segment_count in cluster_segments_count.items()
-            ]
-
-            return {
-                "project_name": project.project_name,
-                "project_id": project.project_id,
-                "cluster_count": cluster_count,
-                "unique_cluster_count": unique_cluster_count,
-                "cluster_info": cluster_info,
-            }
-        else:
+        if not project:
             return {"error": f"Project with ID {project_id} not found."}
+        cluster_stats = stats_cache.get(
+            db, project_id, ("cluster",), lambda: compute_cluster_stats(db, project_id)
+        )
+        result = {"project_name": project.project_name, "project_id": project.project_id}
+    result.update(cluster_stats)
+    return FastJSONResponse(result, headers=etag_headers(etag))
 
 
 @router.get("/recalculate/")
-async def recalculate_databases(project_id: int, db: Session = Depends(get_db)):
-    """Recalculate all databases for a project"""
-    project = db.query(Project).filter(Project.project_id == project_id).first()
+def recalculate_databases(project_id: int, db: Session = Depends(get_db)):
+    """Recalculate the reduced embeddings and clusters of a project in the background pipeline"""
     project_service = ProjectService(project_id, db)
-    cluster_model = project_service.get_model_entry("cluster_config")
-    reduction_model = project_service.get_model_entry("reduction_config")
-
-    if project:
-        # Delete all clusters
-        db.query(Cluster).filter(Cluster.model_id == cluster_model.model_id).delete()
-        # Delete all reduced embeddings
-        db.query(ReducedEmbedding).filter(
-            ReducedEmbedding.model_id == reduction_model.model_id
-        ).delete()
-        # Delete models
-        db.query(Model).filter(Model.model_id == cluster_model.model_id).delete()
-        db.query(Model).filter(Model.model_id == reduction_model.model_id).delete()
-
-        # Commit changes
-        db.commit()
-
-        # project_service.delete_model(cluster_model.model_hash)
-        project_service.delete_model(reduction_model.model_hash)
-
-        async with db_lock:
-            extract_embeddings_endpoint(project_id, db=db)
-            extract_embeddings_reduced_endpoint(project_id, db=db)
-            extract_clusters_endpoint(project_id, db=db)
-            db.commit()
-
-        return {"message": "Databases recalculated successfully"}
-    else:
-        return {"error": f"Project with ID {project_id} not found."}
+    project_service.get_project()
+    if (
+        project_service.get_model_entry("reduction_config") is None
+        or project_service.get_model_entry("cluster_config") is None
+    ):
+        raise HTTPException(
+            status_code=409, detail="The pipeline has not extracted the plot of the project yet"
+        )
+    pipeline = pipeline_runner.trigger(project_id, reset=True)
+    return {"message": "Databases recalculation started", "pipeline": pipeline}
 
 
 @router.get("/segment/{segment_id}")
@@ -701,6 +769,8 @@ async def update_segment_plot(
         if segment:
             segment.code_id = code_id
             db.add(segment)
+            update_plot_codes(db, code_id, PlotPoint.segment_id == segment_id)
+            record_changes(db, project_id, bump_version(db, project_id), [segment_id])
             db.commit()
             db.refresh(segment)
             return {"message": "Segment plot updated successfully"}
@@ -715,5 +785,7 @@ async def delete_segment_plot(
         segment = db.query(Segment).filter(Segment.segment_id == segment_id).first()
         if segment:
             db.delete(segment)
+            record_changes(db, project_id, bump_version(db, project_id), [segment_id])
             db.commit()
+            reset_counts(db, project_id)
             return {"message": "Segment plot deleted successfully"}
@@ -1,7 +1,14 @@
-from typing import List, Optional
+from typing import Dict, List, Literal, Optional
 
 from pydantic import BaseModel
 
+from pipeline.schemas import PipelineStatus
+
+PlotFormat = Literal["json", "normalized", "binary", "ndjson"]
+SearchField = Literal["segment", "sentence"]
+CompletionKind = Literal["segment", "code"]
+ExportFormat = Literal["csv", "json", "jsonl", "parquet"]
+
 
 class Reduced_embedding(BaseModel):
     x: float
@@ -32,8 +39,210 @@ class PlotTable(BaseModel):
     limit: Optional[int]
     page: Optional[int]
     page_size: Optional[int]
+    next_cursor: Optional[int]
+    version: Optional[int]
     data: List[PlotEntry]
+    pipeline: Optional[PipelineStatus]
+
+
+class NormalizedPlotEntry(BaseModel):
+    id: int
+    sentence_id: int
+    segment: str
+    start_position: int
+    code: int
+    reduced_embedding: Optional[Reduced_embedding]
+    cluster: Optional[int]
+
+
+class NormalizedPlotTable(BaseModel):
+    length: int
+    count: Optional[int]
+    limit: Optional[int]
+    page: Optional[int]
+    page_size: Optional[int]
+    next_cursor: Optional[int]
+    version: Optional[int]
+    data: List[NormalizedPlotEntry]
+    sentences: Dict[int, str]
+    pipeline: Optional[PipelineStatus]
+
+
+class PlotChanges(BaseModel):
+    version: int
+    full_refresh: bool
+    data: List[PlotEntry]
+    deleted: List[int]
+
+
+class SentenceTexts(BaseModel):
+    sentences: Dict[int, str]
+
+
+class TilePoint(BaseModel):
+    id: int
+    code: int
+    cluster: Optional[int]
+    reduced_embedding: Reduced_embedding
+
+
+class PlotExtent(BaseModel):
+    min_x: float
+    min_y: float
+    size: float
+    count: int
+
+
+class PlotTile(BaseModel):
+    bounds: List[float]
+    count: int
+    length: int
+    data: List[TilePoint]
+
+
+class SelectionCircle(BaseModel):
+    x: float
+    y: float
+    radius: float
+
+
+class SelectionArea(BaseModel):
+    polygon: Optional[List[List[float]]]
+    circle: Optional[SelectionCircle]
+
+
+class SelectedPoint(BaseModel):
+    id: int
+    code: int
+    cluster: Optional[int]
+
+
+class PlotSelection(BaseModel):
+    length: int
+    data: List[SelectedPoint]
+
+
+class NeighborPoint(TilePoint):
+    distance: float
+
+
+class PlotNeighbors(BaseModel):
+    id: int
+    length: int
+    data: List[NeighborPoint]
+
+
+class DensityBin(BaseModel):
+    x: int
+    y: int
+    count: int
+    codes: Dict[int, int]
+    clusters: Dict[int, int]
+
+
+class DensityTile(BaseModel):
+    level: int
+    bin_size: float
+    min_x: float
+    min_y: float
+    bins: List[DensityBin]
+
+
+class BoundingBox(BaseModel):
+    min_x: float
+    min_y: float
+    max_x: float
+    max_y: float
+
+
+class PositionStats(BaseModel):
+    segment_count: int
+    point_count: int
+    average_position: Reduced_embedding
+    # None if no segment of the code has a plot position
+    bounding_box: Optional[BoundingBox]
+
+
+class CodeStats(PositionStats):
+    code_id: int
+    text: str
+    parent_code_id: Optional[int]
+    # the code and all of its descendants, with subtree only
+    subtree: Optional[PositionStats]
+
+
+class CodeStatsList(BaseModel):
+    codes: List[CodeStats]
+
+
+class CodeStatsResponse(BaseModel):
+    code_segments_count: CodeStatsList
+
+
+class ClusterInfo(BaseModel):
+    cluster_value: int
+    segment_count: int
+    average_position: Reduced_embedding
+    dominant_code: Optional[int]
+    dominant_code_text: Optional[str]
+    purity: float
+
+
+class ClusterStats(BaseModel):
+    project_id: int
+    project_name: str
+    cluster_model_id: Optional[int]
+    cluster_count: int
+    unique_cluster_count: int
+    cluster_info: List[ClusterInfo]
+
+
+class ProjectStats(BaseModel):
+    project_id: int
+    project_name: str
+    dataset_count: int
+    code_count: int
+    model_count: int
+    sentence_count: int
+    segment_count: int
+    embedding_count: int
+
+
+class SearchEntry(PlotEntry):
+    dataset: int
+    rank: Optional[float]
+    # [start, end) character offsets of the matches in the searched text
+    highlights: List[List[int]]
+
+
+class SearchResults(BaseModel):
+    length: int
+    limit: int
+    next_cursor: Optional[str]
+    data: List[SearchEntry]
+
+
+class Completion(BaseModel):
+    text: str
+    count: int
+    # 1 for prefix matches, the share of matching trigrams for typo matches
+    score: float
+
+
+class Completions(BaseModel):
+    kind: CompletionKind
+    length: int
+    data: List[Completion]
 
 
 class DataPlotResponse(BaseModel):
     data: PlotEntry
+
+
+class ExportStatus(BaseModel):
+    status: Literal["running", "done", "failed"]
+    formats: List[ExportFormat]
+    rows: int
+    total: Optional[int]
+    files: Dict[str, str]
+    error: Optional[str]
@@ -0,0 +1,169 @@
+"""
+This module is the full-text search over the plot rows of a project: a websearch query
+matched against the GIN-indexed tsvector of the segments or sentences, ordered by ts_rank
+and combined with code, cluster and dataset filters on PlotPoint. Pages continue after a
+(rank, segment id) cursor instead of an offset.
+"""
+
+from typing import List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import Float, and_, cast, func, literal, or_, select
+from sqlalchemy.orm import Session
+
+from db.models import Code, PlotPoint, Segment, Sentence
+from plot.service import get_plot_model_ids, plot_row_to_dict, plot_rows_query
+from project.service import ProjectService
+
+SEARCH_CONFIG = "english"
+# control characters do not occur in the texts, so they mark the ts_headline matches
+HIGHLIGHT_START, HIGHLIGHT_STOP = "\x02", "\x03"
+HIGHLIGHT_OPTIONS = (
+    f"HighlightAll=true, StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}"
+)
+
+SEARCH_FIELDS = {"segment": Segment, "sentence": Sentence}
+
+
+def encode_search_cursor(rank: Optional[float], segment_id: int) -> str:
+    return str(segment_id) if rank is None else f"{rank!r}:{segment_id}"
+
+
+def decode_search_cursor(cursor: str, ranked: bool):
+    """The (rank, segment id) of a search cursor, rank is None for unranked searches"""
+    try:
+        if not ranked:
+            return None, int(cursor)
+        rank, segment_id = cursor.split(":")
+        return float(rank), int(segment_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid search cursor")
+
+
+def code_subtree(project_id: int, code_ids: List[int]):
+    """Select the given codes of a project and all of their descendants"""
+    tree = (
+        select(Code.code_id)
+        .where(Code.project_id == project_id, Code.code_id.in_(code_ids))
+        .cte("code_tree", recursive=True)
+    )
+    tree = tree.union_all(
+        select(Code.code_id).where(Code.parent_code_id == tree.c.code_id)
+    )
+    return select(tree.c.code_id)
+
+
+def search_plot(
+    db: Session,
+    project_id: int,
+    query: Optional[str] = None,
+    field: str = "segment",
+    code_ids: List[int] = None,
+    clusters: List[int] = None,
+    dataset_ids: List[int] = None,
+    subtree: bool = True,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+):
+    """Get one page of plot rows matching the query and the filters, best ranked first
+
+    Values of one filter are OR-ed, different filters are AND-ed. Without a query the rows
+    are ordered by segment id. Returns the rows (with a rank column) and the cursor of the
+    next page.
+    """
+    reduction_model_id, cluster_model_id = get_plot_model_ids(
+        ProjectService(project_id, db)
+    )
+    if reduction_model_id is None:
+        return [], None
+    rows = plot_rows_query(db, reduction_model_id, cluster_model_id, with_dataset=True)
+
+    if code_ids:
+        codes = code_subtree(project_id, code_ids) if subtree else code_ids
+        rows = rows.filter(PlotPoint.code_id.in_(codes))
+    if clusters:
+        rows = rows.filter(
+            PlotPoint.cluster_model_id == cluster_model_id,
+            PlotPoint.cluster.in_(clusters),
+        )
+    if dataset_ids:
+        rows = rows.filter(PlotPoint.dataset_id.in_(dataset_ids))
+
+    ranked = bool(query and query.strip())
+    if ranked:
+        text_tsv = SEARCH_FIELDS[field].text_tsv
+        tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, query)
+        # ts_rank is a real, which never equals the float8 rank of a cursor
+        rank = cast(func.ts_rank(text_tsv, tsquery), Float(53))
+        rows = rows.add_columns(rank.label("rank")).filter(text_tsv.op("@@")(tsquery))
+        order = (rank.desc(), PlotPoint.segment_id)
+    else:
+        rank = None
+        rows = rows.add_columns(literal(None).label("rank"))
+        order = (PlotPoint.segment_id,)
+
+    if cursor is not None:
+        cursor_rank, cursor_id = decode_search_cursor(cursor, ranked)
+        after_id = PlotPoint.segment_id > cursor_id
+        if ranked:
+            after_id = or_(rank < cursor_rank, and_(rank == cursor_rank, after_id))
+        rows = rows.filter(after_id)
+
+    rows = rows.order_by(*order).limit(limit).all()
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = encode_search_cursor(rows[-1].rank, rows[-1].id)
+    return rows, next_cursor
+
+
+def parse_highlights(headline: str):
+    """Offsets [start, end) of the marked matches of a ts_headline in the plain text"""
+    offsets, position, start = [], 0, None
+    for char in headline:
+        if char == HIGHLIGHT_START:
+            start = position
+        elif char == HIGHLIGHT_STOP:
+            if start is not None:
+                offsets.append([start, position])
+            start = None
+        else:
+            position += 1
+    return offsets
+
+
+def get_highlights(
+    db: Session, segment_ids: List[int], query: str, field: str = "segment"
+):
+    """Match offsets in the searched text per segment id, computed for one page"""
+    if not segment_ids or not (query and query.strip()):
+        return {}
+    model = SEARCH_FIELDS[field]
+    headline = func.ts_headline(
+        SEARCH_CONFIG,
+        model.text,
+        func.websearch_to_tsquery(SEARCH_CONFIG, query),
+        HIGHLIGHT_OPTIONS,
+    )
+    rows = db.query(Segment.segment_id, headline).filter(
+        Segment.segment_id.in_(segment_ids)
+    )
+    if model is Sentence:
+        rows = rows.join(Sentence, Segment.sentence_id == Sentence.sentence_id)
+    return {segment_id: parse_highlights(text) for segment_id, text in rows}
+
+
+def search_rows_to_dicts(db: Session, rows, query: str, field: str = "segment"):
+    """Convert search rows to plot entry dicts with dataset, rank and highlights"""
+    highlights = get_highlights(db, [row.id for row in rows], query, field)
+    entries = []
+    for row in rows:
+        entry = plot_row_to_dict(row)
+        entry.update(
+            {
+                "dataset": row.dataset,
+                "rank": row.rank,
+                "highlights": highlights.get(row.id, []),
+            }
+        )
+        entries.append(entry)
+    return entries
@@ -0,0 +1,191 @@
+"""
+This module provides the shared plot row query used by the plot, search and cluster
+routes. It selects only the scalar columns of a plot point, so embedding values and ORM
+objects are never loaded.
+"""
+
+from sqlalchemy import case, literal
+from sqlalchemy.orm import Session
+
+from db.changes import get_changed_segments
+from db.models import Dataset, PlotPoint, Segment, Sentence
+from db.session import get_engine
+from project.service import ProjectService
+
+PLOT_STREAM_CHUNK_SIZE = 5000
+
+
+def get_plot_model_ids(project: ProjectService):
+    """Model ids of the active reduction and cluster model, None if not extracted yet"""
+    reduction_entry = project.get_model_entry("reduction_config")
+    cluster_entry = project.get_model_entry("cluster_config")
+    return (
+        reduction_entry.model_id if reduction_entry else None,
+        cluster_entry.model_id if cluster_entry else None,
+    )
+
+
+def plot_rows_query(
+    db: Session,
+    reduction_model_id: int,
+    cluster_model_id: int = None,
+    with_text: bool = True,
+    only_clustered: bool = False,
+    with_dataset: bool = False,
+):
+    """Query plot rows as tuples with the labels id, code, x, y, cluster
+    (and sentence_id, sentence, segment, start_position with text, dataset with dataset)
+
+    Reads the denormalized PlotPoint table, Segment and Sentence are only joined for the
+    texts. Points without a cluster of the given cluster model have cluster None unless
+    only_clustered is set.
+    """
+    columns = [PlotPoint.segment_id.label("id")]
+    if with_text:
+        columns += [
+            PlotPoint.sentence_id.label("sentence_id"),
+            Sentence.text.label("sentence"),
+            Segment.text.label("segment"),
+            Segment.start_position.label("start_position"),
+        ]
+    columns += [
+        PlotPoint.code_id.label("code"),
+        PlotPoint.pos_x.label("x"),
+        PlotPoint.pos_y.label("y"),
+    ]
+    if with_dataset:
+        columns.append(PlotPoint.dataset_id.label("dataset"))
+    if cluster_model_id is None:
+        columns.append(literal(None).label("cluster"))
+    else:
+        columns.append(
+            case(
+                (PlotPoint.cluster_model_id == cluster_model_id, PlotPoint.cluster)
+            ).label("cluster")
+        )
+
+    query = db.query(*columns).select_from(PlotPoint)
+    if with_text:
+        query = query.join(Segment, PlotPoint.segment_id == Segment.segment_id).join(
+            Sentence, PlotPoint.sentence_id == Sentence.sentence_id
+        )
+    query = query.filter(
+        PlotPoint.reduction_model_id == reduction_model_id,
+        PlotPoint.code_id.isnot(None),
+    )
+    if only_clustered:
+        query = query.filter(PlotPoint.cluster_model_id == cluster_model_id)
+    return query
+
+
+def plot_row_to_dict(row):
+    """Convert a plot row (with text) to a plot entry dict"""
+    return {
+        "id": row.id,
+        "sentence": row.sentence,
+        "segment": row.segment,
+        "start_position": row.start_position,
+        "code": row.code,
+        "reduced_embedding": {"x": row.x, "y": row.y},
+        "cluster": row.cluster,
+    }
+
+
+def plot_rows_to_dicts(rows):
+    """Convert plot rows (with text) to plot entry dicts"""
+    return [plot_row_to_dict(row) for row in rows]
+
+
+def stream_plot_rows(
+    reduction_model_id: int, cluster_model_id: int = None, with_dataset: bool = False
+):
+    """Yield all plot rows (with text) by segment id, in chunks of a server-side cursor
+
+    Runs on its own session, so the rows can be consumed after the request session is
+    released.
+    """
+    db = Session(bind=get_engine())
+    try:
+        query = (
+            plot_rows_query(
+                db, reduction_model_id, cluster_model_id, with_dataset=with_dataset
+            )
+            .order_by(PlotPoint.segment_id)
+            .yield_per(PLOT_STREAM_CHUNK_SIZE)
+        )
+        yield from query
+    finally:
+        db.close()
+
+
+def plot_rows_to_normalized(rows):
+    """Convert plot rows (with text) to points referencing a sentence dictionary"""
+    sentences = {}
+    points = []
+    for row in rows:
+        sentences[row.sentence_id] = row.sentence
+        points.append(
+            {
+                "id": row.id,
+                "sentence_id": row.sentence_id,
+                "segment": row.segment,
+                "start_position": row.start_position,
+                "code": row.code,
+                "reduced_embedding": {"x": row.x, "y": row.y},
+                "cluster": row.cluster,
+            }
+        )
+    return points, sentences
+
+
+def get_plot_changes(db: Session, project_id: int, since: int):
+    """Get the plot entries changed after version since and the ids of removed points
+
+    full_refresh is set if the change log no longer reaches back to since.
+    """
+    version, segment_ids = get_changed_segments(db, project_id, since)
+    changes = {
+        "version": version,
+        "full_refresh": segment_ids is None,
+        "data": [],
+        "deleted": [],
+    }
+    if not segment_ids:
+        return changes
+    rows = get_plot_rows_by_ids(db, project_id, segment_ids)
+    # segments that are gone or no longer have a code or position
+    found = {row.id for row in rows}
+    changes["data"] = plot_rows_to_dicts(rows)
+    changes["deleted"] = sorted(set(segment_ids) - found)
+    return changes
+
+
+def get_plot_rows_by_ids(db: Session, project_id: int, segment_ids):
+    """Get the plot rows (with text) of the given segments, ordered by segment id"""
+    reduction_model_id, cluster_model_id = get_plot_model_ids(
+        ProjectService(project_id, db)
+    )
+    if reduction_model_id is None or not segment_ids:
+        return []
+    return (
+        plot_rows_query(db, reduction_model_id, cluster_model_id)
+        .filter(PlotPoint.segment_id.in_(segment_ids))
+        .order_by(PlotPoint.segment_id)
+        .all()
+    )
+
+
+def get_sentence_texts(db: Session, project_id: int, start_id: int, end_id: int):
+    """Get the sentence texts of a project with start_id <= sentence_id < end_id"""
+    rows = (
+        db.query(Sentence.sentence_id, Sentence.text)
+        .join(Dataset, Dataset.dataset_id == Sentence.dataset_id)
+        .filter(
+            Dataset.project_id == project_id,
+            Sentence.sentence_id >= start_id,
+            Sentence.sentence_id < end_id,
+        )
+        .order_by(Sentence.sentence_id)
+        .all()
+    )
+    return {sentence_id: text for sentence_id, text in rows}
@@ -0,0 +1,327 @@
+"""
+This module writes plot snapshots, one directory of columnar .npy files per model version,
+and reads them memory-mapped, so pages and tiles come from the page cache instead of
+Postgres.
+
+Texts are utf-8 blobs with int64 offsets: segments in point order, sentences once each,
+sorted by sentence id. With "plot_snapshot_serving" set in env.json, plot reads of
+projects with a current snapshot only read the project version from the database. Outdated
+snapshots are not served, they are rewritten in the background.
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from array import array
+from collections import namedtuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from db.models import Code
+from db.session import SessionLocal
+from db.single_flight import single_flight
+from db.versions import get_version
+from plot.encoding import NO_CLUSTER
+from plot.service import get_plot_model_ids, stream_plot_rows
+from project.service import ProjectService
+from utilities.string_operations import env
+
+logger = logging.getLogger(__name__)
+
+PLOT_SNAPSHOT_SERVING = bool(env.get("plot_snapshot_serving", False))
+
+# column name -> array typecode while writing, all columns have one entry per point
+SNAPSHOT_COLUMNS = {
+    "ids": "q",
+    "xs": "f",
+    "ys": "f",
+    "codes": "q",
+    "clusters": "q",
+    "datasets": "q",
+    "sentence_ids": "q",
+    "start_positions": "q",
+}
+
+PlotRow = namedtuple(
+    "PlotRow",
+    [
+        "id",
+        "sentence_id",
+        "sentence",
+        "segment",
+        "start_position",
+        "code",
+        "x",
+        "y",
+        "cluster",
+        "dataset",
+    ],
+)
+
+
+def snapshot_root(project_id: int, create: bool = True):
+    """The snapshot directory of a project, readers pass create=False to not create it"""
+    path = os.path.join(
+        env["exported_folder"], "projects", str(project_id), "plots", "snapshots"
+    )
+    if create:
+        os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _save(directory: str, name: str, values):
+    np.save(os.path.join(directory, f"{name}.npy"), np.asarray(values))
+
+
+def _write_columns(directory: str, rows):
+    columns = {name: array(typecode) for name, typecode in SNAPSHOT_COLUMNS.items()}
+    segment_offsets = array("q", [0])
+    sentence_keys, sentence_starts, sentence_ends = array("q"), array("q"), array("q")
+    seen_sentences = set()
+    with (
+        open(os.path.join(directory, "segments.bin"), "wb") as segment_file,
+        open(os.path.join(directory, "sentences.bin"), "wb") as sentence_file,
+    ):
+        sentence_size = 0
+        for row in rows:
+            columns["ids"].append(row.id)
+            columns["xs"].append(row.x)
+            columns["ys"].append(row.y)
+            columns["codes"].append(row.code)
+            columns["clusters"].append(NO_CLUSTER if row.cluster is None else row.cluster)
+            columns["datasets"].append(row.dataset)
+            columns["sentence_ids"].append(row.sentence_id)
+            columns["start_positions"].append(row.start_position)
+            segment = row.segment.encode("utf-8")
+            segment_file.write(segment)
+            segment_offsets.append(segment_offsets[-1] + len(segment))
+            if row.sentence_id not in seen_sentences:
+                seen_sentences.add(row.sentence_id)
+                sentence = row.sentence.encode("utf-8")
+                sentence_file.write(sentence)
+                sentence_keys.append(row.sentence_id)
+                sentence_starts.append(sentence_size)
+                sentence_size += len(sentence)
+                sentence_ends.append(sentence_size)
+
+    for name, values in columns.items():
+        _save(directory, name, values)
+    _save(directory, "segment_offsets", segment_offsets)
+    order = np.argsort(np.asarray(sentence_keys), kind="stable")
+    _save(directory, "sentence_keys", np.asarray(sentence_keys)[order])
+    _save(directory, "sentence_starts", np.asarray(sentence_starts)[order])
+    _save(directory, "sentence_ends", np.asarray(sentence_ends)[order])
+    return len(columns["ids"])
+
+
+def write_plot_snapshot(db: Session, project_id: int):
+    """Write the snapshot of the current models and version if needed, make it the latest
+
+    The snapshot is written to a temporary directory and renamed, older snapshots are
+    removed. Writers of a project are serialized, so latest.json never goes back to an
+    older version. Returns the snapshot directory, None if there are no reduced embeddings
+    yet.
+    """
+    with single_flight(project_id, "plot_snapshot", "latest"):
+        return _write_plot_snapshot(db, project_id)
+
+
+def _write_plot_snapshot(db: Session, project_id: int):
+    reduction_model_id, cluster_model_id = get_plot_model_ids(
+        ProjectService(project_id, db)
+    )
+    if reduction_model_id is None:
+        return None
+    version = get_version(db, project_id)
+    root = snapshot_root(project_id)
+    name = f"{reduction_model_id}_{cluster_model_id}_{version}"
+    directory = os.path.join(root, name)
+    if not os.path.isdir(directory):
+        temporary = tempfile.mkdtemp(prefix=".tmp-", dir=root)
+        try:
+            rows = stream_plot_rows(
+                reduction_model_id, cluster_model_id, with_dataset=True
+            )
+            length = _write_columns(temporary, rows)
+            meta = {
+                "reduction_model_id": reduction_model_id,
+                "cluster_model_id": cluster_model_id,
+                "version": version,
+                "length": length,
+                # the code tree for subtree filters, as [code_id, parent_code_id] pairs
+                "code_parents": [
+                    list(row)
+                    for row in db.query(Code.code_id, Code.parent_code_id).filter(
+                        Code.project_id == project_id
+                    )
+                ],
+            }
+            with open(os.path.join(temporary, "meta.json"), "w") as file:
+                json.dump(meta, file)
+            os.rename(temporary, directory)
+        except Exception:
+            shutil.rmtree(temporary, ignore_errors=True)
+            raise
+
+    latest = os.path.join(root, "latest.json")
+    with tempfile.NamedTemporaryFile("w", prefix=".tmp-", dir=root, delete=False) as file:
+        json.dump({"name": name}, file)
+    os.replace(file.name, latest)
+    # open snapshots keep their mapped files after removal
+    for entry in os.listdir(root):
+        if entry not in (name, "latest.json") and not entry.startswith(".tmp-"):
+            shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+    return directory
+
+
+class PlotSnapshot:
+    """A plot snapshot opened with memory-mapped columns, points ordered by segment id"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as file:
+            self.meta = json.load(file)
+        names = [
+            *SNAPSHOT_COLUMNS,
+            "segment_offsets",
+            "sentence_keys",
+            "sentence_starts",
+            "sentence_ends",
+        ]
+        for name in names:
+            setattr(
+                self, name, np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            )
+        self.segment_text = self._map_text("segments.bin")
+        self.sentence_text = self._map_text("sentences.bin")
+
+    def _map_text(self, file_name: str):
+        path = os.path.join(self.directory, file_name)
+        # empty files cannot be mapped
+        if os.path.getsize(path) == 0:
+            return np.empty(0, dtype=np.uint8)
+        return np.memmap(path, dtype=np.uint8, mode="r")
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def version(self) -> int:
+        return self.meta["version"]
+
+    def page(self, page: int, page_size: int, cursor: int = None):
+        """Indexes of one page and the cursor of the next, as db.pagination.keyset_page"""
+        if cursor is not None:
+            start = int(np.searchsorted(self.ids, cursor, side="right"))
+        else:
+            start = page * page_size
+        end = min(start + page_size, len(self))
+        indexes = np.arange(min(start, end), end)
+        next_cursor = int(self.ids[end - 1]) if len(indexes) == page_size else None
+        return indexes, next_cursor
+
+    def sentence(self, sentence_id: int) -> str:
+        i = int(np.searchsorted(self.sentence_keys, sentence_id))
+        start, end = int(self.sentence_starts[i]), int(self.sentence_ends[i])
+        return bytes(self.sentence_text[start:end]).decode("utf-8")
+
+    def rows(self, indexes):
+        """Yield plot rows (with text and dataset) of the given point indexes"""
+        for i in indexes:
+            start, end = int(self.segment_offsets[i]), int(self.segment_offsets[i + 1])
+            cluster = int(self.clusters[i])
+            yield PlotRow(
+                id=int(self.ids[i]),
+                sentence_id=int(self.sentence_ids[i]),
+                sentence=self.sentence(int(self.sentence_ids[i])),
+                segment=bytes(self.segment_text[start:end]).decode("utf-8"),
+                start_position=int(self.start_positions[i]),
+                code=int(self.codes[i]),
+                x=float(self.xs[i]),
+                y=float(self.ys[i]),
+                cluster=None if cluster == NO_CLUSTER else cluster,
+                dataset=int(self.datasets[i]),
+            )
+
+
+class PlotSnapshotCache:
+    """The opened latest snapshot per project, reopened when latest.json is replaced
+
+    latest.json is only read again when its inode or modification time changed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshots = {}
+        self._rewrites = set()
+
+    def get(self, project_id: int):
+        """Get the latest snapshot of a project, None if there is none"""
+        root = snapshot_root(project_id, create=False)
+        latest = os.path.join(root, "latest.json")
+        try:
+            stat = os.stat(latest)
+        except FileNotFoundError:
+            return None
+        # written with os.replace, so a new manifest is a new inode
+        key = (stat.st_ino, stat.st_mtime_ns)
+        with self._lock:
+            cached = self._snapshots.get(project_id)
+        if cached is not None and cached[0] == key:
+            return cached[2]
+        try:
+            with open(latest) as file:
+                name = json.load(file)["name"]
+        except FileNotFoundError:
+            return None
+        if cached is not None and cached[1] == name:
+            snapshot = cached[2]
+        else:
+            snapshot = PlotSnapshot(os.path.join(root, name))
+        with self._lock:
+            self._snapshots[project_id] = (key, name, snapshot)
+        return snapshot
+
+    def get_current(self, db: Session, project_id: int):
+        """Get the latest snapshot if it has the current project version, None otherwise
+
+        An outdated snapshot is rewritten in the background.
+        """
+        snapshot = self.get(project_id)
+        if snapshot is None or snapshot.version == get_version(db, project_id):
+            return snapshot
+        self.schedule_rewrite(project_id)
+        return None
+
+    def schedule_rewrite(self, project_id: int):
+        """Write the snapshot of a project in a thread, unless one is being written"""
+        with self._lock:
+            if project_id in self._rewrites:
+                return
+            self._rewrites.add(project_id)
+        thread = threading.Thread(
+            target=self._rewrite,
+            args=(project_id,),
+            name=f"plot-snapshot-{project_id}",
+            daemon=True,
+        )
+        thread.start()
+
+    def _rewrite(self, project_id: int):
+        db = SessionLocal()
+        try:
+            write_plot_snapshot(db, project_id)
+        except Exception as e:
+            logger.error(f"Plot snapshot rewrite failed for project {project_id}: {e}")
+        finally:
+            db.close()
+            SessionLocal.remove()
+            with self._lock:
+                self._rewrites.discard(project_id)
+
+
+plot_snapshot_cache = PlotSnapshotCache()
@@ -0,0 +1,215 @@
+"""
+This module computes the statistics panels of a project with one grouped aggregation per
+panel, cached for the project version they were computed for.
+"""
+
+import threading
+from collections import OrderedDict, defaultdict
+
+from sqlalchemy import and_, func
+from sqlalchemy.orm import Session
+
+from db.models import Code, PlotPoint, Segment
+from db.versions import get_version
+from plot.service import get_plot_model_ids
+from project.service import ProjectService
+
+STATS_CACHE_SIZE = 64
+
+
+class StatsCache:
+    """Statistics by (project, panel, parameters), valid for one project version"""
+
+    def __init__(self, max_entries: int = STATS_CACHE_SIZE):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.max_entries = max_entries
+
+    def get(self, db: Session, project_id: int, key: tuple, compute):
+        """Get the cached statistics of key, compute() them if the project changed"""
+        version = get_version(db, project_id)
+        key = (project_id, *key)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and cached[0] == version:
+                self._entries.move_to_end(key)
+                return cached[1]
+        result = compute()
+        with self._lock:
+            self._entries[key] = (version, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result
+
+
+stats_cache = StatsCache()
+
+
+def position_stats(count: int, sum_x, sum_y, min_x, min_y, max_x, max_y):
+    """Centroid and bounding box of aggregated positions, None without positions"""
+    if not count:
+        return {"average_position": {"x": 0, "y": 0}, "bounding_box": None}
+    return {
+        "average_position": {"x": sum_x / count, "y": sum_y / count},
+        "bounding_box": {"min_x": min_x, "min_y": min_y, "max_x": max_x, "max_y": max_y},
+    }
+
+
+def compute_code_stats(db: Session, project_id: int, subtree: bool = False):
+    """Segment counts, centroids and bounding boxes per code, optionally per subtree"""
+    reduction_model_id, _ = get_plot_model_ids(ProjectService(project_id, db))
+    rows = (
+        db.query(
+            Code.code_id,
+            Code.text,
+            Code.parent_code_id,
+            func.count(Segment.segment_id),
+            func.count(PlotPoint.reduced_embedding_id),
+            func.sum(PlotPoint.pos_x),
+            func.sum(PlotPoint.pos_y),
+            func.min(PlotPoint.pos_x),
+            func.min(PlotPoint.pos_y),
+            func.max(PlotPoint.pos_x),
+            func.max(PlotPoint.pos_y),
+        )
+        .outerjoin(Segment, Segment.code_id == Code.code_id)
+        .outerjoin(
+            PlotPoint,
+            and_(
+                PlotPoint.segment_id == Segment.segment_id,
+                PlotPoint.reduction_model_id == reduction_model_id,
+            ),
+        )
+        .filter(Code.project_id == project_id)
+        .group_by(Code.code_id)
+        .order_by(Code.code_id)
+        .all()
+    )
+
+    codes = []
+    aggregates = {}
+    children = defaultdict(list)
+    for code_id, text, parent_code_id, segment_count, point_count, *positions in rows:
+        codes.append(
+            {
+                "code_id": code_id,
+                "text": text,
+                "parent_code_id": parent_code_id,
+                "segment_count": segment_count,
+                "point_count": point_count,
+                **position_stats(point_count, *positions),
+            }
+        )
+        aggregates[code_id] = [segment_count, point_count, *positions]
+        children[parent_code_id].append(code_id)
+
+    if subtree:
+        rollups = {}
+
+        def roll_up(code_id):
+            segment_count, point_count, sum_x, sum_y, min_x, min_y, max_x, max_y = (
+                aggregates[code_id]
+            )
+            for child_id in children[code_id]:
+                child = roll_up(child_id)
+                segment_count += child[0]
+                if child[1]:
+                    point_count += child[1]
+                    sum_x = child[2] if sum_x is None else sum_x + child[2]
+                    sum_y = child[3] if sum_y is None else sum_y + child[3]
+                    min_x = child[4] if min_x is None else min(min_x, child[4])
+                    min_y = child[5] if min_y is None else min(min_y, child[5])
+                    max_x = child[6] if max_x is None else max(max_x, child[6])
+                    max_y = child[7] if max_y is None else max(max_y, child[7])
+            rollups[code_id] = [
+                segment_count,
+                point_count,
+                sum_x,
+                sum_y,
+                min_x,
+                min_y,
+                max_x,
+                max_y,
+            ]
+            return rollups[code_id]
+
+        for code in codes:
+            if code["parent_code_id"] not in aggregates:
+                roll_up(code["code_id"])
+        for code in codes:
+            segment_count, point_count, *positions = rollups[code["code_id"]]
+            code["subtree"] = {
+                "segment_count": segment_count,
+                "point_count": point_count,
+                **position_stats(point_count, *positions),
+            }
+    return {"codes": codes}
+
+
+def compute_cluster_stats(db: Session, project_id: int):
+    """Size, centroid, dominant code and purity per cluster of the active model"""
+    reduction_model_id, cluster_model_id = get_plot_model_ids(
+        ProjectService(project_id, db)
+    )
+    rows = (
+        db.query(
+            PlotPoint.cluster,
+            PlotPoint.code_id,
+            func.count(),
+            func.sum(PlotPoint.pos_x),
+            func.sum(PlotPoint.pos_y),
+        )
+        .filter(
+            PlotPoint.reduction_model_id == reduction_model_id,
+            PlotPoint.cluster_model_id == cluster_model_id,
+            PlotPoint.cluster.isnot(None),
+        )
+        .group_by(PlotPoint.cluster, PlotPoint.code_id)
+        .all()
+    )
+
+    clusters = {}
+    for cluster, code_id, count, sum_x, sum_y in rows:
+        stats = clusters.setdefault(
+            cluster,
+            {"size": 0, "sum_x": 0.0, "sum_y": 0.0, "code": None, "code_count": 0},
+        )
+        stats["size"] += count
+        stats["sum_x"] += sum_x
+        stats["sum_y"] += sum_y
+        # ties go to the lower code id
+        if code_id is not None and (
+            count > stats["code_count"]
+            or (count == stats["code_count"] and code_id < stats["code"])
+        ):
+            stats["code"], stats["code_count"] = code_id, count
+
+    code_texts = dict(
+        db.query(Code.code_id, Code.text).filter(
+            Code.code_id.in_(
+                [stats["code"] for stats in clusters.values() if stats["code"]]
+            )
+        )
+    )
+    cluster_info = [
+        {
+            "cluster_value": cluster,
+            "segment_count": stats["size"],
+            "average_position": {
+                "x": stats["sum_x"] / stats["size"],
+                "y": stats["sum_y"] / stats["size"],
+            },
+            "dominant_code": stats["code"],
+            "dominant_code_text": code_texts.get(stats["code"]),
+            # share of the cluster coded with the dominant code
+            "purity": stats["code_count"] / stats["size"],
+        }
+        for cluster, stats in sorted(clusters.items())
+    ]
+    return {
+        "cluster_model_id": cluster_model_id,
+        "cluster_count": sum(stats["size"] for stats in clusters.values()),
+        "unique_cluster_count": len(clusters),
+        "cluster_info": cluster_info,
+    }
@@ -3,8 +3,11 @@ from sqlalchemy.orm import Session
 
 from configmanager.router import create_config, get_config
 from db.models import Project
+from db.changes import record_changes
 from db.schema import DeleteResponse
 from db.session import get_db
+from db.versions import bump_version
+from pipeline.service import pipeline_runner
 from project.schema import ProjectData, ProjectEntry, ProjectsData
 from project.service import ProjectService
 
@@ -102,6 +105,9 @@ def set_project_config_route(
 ) -> ProjectData:
     config = get_config(config_id, db=db)
     project = ProjectService(project_id, db).set_project_config(config.config_id)
+    record_changes(db, project.project_id, bump_version(db, project.project_id))
+    db.commit()
+    pipeline_runner.trigger(project.project_id)
     return ProjectData(
         data=ProjectEntry(
             project_name=project.project_name,
@@ -6,6 +6,7 @@ import pickle
 from fastapi import HTTPException
 from sqlalchemy.orm import Session
 
+from db.counters import add_project_counts
 from db.models import Config, Model, Project
 from models.model_definitions import MODELS
 from utilities.string_operations import generate_hash, get_file_path
@@ -115,6 +116,7 @@ class ProjectService:
         if model_entry is None:
             model_entry = Model(project_id=self.project_id, model_hash=model_hash)
             self.db.add(model_entry)
+            add_project_counts(self.db, self.project_id, model_count=1)
             self.db.commit()
             self.db.refresh(model_entry)
 
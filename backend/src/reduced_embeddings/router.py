@@ -1,13 +1,20 @@
 import logging
 import pickle
+from typing import Optional
 
 import numpy as np
 from fastapi import APIRouter, Depends
 from sqlalchemy import and_, exists, not_
 from sqlalchemy.orm import Session
 
+from db.changes import record_changes
+from db.counters import add_count, get_count, model_counter_key
 from db.models import Embedding, Model, Project, ReducedEmbedding
+from db.pagination import keyset_page
+from db.plot_points import add_plot_points
 from db.session import get_db
+from db.single_flight import single_flight
+from db.versions import bump_version
 from project.service import ProjectService
 
 router = APIRouter()
@@ -20,33 +27,30 @@ def get_reduced_embeddings_endpoint(
     all: bool = False,
     page: int = 0,
     page_size: int = 100,
+    cursor: Optional[int] = None,
     db: Session = Depends(get_db),
 ):
     reduced_embeddings = []
     project = ProjectService(project_id, db)
     model_entry = project.get_model_entry("reduction_config")
     return_dict = {}
-    count = (
-        db.query(ReducedEmbedding)
-        .filter(ReducedEmbedding.model_id == model_entry.model_id)
-        .count()
+    query = db.query(ReducedEmbedding).filter(
+        ReducedEmbedding.model_id == model_entry.model_id
     )
+    count = get_count(db, project_id, model_counter_key(model_entry.model_id), query)
 
     if all:
-        reduced_embeddings = (
-            db.query(ReducedEmbedding)
-            .filter(ReducedEmbedding.model_id == model_entry.model_id)
-            .all()
-        )
+        reduced_embeddings = query.all()
     else:
-        reduced_embeddings = (
-            db.query(ReducedEmbedding)
-            .filter(ReducedEmbedding.model_id == model_entry.model_id)
-            .offset(page * page_size)
-            .limit(page_size)
-            .all()
+        reduced_embeddings, next_cursor = keyset_page(
+            query,
+            ReducedEmbedding.reduced_embedding_id,
+            "reduced_embedding_id",
+            page_size,
+            page,
+            cursor,
         )
-        return_dict.update({"page": page, "page_size": page_size})
+        return_dict.update({"page": page, "page_size": page_size, "next_cursor": next_cursor})
 
     return_dict.update(
         {"length": len(reduced_embeddings), "count": count, "data": reduced_embeddings}
@@ -57,6 +61,13 @@ def get_reduced_embeddings_endpoint(
 
 @router.get("/extract")
 def extract_embeddings_reduced_endpoint(project_id: int, db: Session = Depends(get_db)):
+    """Reduce the embeddings without position, concurrent calls for the same model run one after another"""
+    model_hash = ProjectService(project_id, db).get_model_hash("reduction_config")
+    with single_flight(project_id, "reduced_embeddings", model_hash):
+        return extract_embeddings_reduced(project_id, db)
+
+
+def extract_embeddings_reduced(project_id: int, db: Session):
     reduced_embeddings = []
     project: ProjectService = ProjectService(project_id, db)
 
@@ -108,8 +119,16 @@ def extract_embeddings_reduced_endpoint(project_id: int, db: Session = Depends(g
             for position_value, embedding in zip(reduced_embeddings, embeddings_todo)
         ]
         db.bulk_insert_mappings(ReducedEmbedding, position_mappings)
+        add_count(db, model_counter_key(model_entry.model_id), len(position_mappings))
+        add_plot_points(db, project_id, model_entry.model_id)
+        version = bump_version(db, project_id)
+        record_changes(db, project_id, version, [embedding.segment_id for embedding in embeddings_todo])
         db.commit()
         project.save_model("reduction_config", reduction_model)
         logger.info(f"Extracted {len(embeddings_todo)} reduced embeddings")
+    elif add_plot_points(db, project_id, model_entry.model_id):
+        # reduced embeddings extracted before the plot points existed
+        record_changes(db, project_id, bump_version(db, project_id))
+        db.commit()
 
     return {"data": len(reduced_embeddings)}
@@ -0,0 +1,261 @@
+"""
+Response compression negotiated by Accept-Encoding: zstd and brotli if their packages are
+installed, gzip always. Small responses are sent as they are, streamed responses are
+compressed chunk by chunk. Compressed bodies of responses with an ETag are cached, so a
+version is only compressed once per encoding. The ETag of a compressed response gets the
+encoding as suffix, every representation has its own tag.
+"""
+
+import zlib
+from collections import OrderedDict
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_MINIMUM_SIZE = 1024
+COMPRESSION_CACHE_BYTES = 64 * 1024 * 1024
+# content types that are already compressed
+UNCOMPRESSED_TYPES = (
+    "image/",
+    "video/",
+    "audio/",
+    "application/zip",
+    "application/gzip",
+    "application/vnd.apache.parquet",
+)
+
+
+class GzipCompressor:
+    def __init__(self):
+        # wbits 31 writes the gzip container
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class ZstdCompressor:
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(level=3).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(
+            zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        )
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliCompressor:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=5)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+# encodings in order of preference, only the installed ones
+COMPRESSORS = OrderedDict(
+    (encoding, compressor)
+    for encoding, compressor, module in (
+        ("zstd", ZstdCompressor, zstandard),
+        ("br", BrotliCompressor, brotli),
+        ("gzip", GzipCompressor, zlib),
+    )
+    if module is not None
+)
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """The ETag of the response compressed with encoding, suffixed inside the quotes"""
+    if not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def decoded_etag(etag: str) -> str:
+    """The ETag of the uncompressed response, without the suffix of encoded_etag"""
+    for encoding in ("zstd", "br", "gzip"):
+        suffix = f'-{encoding}"'
+        if etag.endswith(suffix):
+            return etag[: -len(suffix)] + '"'
+    return etag
+
+
+def negotiate_encoding(accept_encoding: str):
+    """The preferred installed encoding accepted by the client, None if there is none"""
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, parameters = part.strip().partition(";")
+        weight = 1.0
+        parameter = parameters.strip()
+        if parameter.startswith("q="):
+            try:
+                weight = float(parameter[2:])
+            except ValueError:
+                weight = 0.0
+        if coding:
+            weights[coding.strip().lower()] = weight
+    default = weights.get("*", 0.0)
+    accepted = [
+        (weights.get(encoding, default), encoding)
+        for encoding in COMPRESSORS
+        if weights.get(encoding, default) > 0
+    ]
+    if not accepted:
+        return None
+    # the highest weight wins, ties go to the order of COMPRESSORS
+    return max(accepted, key=lambda item: item[0])[1]
+
+
+def compress_body(encoding: str, body: bytes) -> bytes:
+    compressor = COMPRESSORS[encoding]()
+    return compressor.compress(body) + compressor.finish()
+
+
+class CompressedBodyCache:
+    """Compressed bodies by (path, query, ETag, encoding), bounded by max_bytes (LRU)"""
+
+    def __init__(self, max_bytes: int = COMPRESSION_CACHE_BYTES):
+        self._bodies = OrderedDict()
+        self._size = 0
+        self.max_bytes = max_bytes
+
+    def get(self, key):
+        body = self._bodies.get(key)
+        if body is not None:
+            self._bodies.move_to_end(key)
+        return body
+
+    def put(self, key, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        previous = self._bodies.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous)
+        self._bodies[key] = body
+        self._size += len(body)
+        while self._size > self.max_bytes:
+            _, dropped = self._bodies.popitem(last=False)
+            self._size -= len(dropped)
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing streamed responses and those of minimum_size bytes"""
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = COMPRESSION_MINIMUM_SIZE,
+        cache_bytes: int = COMPRESSION_CACHE_BYTES,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.cache = CompressedBodyCache(cache_bytes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = CompressionResponder(self, scope, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+
+class CompressionResponder:
+    """Compresses the messages of one response, decided on its first body message"""
+
+    def __init__(self, middleware: CompressionMiddleware, scope, encoding: str, send):
+        self.middleware = middleware
+        self.scope = scope
+        self.encoding = encoding
+        self._send = send
+        self.start = None
+        self.compressor = None
+        self.passthrough = False
+
+    def _compressible(self, headers: MutableHeaders) -> bool:
+        if self.start["status"] in (204, 304) or "content-encoding" in headers:
+            return False
+        return not headers.get("content-type", "").startswith(UNCOMPRESSED_TYPES)
+
+    def _set_encoding(self, headers: MutableHeaders, length: int = None):
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        if "etag" in headers:
+            headers["ETag"] = encoded_etag(headers["etag"], self.encoding)
+        if length is None:
+            del headers["Content-Length"]
+        else:
+            headers["Content-Length"] = str(length)
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body":
+            await self._send(message)
+            return
+        if self.passthrough:
+            await self._send(message)
+            return
+        if self.compressor is not None:
+            await self._send_chunk(message)
+            return
+
+        headers = MutableHeaders(raw=self.start["headers"])
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if not self._compressible(headers) or (
+            not more_body and len(body) < self.middleware.minimum_size
+        ):
+            self.passthrough = True
+            await self._send(self.start)
+            await self._send(message)
+            return
+
+        if more_body:
+            self.compressor = COMPRESSORS[self.encoding]()
+            self._set_encoding(headers)
+            await self._send(self.start)
+            await self._send_chunk(message)
+            return
+
+        etag = headers.get("etag")
+        key = (self.scope["path"], self.scope["query_string"], etag, self.encoding)
+        compressed = self.middleware.cache.get(key) if etag else None
+        if compressed is None:
+            compressed = await run_in_threadpool(compress_body, self.encoding, body)
+            if etag:
+                self.middleware.cache.put(key, compressed)
+        self._set_encoding(headers, len(compressed))
+        await self._send(self.start)
+        await self._send({"type": "http.response.body", "body": compressed})
+
+    async def _send_chunk(self, message):
+        more_body = message.get("more_body", False)
+        body = await run_in_threadpool(self.compressor.compress, message.get("body", b""))
+        if not more_body:
+            body += self.compressor.finish()
+        await self._send(
+            {"type": "http.response.body", "body": body, "more_body": more_body}
+        )
@@ -0,0 +1,47 @@
+import hashlib
+from typing import Optional, Tuple
+
+from fastapi import Request, Response
+from sqlalchemy.orm import Session
+
+from db.versions import get_version
+from utilities.compression import decoded_etag
+
+
+def version_etag(request: Request, version: int, *parts) -> str:
+    """ETag of a response that only changes with the project version and the query"""
+    key = "|".join(str(part) for part in (request.url.path, request.url.query, *parts))
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    return f'"{version}-{digest}"'
+
+
+def etag_headers(etag: str) -> dict:
+    """Headers for responses returned directly instead of the injected response"""
+    return {"ETag": etag, "Cache-Control": "no-cache"}
+
+
+def check_etag(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """Return a 304 response if the client has the current version, else tag the response
+
+    Tags of compressed representations match too, the 304 then repeats the tag the client
+    sent.
+    """
+    headers = etag_headers(etag)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag == "*" or decoded_etag(tag.removeprefix("W/")) == etag:
+                if tag != "*":
+                    headers["ETag"] = tag
+                return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+def check_project_etag(
+    request: Request, response: Response, db: Session, project_id: int, *parts
+) -> Tuple[str, Optional[Response]]:
+    """check_etag with the project version, returns the ETag and the 304 response"""
+    etag = version_etag(request, get_version(db, project_id), *parts)
+    return etag, check_etag(request, response, etag)
@@ -0,0 +1,25 @@
+"""
+JSON responses for large payloads of plain dicts and lists. Returning them directly skips
+FastAPI's jsonable_encoder and the validation of the response model, which is only kept
+for the OpenAPI schema.
+"""
+
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # falls back to the standard library encoder
+    orjson = None
+
+ORJSON_OPTIONS = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse serialized with orjson if installed, with numpy values, int keys"""
+
+    def render(self, content: Any) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content, option=ORJSON_OPTIONS)
@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path.insert(0, SRC)
+# the modules read ../env.json relative to src, as when the api is started
+os.chdir(SRC)
+
+
+@pytest.fixture(scope="session")
+def client():
+    """A client of the whole api, needs the database of env.json and the models"""
+    from fastapi.testclient import TestClient
+    from sqlalchemy.exc import OperationalError
+
+    try:
+        from main import app
+    except (ImportError, OperationalError) as e:
+        pytest.skip(f"Backend environment unavailable: {e}")
+    with TestClient(app) as client:
+        yield client
@@ -0,0 +1,77 @@
+import threading
+from collections import Counter
+
+import pytest
+
+from plot import autocomplete
+from plot.autocomplete import AutocompleteIndex, count_terms
+
+TEXTS = [
+    ("Apple pie", 1),
+    ("apple  pie!", 1),
+    ("Apricot", 5),
+    ("avocado", 4),
+    ("green apple", 2),
+    ("banana", 3),
+    ("Aardvark", 6),
+]
+
+
+@pytest.fixture(autouse=True)
+def small_precomputed_lists(monkeypatch):
+    # fewer precomputed completions than texts per prefix, so ranks matter
+    monkeypatch.setattr(autocomplete, "AUTOCOMPLETE_MAX_K", 2)
+
+
+def completions(index, text, k=2):
+    return [(c["text"], c["count"]) for c in index.complete(text, k) if c["score"] == 1.0]
+
+
+def test_texts_are_merged_by_normalized_form():
+    index = AutocompleteIndex(count_terms(TEXTS))
+    assert completions(index, "apple p") == [("Apple pie", 2)]
+    assert completions(index, "a") == [("Aardvark", 6), ("Apricot", 5)]
+    # ties are ranked by text
+    assert completions(index, "ap") == [("Apricot", 5), ("Apple pie", 2)]
+
+
+def test_added_counts_update_the_precomputed_prefixes():
+    index = AutocompleteIndex(count_terms(TEXTS))
+    index.add(Counter({"green APPLE": 10, "banana": 0}))
+    assert completions(index, "a") == [("green apple", 12), ("Aardvark", 6)]
+    assert completions(index, "ap") == [("green apple", 12), ("Apricot", 5)]
+    assert completions(index, "g") == [("green apple", 12)]
+
+    # the same completions as an index built from the merged texts
+    rebuilt = AutocompleteIndex(index.merged_terms())
+    for prefix in ("a", "ap", "aa", "g", "gr", "b", "p", "pi"):
+        assert completions(index, prefix) == completions(rebuilt, prefix)
+
+
+def test_new_texts_are_completed_before_a_rebuild():
+    index = AutocompleteIndex(count_terms(TEXTS))
+    index.add(Counter({"Apex": 20}))
+    assert ("Apex", 20) in completions(index, "ap", k=3)
+    assert completions(index, "apex") == [("Apex", 20)]
+    assert len(index) == len(index.merged_terms()) == 7
+
+
+def test_completions_run_while_texts_are_added():
+    index = AutocompleteIndex(count_terms(TEXTS))
+    errors = []
+
+    def complete():
+        try:
+            for _ in range(300):
+                index.complete("ap", 5)
+                index.complete("apx", 5)
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=complete)
+    thread.start()
+    for i in range(300):
+        index.add(Counter({f"apex {i}": 1, "Apricot": 1}))
+    thread.join()
+    assert errors == []
+    assert completions(index, "apr", k=1) == [("Apricot", 305)]
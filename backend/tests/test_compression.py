@@ -0,0 +1,142 @@
+import gzip
+
+import pytest
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from utilities import compression
+from utilities.compression import (
+    COMPRESSORS,
+    CompressedBodyCache,
+    CompressionMiddleware,
+    decoded_etag,
+    encoded_etag,
+    negotiate_encoding,
+)
+from utilities.etag import check_etag
+
+BODY = "0123456789" * 500
+ETAG = '"7-abcdef"'
+
+
+@pytest.fixture
+def app():
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware)
+
+    @app.get("/tagged")
+    def tagged(request: Request, response: Response):
+        not_modified = check_etag(request, response, ETAG)
+        if not_modified:
+            return not_modified
+        return Response(BODY, headers=response.headers)
+
+    @app.get("/small")
+    def small():
+        return Response("small")
+
+    @app.get("/stream")
+    def stream():
+        return StreamingResponse(iter([BODY, BODY]), headers={"ETag": ETAG})
+
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return TestClient(app)
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, expected",
+    [
+        ("", None),
+        ("identity", None),
+        ("gzip", "gzip"),
+        ("GZIP;q=0.5", "gzip"),
+        ("gzip;q=0", None),
+        ("gzip;q=invalid", None),
+        ("*", next(iter(COMPRESSORS))),
+        ("*, gzip;q=0", next(iter(COMPRESSORS)) if len(COMPRESSORS) > 1 else None),
+        ("deflate, gzip;q=0.2, br;q=0.8", "br" if "br" in COMPRESSORS else "gzip"),
+    ],
+)
+def test_negotiate_encoding(accept_encoding, expected):
+    assert negotiate_encoding(accept_encoding) == expected
+
+
+def test_etag_suffix():
+    assert encoded_etag(ETAG, "gzip") == '"7-abcdef-gzip"'
+    assert decoded_etag(encoded_etag(ETAG, "br")) == ETAG
+    assert decoded_etag(ETAG) == ETAG
+
+
+def test_compressed_response(client):
+    response = client.get("/tagged", headers={"Accept-Encoding": "gzip"})
+    assert response.text == BODY
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == encoded_etag(ETAG, "gzip")
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert int(response.headers["content-length"]) < len(BODY)
+
+
+def test_uncompressed_responses(client):
+    response = client.get("/tagged", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert response.headers["etag"] == ETAG
+    response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.text == "small"
+
+
+@pytest.mark.parametrize("tag", [encoded_etag(ETAG, "gzip"), f"W/{ETAG}", ETAG])
+def test_encoded_etags_are_not_modified(client, tag):
+    response = client.get(
+        "/tagged", headers={"Accept-Encoding": "gzip", "If-None-Match": f'"other", {tag}'}
+    )
+    assert response.status_code == 304
+    assert response.headers["etag"] == tag
+    response = client.get(
+        "/tagged", headers={"Accept-Encoding": "gzip", "If-None-Match": '"6-abcdef-gzip"'}
+    )
+    assert response.status_code == 200
+
+
+def test_streamed_response(client):
+    response = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert response.headers["etag"] == encoded_etag(ETAG, "gzip")
+    assert response.text == BODY * 2
+
+
+def test_compressed_bodies_are_cached_by_path_query_etag_and_encoding(
+    client, monkeypatch
+):
+    calls = []
+
+    def compress_body(encoding, body):
+        calls.append(encoding)
+        return gzip.compress(body)
+
+    monkeypatch.setattr(compression, "compress_body", compress_body)
+    for _ in range(3):
+        assert client.get("/tagged", headers={"Accept-Encoding": "gzip"}).text == BODY
+    assert len(calls) == 1
+    client.get("/tagged?page=2", headers={"Accept-Encoding": "gzip"})
+    assert len(calls) == 2
+    client.get("/tagged?page=2", headers={"Accept-Encoding": "gzip"})
+    assert len(calls) == 2
+
+
+def test_body_cache_drops_the_least_recently_used():
+    cache = CompressedBodyCache(max_bytes=10)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    assert cache.get("a") == b"1234"
+    cache.put("c", b"1234")
+    assert cache.get("b") is None
+    assert cache.get("a") == cache.get("c") == b"1234"
+    cache.put("d", b"12345678901")
+    assert cache.get("d") is None
@@ -0,0 +1,135 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from plot.density import DENSITY_LEVELS, DensityPyramid
+from plot.encoding import NO_CLUSTER
+
+
+def random_points(seed: int, n: int = 3000):
+    rng = np.random.default_rng(seed)
+    return (
+        rng.random(n) * 10,
+        rng.random(n) * 10,
+        rng.integers(0, 5, n),
+        rng.integers(-1, 4, n),
+    )
+
+
+def brute_force(
+    xs, ys, codes, clusters, level: int, origin=(0.0, 0.0), size: float = 10.0
+):
+    """Bin key -> [count, code counts, cluster counts] of the points"""
+    bins_per_axis = 2**level
+    bx = np.minimum(
+        ((xs - origin[0]) / size * bins_per_axis).astype(int), bins_per_axis - 1
+    )
+    by = np.minimum(
+        ((ys - origin[1]) / size * bins_per_axis).astype(int), bins_per_axis - 1
+    )
+    bins = {}
+    for key, code, cluster in zip(by * bins_per_axis + bx, codes, clusters):
+        count, code_counts, cluster_counts = bins.setdefault(
+            int(key), [0, Counter(), Counter()]
+        )
+        bins[int(key)][0] = count + 1
+        code_counts[int(code)] += 1
+        if cluster != NO_CLUSTER:
+            cluster_counts[int(cluster)] += 1
+    return bins
+
+
+def as_bins(result):
+    bins_per_axis = 2 ** result["level"]
+    return {
+        b["y"] * bins_per_axis
+        + b["x"]: [b["count"], Counter(b["codes"]), Counter(b["clusters"])]
+        for b in result["bins"]
+    }
+
+
+@pytest.mark.parametrize("level", [0, 1, 4, DENSITY_LEVELS])
+def test_levels_match_brute_force(level):
+    xs, ys, codes, clusters = random_points(0)
+    pyramid = DensityPyramid((0.0, 0.0), 10.0)
+    pyramid.update(xs, ys, codes, clusters)
+    result = pyramid.query(level, 0.0, 0.0, 10.0, 10.0)
+    assert result["bin_size"] == 10.0 / 2**level
+    assert as_bins(result) == brute_force(xs, ys, codes, clusters, level)
+    assert sum(b["count"] for b in result["bins"]) == len(xs)
+
+
+def test_query_returns_the_overlapping_bins():
+    xs, ys, codes, clusters = random_points(1)
+    pyramid = DensityPyramid((0.0, 0.0), 10.0)
+    pyramid.update(xs, ys, codes, clusters)
+    level = 3
+    expected = {
+        key: value
+        for key, value in brute_force(xs, ys, codes, clusters, level).items()
+        # bins of 1.25, bounds 2.6 to 5.0 overlap columns 2 to 3 and rows 0 to 3
+        if 2 <= key % 8 <= 3 and key // 8 <= 3
+    }
+    assert as_bins(pyramid.query(level, 2.6, -5.0, 5.0, 5.0)) == expected
+    assert pyramid.query(level, 20.0, 20.0, 30.0, 30.0)["bins"] == []
+    # levels are clamped
+    assert pyramid.query(DENSITY_LEVELS + 3, 0, 0, 10, 10)["level"] == DENSITY_LEVELS
+
+
+def test_removing_points_restores_the_counts():
+    xs, ys, codes, clusters = random_points(2)
+    pyramid = DensityPyramid((0.0, 0.0), 10.0)
+    pyramid.update(xs, ys, codes, clusters)
+    copy = pyramid.copy()
+    copy.update(xs[:1000], ys[:1000], codes[:1000], clusters[:1000], weight=-1)
+    expected = brute_force(xs[1000:], ys[1000:], codes[1000:], clusters[1000:], 5)
+    assert as_bins(copy.query(5, 0, 0, 10, 10)) == expected
+    # the copy does not change the original
+    assert sum(b["count"] for b in pyramid.query(0, 0, 0, 10, 10)["bins"]) == len(xs)
+    copy.update(xs[1000:], ys[1000:], codes[1000:], clusters[1000:], weight=-1)
+    for level in range(DENSITY_LEVELS + 1):
+        assert copy.query(level, 0, 0, 10, 10)["bins"] == []
+        assert len(copy.totals[level][0]) == len(copy.codes[level][0]) == 0
+
+
+def test_incremental_update_matches_a_full_rebuild():
+    # the index module imports the database session
+    plot_index = pytest.importorskip(
+        "plot.index", reason="Backend environment unavailable"
+    )
+    rng = np.random.default_rng(3)
+    n = 4000
+    ids = np.arange(n)
+    xs, ys = rng.random(n) * 10, rng.random(n) * 10
+    codes, clusters = rng.integers(0, 5, n), rng.integers(-1, 4, n)
+    previous = plot_index.PlotIndex(ids, xs, ys, codes, clusters)
+    previous.density
+
+    # delete, move, recode, recluster and add points, all inside the previous extent
+    keep = rng.random(n) > 0.1
+    ids, xs, ys = ids[keep], xs[keep].copy(), ys[keep].copy()
+    codes, clusters = codes[keep].copy(), clusters[keep].copy()
+    changed = rng.random(len(ids)) < 0.2
+    xs[changed] = rng.random(changed.sum()) * 9
+    codes[rng.random(len(ids)) < 0.1] = 7
+    clusters[rng.random(len(ids)) < 0.1] = NO_CLUSTER
+    ids = np.concatenate([ids, np.arange(n, n + 300)])
+    xs, ys = np.concatenate([xs, rng.random(300) * 9]), np.concatenate(
+        [ys, rng.random(300) * 9]
+    )
+    codes = np.concatenate([codes, rng.integers(0, 8, 300)])
+    clusters = np.concatenate([clusters, rng.integers(-1, 4, 300)])
+
+    incremental = plot_index.PlotIndex(ids, xs, ys, codes, clusters, previous=previous)
+    rebuilt = DensityPyramid(incremental.origin, incremental.size)
+    rebuilt.update(
+        incremental.xs, incremental.ys, incremental.codes, incremental.clusters
+    )
+    assert incremental._density is not None
+    for level in range(DENSITY_LEVELS + 1):
+        for name in ("totals", "codes", "clusters"):
+            keys, counts = getattr(incremental.density, name)[level]
+            expected_keys, expected_counts = getattr(rebuilt, name)[level]
+            assert np.array_equal(keys, expected_keys)
+            assert np.array_equal(counts, expected_counts)
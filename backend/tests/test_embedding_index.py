@@ -0,0 +1,115 @@
+import contextlib
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+# the index module imports the database session
+embedding_index = pytest.importorskip(
+    "embeddings.index", reason="Backend environment unavailable"
+)
+
+from utilities.string_operations import env  # noqa: E402
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setitem(env, "exported_folder", str(tmp_path))
+    monkeypatch.setattr(embedding_index, "SIMILARITY_BLOCK_SIZE", 64)
+    rng = np.random.default_rng(0)
+    index = embedding_index.EmbeddingIndex(1, "model")
+    index.append(np.arange(100, 400), rng.normal(size=(300, 8)), 300)
+    return index
+
+
+def brute_force(index, vector, masked=()):
+    vectors = embedding_index.normalize_rows(np.asarray(index.vectors))
+    scores = vectors @ embedding_index.normalize_rows(vector)
+    scores[list(masked)] = -np.inf
+    return np.argsort(-scores, kind="stable"), scores
+
+
+def test_most_similar_matches_brute_force(index):
+    for position in (0, 63, 64, 150, 299):
+        positions, scores = index.most_similar(
+            index.vectors[position], 10, exclude=position
+        )
+        expected, expected_scores = brute_force(
+            index, index.vectors[position], [position]
+        )
+        assert positions.tolist() == expected[:10].tolist()
+        assert np.allclose(scores, expected_scores[expected[:10]])
+    assert len(index.most_similar(index.vectors[0], 1000, exclude=0)[0]) == 299
+
+
+def test_deleted_rows_do_not_shrink_the_results(index):
+    vector = index.vectors[5]
+    first, _ = index.most_similar(vector, 10, exclude=5)
+    index.mark_deleted(first[:4])
+    positions, _ = index.most_similar(vector, 10, exclude=5)
+    assert len(positions) == 10
+    assert not set(positions.tolist()) & set(first[:4].tolist())
+    expected, _ = brute_force(index, vector, [5, *first[:4]])
+    assert positions.tolist() == expected[:10].tolist()
+
+
+def test_positions(index):
+    assert index.position(100) == 0
+    assert index.position(399) == 299
+    assert index.position(99) is None
+    index.append([1000, 100], np.ones((2, 8)), 302)
+    # the first row of a segment wins
+    assert index.position(1000) == 300 and index.position(100) == 0
+    index.mark_deleted([1])
+    index.clear()
+    assert index.position(100) is None and index.deleted == frozenset()
+    index.append([7], np.ones((1, 8)), 1)
+    assert index.position(7) == 0
+
+
+def test_reload_sees_rows_appended_by_other_workers(index):
+    other = embedding_index.EmbeddingIndex(1, "model")
+    other.append([5000], np.ones((1, 8)), 301)
+    assert index.position(5000) is None
+    index.reload()
+    assert index.position(5000) == 300 and len(index) == 301
+
+
+def test_indexes_sync_under_their_own_lock(tmp_path, monkeypatch):
+    monkeypatch.setitem(env, "exported_folder", str(tmp_path))
+    cache = embedding_index.EmbeddingIndexCache()
+    entered = {key: threading.Event() for key in ("a", "b")}
+    release = threading.Event()
+
+    def sync(db, index, model_id):
+        entered[model_id].set()
+        assert release.wait(5)
+
+    monkeypatch.setattr(cache, "_sync", sync)
+    monkeypatch.setattr(
+        embedding_index, "single_flight", lambda *key: contextlib.nullcontext()
+    )
+    monkeypatch.setattr(embedding_index, "get_count", lambda *args: 0)
+
+    class Session:
+        def query(self, *columns):
+            return self
+
+        def filter(self, *conditions):
+            return self
+
+    threads = [
+        threading.Thread(
+            target=cache.get,
+            args=(Session(), 1, SimpleNamespace(model_hash=key, model_id=key)),
+        )
+        for key in entered
+    ]
+    for thread in threads:
+        thread.start()
+    # both syncs run at the same time
+    assert all(event.wait(5) for event in entered.values())
+    release.set()
+    for thread in threads:
+        thread.join()
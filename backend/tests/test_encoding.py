@@ -0,0 +1,104 @@
+import asyncio
+import struct
+from collections import namedtuple
+
+import numpy as np
+import pytest
+
+from plot.encoding import (
+    NO_CLUSTER,
+    PLOT_MAGIC,
+    binary_plot_chunks,
+    binary_plot_response,
+    encode_plot_rows,
+)
+
+Row = namedtuple("Row", "id sentence segment code x y cluster")
+ROWS = [
+    Row(
+        i,
+        f"sentence {i // 4}",
+        f"ségment {i}",
+        i % 3,
+        i / 2,
+        -i,
+        None if i % 5 else i % 7,
+    )
+    for i in range(25)
+]
+
+
+def decode_plot(content: bytes, offset: int = 0):
+    """Decode one buffer of plot.encoding, returns the rows and the offset after it"""
+    magic, _, n, m = struct.unpack_from("<4sIII", content, offset)
+    assert magic == PLOT_MAGIC
+    offset += 16
+    columns = {}
+    for name, dtype in [("x", "<f4"), ("y", "<f4")] + [
+        (name, "<i4") for name in ("id", "code", "cluster", "segment", "sentence")
+    ]:
+        columns[name] = np.frombuffer(content, dtype, n, offset)
+        offset += 4 * n
+    string_offsets = np.frombuffer(content, "<u4", m + 1, offset)
+    offset += 4 * (m + 1)
+    data = content[offset : offset + int(string_offsets[-1])]
+    strings = [
+        data[start:end].decode("utf-8")
+        for start, end in zip(string_offsets[:-1], string_offsets[1:])
+    ]
+    offset += int(string_offsets[-1])
+    rows = [
+        Row(
+            int(columns["id"][i]),
+            strings[columns["sentence"][i]],
+            strings[columns["segment"][i]],
+            int(columns["code"][i]),
+            float(columns["x"][i]),
+            float(columns["y"][i]),
+            None if columns["cluster"][i] == NO_CLUSTER else int(columns["cluster"][i]),
+        )
+        for i in range(n)
+    ]
+    return rows, offset + -offset % 4
+
+
+def decode_stream(content: bytes):
+    rows, offset, buffers = [], 0, 0
+    while offset < len(content):
+        buffer_rows, offset = decode_plot(content, offset)
+        rows += buffer_rows
+        buffers += 1
+    assert offset == len(content)
+    return rows, buffers
+
+
+def test_encode_round_trip():
+    assert decode_plot(encode_plot_rows(ROWS))[0] == ROWS
+
+
+@pytest.mark.parametrize("chunk_size, buffers", [(1, 25), (7, 4), (25, 1), (100, 1)])
+def test_chunks_are_aligned_buffers(chunk_size, buffers):
+    chunks = list(binary_plot_chunks(iter(ROWS), chunk_size))
+    assert len(chunks) == buffers
+    assert all(len(chunk) % 4 == 0 for chunk in chunks)
+    assert decode_stream(b"".join(chunks)) == (ROWS, buffers)
+
+
+def test_chunks_of_an_empty_plot():
+    chunks = list(binary_plot_chunks([], 10))
+    assert decode_stream(b"".join(chunks)) == ([], 1)
+
+
+def test_streamed_response():
+    response = binary_plot_response(iter(ROWS), 10, count=25, version=3)
+    assert response.headers["x-plot-chunk-size"] == "10"
+    assert response.headers["x-plot-count"] == "25"
+    assert "x-plot-length" not in response.headers
+
+    async def body():
+        return b"".join([chunk async for chunk in response.body_iterator])
+
+    assert decode_stream(asyncio.run(body())) == (ROWS, 3)
+    whole = binary_plot_response(ROWS, count=25)
+    assert whole.headers["x-plot-length"] == "25"
+    assert decode_plot(whole.body)[0] == ROWS
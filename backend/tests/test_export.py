@@ -0,0 +1,188 @@
+import csv
+import json
+import os
+import sys
+from collections import namedtuple
+
+import pytest
+
+# the export module imports the database session
+export = pytest.importorskip("plot.export", reason="Backend environment unavailable")
+
+Row = namedtuple("Row", "id sentence_id sentence segment start_position code x y cluster")
+
+
+def make_row(i: int) -> Row:
+    # every sixth row has no cluster and texts that need quoting
+    special = i % 6 == 0
+    return Row(
+        id=i,
+        sentence_id=i // 3,
+        sentence=f'sentence, "{i // 3}"' if special else f"sentence {i // 3}",
+        segment=f"segment\n{i}" if special else f"segment {i}",
+        start_position=i % 5,
+        code=i % 4,
+        x=i / 7,
+        y=-i / 3,
+        cluster=None if special else i % 3,
+    )
+
+
+ROWS = [make_row(i) for i in range(40)]
+ENTRIES = [export.plot_rows_to_dicts([row])[0] for row in ROWS]
+
+
+@pytest.fixture
+def plot(monkeypatch):
+    """export_plot over ROWS instead of the database, the counted query has ROWS"""
+    streams = []
+
+    def stream_plot_rows(reduction_model_id, cluster_model_id):
+        streams.append((reduction_model_id, cluster_model_id))
+        yield from ROWS
+
+    monkeypatch.setattr(export, "EXPORT_CHUNK_SIZE", 7)
+    monkeypatch.setattr(export, "ProjectService", lambda project_id, db: project_id)
+    monkeypatch.setattr(export, "get_plot_model_ids", lambda project_id: (11, 12))
+    monkeypatch.setattr(
+        export, "plot_rows_query", lambda db, *model_ids: ("query", model_ids)
+    )
+    monkeypatch.setattr(
+        export,
+        "get_count",
+        lambda db, project_id, key, query: len(ROWS) if key == "plot:11" else 0,
+    )
+    monkeypatch.setattr(export, "stream_plot_rows", stream_plot_rows)
+    return streams
+
+
+def read_export(path: str, format: str):
+    """The entries of an export file, with the values as written to the format"""
+    if format == "csv":
+        with open(path, newline="", encoding="utf-8") as file:
+            return list(csv.DictReader(file))
+    if format == "json":
+        with open(path, encoding="utf-8") as file:
+            return json.load(file)
+    if format == "jsonl":
+        with open(path, encoding="utf-8") as file:
+            return [json.loads(line) for line in file]
+    if format == "parquet":
+        import pyarrow.parquet
+
+        return pyarrow.parquet.read_table(path).to_pylist()
+
+
+def csv_entry(entry):
+    return {
+        "id": str(entry["id"]),
+        "sentence": entry["sentence"],
+        "segment": entry["segment"],
+        "cluster": "" if entry["cluster"] is None else str(entry["cluster"]),
+        "x": str(entry["reduced_embedding"]["x"]),
+        "y": str(entry["reduced_embedding"]["y"]),
+        "code": str(entry["code"]),
+    }
+
+
+def parquet_entry(entry):
+    entry = dict(entry)
+    position = entry.pop("reduced_embedding")
+    return {**entry, "x": position["x"], "y": position["y"]}
+
+
+@pytest.mark.parametrize("format", export.EXPORT_FORMATS)
+@pytest.mark.parametrize("chunks", [[ENTRIES], [ENTRIES[:3], [], ENTRIES[3:]], []])
+def test_writers_round_trip(tmp_path, format, chunks):
+    if format == "parquet":
+        pytest.importorskip("pyarrow")
+    path = str(tmp_path / f"plot.{format}")
+    writer = export.EXPORT_WRITERS[format](path)
+    for chunk in chunks:
+        writer.write(chunk)
+    writer.finish()
+    entries = [entry for chunk in chunks for entry in chunk]
+    expected = {"csv": map(csv_entry, entries), "parquet": map(parquet_entry, entries)}
+    assert read_export(path, format) == list(expected.get(format, entries))
+
+
+@pytest.mark.parametrize("formats", [["csv", "jsonl", "parquet"], ["json"]])
+def test_export_plot(tmp_path, plot, formats):
+    if "parquet" in formats:
+        pytest.importorskip("pyarrow")
+    progress = []
+    count, paths = export.export_plot(
+        None,
+        1,
+        formats + formats[:1],
+        str(tmp_path),
+        lambda rows, total: progress.append((rows, total)),
+    )
+    assert count == len(ROWS)
+    assert plot == [(11, 12)]
+    assert sorted(paths) == sorted(formats)
+    for format, path in paths.items():
+        assert path == str(tmp_path / f"plot_1.{format}")
+        assert len(read_export(path, format)) == len(ROWS)
+        assert os.stat(path).st_mode & 0o777 == 0o644
+    assert progress == [
+        (0, 40),
+        (7, 40),
+        (14, 40),
+        (21, 40),
+        (28, 40),
+        (35, 40),
+        (40, 40),
+    ]
+    # no temporary files are left
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        os.path.basename(p) for p in paths.values()
+    )
+
+
+def test_failed_export_keeps_the_previous_files(tmp_path, plot, monkeypatch):
+    previous = tmp_path / "plot_1.csv"
+    previous.write_text("previous")
+
+    def failing_rows(reduction_model_id, cluster_model_id):
+        yield from ROWS[:10]
+        raise RuntimeError("connection lost")
+
+    monkeypatch.setattr(export, "stream_plot_rows", failing_rows)
+    with pytest.raises(RuntimeError):
+        export.export_plot(None, 1, ["csv", "json"], str(tmp_path))
+    assert previous.read_text() == "previous"
+    assert os.listdir(tmp_path) == ["plot_1.csv"]
+
+
+def test_unknown_formats_are_rejected(plot):
+    with pytest.raises(export.HTTPException) as error:
+        export.export_plot(None, 1, ["csv", "xml"])
+    assert error.value.status_code == 400
+    with pytest.raises(export.HTTPException):
+        export.export_plot(None, 1, [])
+
+
+def test_cli(tmp_path, plot, monkeypatch):
+    sessions = []
+
+    class Session:
+        def close(self):
+            sessions.append("closed")
+
+    monkeypatch.setattr(export, "SessionLocal", Session)
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["export", "1", "--formats", "jsonl", "csv", "--output", str(tmp_path)],
+    )
+    export.main()
+    assert sessions == ["closed"]
+    assert read_export(str(tmp_path / "plot_1.jsonl"), "jsonl") == ENTRIES
+    assert read_export(str(tmp_path / "plot_1.csv"), "csv") == list(
+        map(csv_entry, ENTRIES)
+    )
+
+    monkeypatch.setattr(sys, "argv", ["export", "1", "--formats", "xml"])
+    with pytest.raises(SystemExit):
+        export.main()
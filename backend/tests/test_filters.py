@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from plot.filters import PlotFilters
+
+# 1 -> 2 -> 4, 1 -> 3, 5
+CODE_PARENTS = {1: None, 2: 1, 3: 1, 4: 2, 5: None}
+
+
+class Points:
+    """The columns of a PlotIndex that the filters read"""
+
+    def __init__(self, seed: int = 0, n: int = 1001):
+        rng = np.random.default_rng(seed)
+        self.codes = rng.integers(1, 6, n)
+        self.clusters = rng.integers(-1, 4, n)
+        self.datasets = rng.integers(0, 3, n)
+        self.code_parents = CODE_PARENTS
+
+    def __len__(self):
+        return len(self.codes)
+
+
+@pytest.fixture(scope="module")
+def points():
+    return Points()
+
+
+def test_subtree_codes(points):
+    filters = PlotFilters(points)
+    assert filters.subtree_codes(1) == {1, 2, 3, 4}
+    assert filters.subtree_codes(2) == {2, 4}
+    assert filters.subtree_codes(5) == {5}
+
+
+@pytest.mark.parametrize(
+    "code_ids, clusters, dataset_ids, subtree",
+    [
+        ([1], [], [], True),
+        ([1], [], [], False),
+        ([2, 5], [0, 3], [], True),
+        ([], [-1], [2], True),
+        ([4], [0, 1, 2], [0, 1], False),
+        ([], [], [], True),
+        ([6], [], [], True),
+    ],
+)
+def test_select_matches_brute_force(points, code_ids, clusters, dataset_ids, subtree):
+    filters = PlotFilters(points)
+    codes = set(code_ids)
+    if subtree:
+        codes = set().union(*(filters.subtree_codes(code) for code in code_ids))
+    mask = np.ones(len(points), dtype=bool)
+    if code_ids:
+        mask &= np.isin(points.codes, list(codes))
+    if clusters:
+        mask &= np.isin(points.clusters, clusters)
+    if dataset_ids:
+        mask &= np.isin(points.datasets, dataset_ids)
+    assert np.array_equal(
+        filters.select(code_ids, clusters, dataset_ids, subtree), np.nonzero(mask)[0]
+    )
+
+
+def test_bitsets_are_cached(points):
+    filters = PlotFilters(points)
+    assert filters.code(1) is filters.code(1)
+    assert filters.cluster(2) is filters.cluster(2)
+    # the subtree bitset of a leaf equals its own bitset
+    assert np.array_equal(filters.code(4), filters.code(4, subtree=False))
@@ -0,0 +1,58 @@
+import time
+
+import pytest
+
+PIPELINE_TIMEOUT = 900
+
+
+def wait_for_pipeline(client, project_id: int):
+    deadline = time.monotonic() + PIPELINE_TIMEOUT
+    while True:
+        status = client.get(f"/projects/{project_id}/plots/pipeline/").json()
+        if status["status"] in ("done", "failed"):
+            return status
+        assert (
+            time.monotonic() < deadline
+        ), f"Pipeline still {status} after {PIPELINE_TIMEOUT}s"
+        time.sleep(1)
+
+
+def cluster_count(client, project_id: int) -> int:
+    return client.get(f"/projects/{project_id}/plots/stats/cluster/").json()[
+        "cluster_count"
+    ]
+
+
+@pytest.fixture(scope="module")
+def dynamic_project(client):
+    """A project with the test dataset and a dynamic reduction model, pipeline finished"""
+    config = client.post(
+        "/configs/",
+        json={"name": "pytest", "reduction_config": {"model_name": "dynamic_umap"}},
+    ).json()
+    project_id = client.post("/projects/", params={"project_name": "pytest"}).json()[
+        "data"
+    ]["project_id"]
+    client.put(f"/projects/{project_id}/config/{config['config_id']}/")
+    response = client.post(
+        f"/projects/{project_id}/datasets/test", params={"dataset_name": "few_ner_small"}
+    )
+    assert response.status_code == 200
+    client.post(f"/projects/{project_id}/plots/pipeline/")
+    assert wait_for_pipeline(client, project_id)["status"] == "done"
+    yield project_id
+    client.delete(f"/projects/{project_id}/")
+
+
+@pytest.mark.parametrize(
+    "path, body",
+    [("cluster", None), ("correction", [])],
+)
+def test_dynamic_training_restores_clusters(client, dynamic_project, path, body):
+    assert cluster_count(client, dynamic_project) > 0
+    response = client.post(
+        f"/projects/{dynamic_project}/dynamic/{path}", params={"epochs": 1}, json=body
+    )
+    assert response.status_code == 200
+    assert wait_for_pipeline(client, dynamic_project)["status"] == "done"
+    assert cluster_count(client, dynamic_project) > 0
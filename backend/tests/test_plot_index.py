@@ -0,0 +1,219 @@
+import numpy as np
+import pytest
+
+# the index module imports the database session
+plot_index = pytest.importorskip("plot.index", reason="Backend environment unavailable")
+
+from plot.encoding import NO_CLUSTER  # noqa: E402
+
+PlotIndex, PlotIndexCache = plot_index.PlotIndex, plot_index.PlotIndexCache
+
+
+def random_index(seed: int = 0, n: int = 5000, previous: PlotIndex = None):
+    rng = np.random.default_rng(seed)
+    return PlotIndex(
+        ids=np.arange(0, 2 * n, 2),
+        xs=rng.normal(size=n),
+        ys=rng.normal(size=n) * 3,
+        codes=rng.integers(0, 6, n),
+        clusters=rng.integers(-1, 8, n),
+        datasets=rng.integers(0, 3, n),
+        previous=previous,
+    )
+
+
+def inside_polygon(x: float, y: float, vertices) -> bool:
+    inside = False
+    for (x0, y0), (x1, y1) in zip(vertices, vertices[-1:] + vertices[:-1]):
+        if (y0 > y) != (y1 > y) and x < (x1 - x0) * (y - y0) / (y1 - y0) + x0:
+            inside = not inside
+    return inside
+
+
+@pytest.fixture(scope="module")
+def index():
+    return random_index()
+
+
+@pytest.mark.parametrize(
+    "bounds",
+    [
+        (-1.0, -2.0, 0.5, 1.0),
+        (-10.0, -10.0, 10.0, 10.0),
+        (0.3, 0.3, 0.31, 0.31),
+        (1.0, 1.0, 0.0, 2.0),
+    ],
+)
+def test_query_bbox_matches_brute_force(index, bounds):
+    min_x, min_y, max_x, max_y = bounds
+    expected = np.nonzero(
+        (index.xs >= min_x)
+        & (index.xs < max_x)
+        & (index.ys >= min_y)
+        & (index.ys < max_y)
+    )[0]
+    assert np.array_equal(np.sort(index.query_bbox(*bounds)), expected)
+
+
+def test_tiles_partition_the_points(index):
+    z = 3
+    counts = [
+        len(index.query_bbox(*index.tile_bounds(z, x, y)))
+        for x in range(2**z)
+        for y in range(2**z)
+    ]
+    assert sum(counts) == len(index)
+
+
+def test_query_polygon_matches_brute_force(index):
+    vertices = [[-1.0, -2.0], [1.5, -1.0], [0.5, 3.0], [-2.0, 1.0]]
+    expected = [
+        i
+        for i in range(len(index))
+        if inside_polygon(float(index.xs[i]), float(index.ys[i]), vertices)
+    ]
+    assert index.query_polygon(vertices).tolist() == expected
+    assert len(index.query_polygon(vertices[:2])) == 0
+
+
+def test_query_circle_matches_brute_force(index):
+    expected = np.nonzero(np.hypot(index.xs - 0.3, index.ys - 0.2) <= 1.1)[0]
+    assert np.array_equal(index.query_circle(0.3, 0.2, 1.1), expected)
+
+
+def test_nearest_matches_brute_force(index):
+    rng = np.random.default_rng(1)
+    for i in rng.integers(0, len(index), 30):
+        k = int(rng.integers(1, 50))
+        indexes, distances = index.nearest(int(i), k)
+        brute = np.hypot(index.xs - index.xs[i], index.ys - index.ys[i])
+        brute[i] = np.inf
+        assert np.allclose(distances, np.sort(brute)[:k])
+        found = np.hypot(index.xs[indexes] - index.xs[i], index.ys[indexes] - index.ys[i])
+        assert np.allclose(found, distances)
+        assert i not in indexes
+
+
+def test_nearest_returns_all_points_for_large_k(index):
+    indexes, distances = index.nearest(0, len(index) + 5)
+    assert len(indexes) == len(index) - 1
+    assert np.all(np.diff(distances) >= 0)
+
+
+def test_position(index):
+    assert index.position(4) == 2
+    assert index.position(5) is None
+    assert index.position(10**9) is None
+
+
+def test_limit_keeps_the_lowest_ranks(index):
+    indexes = index.query_bbox(-1.0, -1.0, 1.0, 1.0)
+    selected = index.limit(indexes, 100)
+    assert len(selected) == 100
+    assert index.rank[selected].max() < np.sort(index.rank[indexes])[100]
+    assert np.array_equal(np.sort(index.limit(indexes, 100)), np.sort(selected))
+    assert np.array_equal(index.limit(indexes, len(indexes)), indexes)
+
+
+def test_limit_is_stable_when_zooming_in(index):
+    # points kept in a tile are kept in the tiles inside it
+    outer = set(index.limit(index.query_bbox(-2.0, -2.0, 2.0, 2.0), 500).tolist())
+    inner_points = index.query_bbox(-1.0, -1.0, 1.0, 1.0)
+    inner = set(index.limit(inner_points, 500).tolist())
+    assert outer & set(inner_points.tolist()) <= inner
+
+
+def test_sample_is_stratified_and_deterministic():
+    n = 20000
+    rng = np.random.default_rng(2)
+    codes = np.concatenate([rng.integers(0, 5, n - 30), np.full(30, 99)])
+    clusters = np.concatenate([rng.integers(-1, 4, n - 30), np.zeros(30)])
+    index = PlotIndex(np.arange(n), rng.random(n), rng.random(n), codes, clusters)
+    sample = index.sample(1000)
+    assert len(sample) == 1000
+    assert len(np.unique(sample)) == 1000
+    assert np.all(np.diff(sample) > 0)
+    # the rare code keeps at least its minimum, proportionally it would get 1 or 2 points
+    assert (index.codes[sample] == 99).sum() >= plot_index.SAMPLE_STRATUM_MINIMUM
+    assert np.array_equal(index.sample(1000), sample)
+    assert np.array_equal(index.sample(n + 1), np.arange(n))
+
+
+def test_to_dicts(index):
+    clusters = index.clusters.copy()
+    clusters[0] = NO_CLUSTER
+    index = PlotIndex(
+        index.ids, index.xs, index.ys, index.codes, clusters, index.datasets
+    )
+    point = index.to_dicts([0])[0]
+    assert point["id"] == 0 and point["cluster"] is None
+    assert point["reduced_embedding"] == {
+        "x": float(index.xs[0]),
+        "y": float(index.ys[0]),
+    }
+
+
+def test_previous_extent_is_kept_if_it_covers_the_points():
+    previous = random_index()
+    shrunk = PlotIndex(
+        previous.ids[:-10],
+        previous.xs[:-10],
+        previous.ys[:-10],
+        previous.codes[:-10],
+        previous.clusters[:-10],
+        previous=previous,
+    )
+    assert (shrunk.origin, shrunk.size) == (previous.origin, previous.size)
+    moved = PlotIndex(
+        previous.ids,
+        previous.xs + 100,
+        previous.ys,
+        previous.codes,
+        previous.clusters,
+        previous=previous,
+    )
+    assert moved.origin != previous.origin
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    """A PlotIndexCache over fake projects, the test controls versions and builds"""
+    versions = {}
+    builds = []
+
+    monkeypatch.setattr(plot_index, "PLOT_SNAPSHOT_SERVING", False)
+    monkeypatch.setattr(plot_index, "ProjectService", lambda project_id, db: project_id)
+    monkeypatch.setattr(
+        plot_index, "get_plot_model_ids", lambda project_id: (project_id, None)
+    )
+    monkeypatch.setattr(
+        plot_index, "get_version", lambda db, project_id: versions.get(project_id, 0)
+    )
+
+    def build(self, db, project_id, reduction_model_id, cluster_model_id, previous):
+        builds.append((project_id, previous))
+        return random_index(project_id, n=100, previous=previous)
+
+    monkeypatch.setattr(PlotIndexCache, "_build", build)
+    cache = PlotIndexCache(max_projects=2)
+    cache.versions, cache.builds = versions, builds
+    return cache
+
+
+def test_cache_rebuilds_on_new_versions_with_the_previous_index(cache):
+    first = cache.get(None, 1)
+    assert cache.get(None, 1) is first
+    cache.versions[1] = 1
+    second = cache.get(None, 1)
+    assert second is not first
+    assert cache.builds == [(1, None), (1, first)]
+
+
+def test_cache_evicts_the_least_recently_used_project(cache):
+    cache.get(None, 1)
+    cache.get(None, 2)
+    cache.get(None, 1)
+    cache.get(None, 3)
+    assert list(cache._indexes) == [1, 3]
+    cache.get(None, 2)
+    assert [project_id for project_id, _ in cache.builds] == [1, 2, 3, 2]
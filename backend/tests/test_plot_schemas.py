@@ -0,0 +1,215 @@
+"""Representative responses of the plot routes, validated against plot.schemas"""
+
+import asyncio
+import json
+import struct
+from collections import namedtuple
+
+import numpy as np
+import pytest
+from starlette.requests import Request
+
+from plot.schemas import (
+    ClusterStats,
+    CodeStatsResponse,
+    DensityTile,
+    NormalizedPlotTable,
+    PlotExtent,
+    PlotNeighbors,
+    PlotSelection,
+    PlotTable,
+    PlotTile,
+    ProjectStats,
+    SelectionArea,
+    SelectionCircle,
+)
+
+# the router and the index import the database session
+router = pytest.importorskip("plot.router", reason="Backend environment unavailable")
+plot_index = pytest.importorskip("plot.index", reason="Backend environment unavailable")
+plot_stats = pytest.importorskip("plot.stats", reason="Backend environment unavailable")
+
+from db.counters import PROJECT_COUNTS  # noqa: E402
+
+Row = namedtuple("Row", "id sentence_id sentence segment start_position code x y cluster")
+ROWS = [
+    Row(
+        id=i,
+        sentence_id=i // 2,
+        sentence=f"sentence {i // 2}",
+        segment=f"segment {i}",
+        start_position=i,
+        code=i % 3,
+        x=i / 3,
+        y=-i / 5,
+        cluster=i % 4 or None,
+    )
+    for i in range(12)
+]
+PIPELINE = {"status": "done", "stage": None, "error": None}
+
+
+def body(response):
+    return json.loads(response.body) if hasattr(response, "body") else response
+
+
+class FakeQuery:
+    """A query of the stats routes, all() and iteration return the rows"""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def filter(self, *conditions):
+        return self
+
+    outerjoin = group_by = order_by = filter
+
+    def all(self):
+        return self.rows
+
+    def first(self):
+        return self.rows[0]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class FakeSession:
+    """Answers the queries of a route in order"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+
+    def query(self, *columns):
+        return FakeQuery(self.results.pop(0))
+
+
+@pytest.fixture
+def index(monkeypatch):
+    rng = np.random.default_rng(0)
+    n = 200
+    clusters = rng.integers(-1, 4, n)
+    clusters[:10] = plot_index.NO_CLUSTER
+    index = plot_index.PlotIndex(
+        np.arange(n), rng.random(n), rng.random(n), rng.integers(0, 5, n), clusters
+    )
+
+    class Cache:
+        def get(self, db, project_id):
+            return index
+
+    monkeypatch.setattr(router, "plot_index_cache", Cache())
+    return index
+
+
+@pytest.mark.parametrize(
+    "format, schema", [("json", PlotTable), ("normalized", NormalizedPlotTable)]
+)
+@pytest.mark.parametrize("paged", [True, False])
+def test_plot_tables(format, schema, paged):
+    response = {"version": 3}
+    if paged:
+        response.update({"page": 0, "page_size": 12, "next_cursor": 11})
+    plot = body(
+        router.plot_response(ROWS, response, format, '"3-a"', len(ROWS), PIPELINE)
+    )
+    table = schema.parse_obj(plot)
+    assert table.length == table.count == len(ROWS)
+    assert [point.id for point in table.data] == [row.id for row in ROWS]
+    if format == "normalized":
+        assert table.sentences[0] == "sentence 0"
+
+
+def test_plot_rows_conversions():
+    entries = router.plot_rows_to_dicts(ROWS)
+    PlotTable.parse_obj({"length": len(entries), "data": entries})
+    points, sentences = router.plot_rows_to_normalized(ROWS)
+    NormalizedPlotTable.parse_obj(
+        {"length": len(points), "data": points, "sentences": sentences}
+    )
+
+
+def test_tiles(index):
+    PlotExtent.parse_obj(router.get_plot_extent(1, db=None))
+    tile = PlotTile.parse_obj(body(router.get_plot_tile(1, 1, 0, 1, budget=20, db=None)))
+    assert tile.length == len(tile.data) <= 20
+    bbox = PlotTile.parse_obj(body(router.get_plot_bbox(1, 0, 0, 0.5, 0.5, db=None)))
+    assert bbox.count == len(index.query_bbox(0, 0, 0.5, 0.5))
+
+
+def test_density(index):
+    tile = DensityTile.parse_obj(
+        body(router.get_density_tile(1, 0, 0, 0, resolution=4, db=None))
+    )
+    assert tile.level == 2
+    assert sum(bin.count for bin in tile.bins) == len(index)
+    assert all(sum(bin.codes.values()) == bin.count for bin in tile.bins)
+
+
+def test_select_and_neighbors(index):
+    area = SelectionArea(circle=SelectionCircle(x=0.5, y=0.5, radius=0.3))
+    selection = PlotSelection.parse_obj(body(router.select_plot_area(1, area, db=None)))
+    assert selection.length == len(index.query_circle(0.5, 0.5, 0.3))
+    area = SelectionArea(polygon=[[0, 0], [1, 0], [0, 1]])
+    PlotSelection.parse_obj(body(router.select_plot_area(1, area, db=None)))
+    neighbors = PlotNeighbors.parse_obj(
+        body(router.get_segment_neighbors(1, 7, k=5, db=None))
+    )
+    assert neighbors.id == 7 and neighbors.length == 5
+
+
+def test_code_stats(monkeypatch):
+    monkeypatch.setattr(plot_stats, "ProjectService", lambda project_id, db: None)
+    monkeypatch.setattr(plot_stats, "get_plot_model_ids", lambda project: (1, 2))
+    rows = [
+        (1, "root", None, 3, 2, 1.0, 2.0, 0.0, 0.5, 1.0, 1.5),
+        (2, "child", 1, 2, 2, 3.0, 1.0, 1.0, 0.0, 2.0, 1.0),
+        (3, "empty", None, 0, 0, None, None, None, None, None, None),
+    ]
+    stats = plot_stats.compute_code_stats(FakeSession(rows), 1, subtree=True)
+    response = CodeStatsResponse.parse_obj({"code_segments_count": stats})
+    root, child, empty = response.code_segments_count.codes
+    assert root.subtree.point_count == 4 and root.subtree.bounding_box.max_x == 2.0
+    assert empty.bounding_box is None and empty.subtree.segment_count == 0
+
+
+def test_cluster_stats(monkeypatch):
+    monkeypatch.setattr(plot_stats, "ProjectService", lambda project_id, db: None)
+    monkeypatch.setattr(plot_stats, "get_plot_model_ids", lambda project: (1, 2))
+    rows = [(0, 1, 3, 1.5, 3.0), (0, 2, 1, 0.5, 1.0), (1, None, 2, 2.0, 2.0)]
+    stats = plot_stats.compute_cluster_stats(FakeSession(rows, [(1, "code")]), 1)
+    stats.update({"project_id": 1, "project_name": "project"})
+    clusters = ClusterStats.parse_obj(stats)
+    assert clusters.cluster_count == 6 and clusters.unique_cluster_count == 2
+    assert clusters.cluster_info[0].dominant_code_text == "code"
+    assert clusters.cluster_info[1].dominant_code is None
+
+
+def test_project_stats(monkeypatch):
+    Project = namedtuple("Project", "project_id project_name")
+    counts = {name: 1 for name in PROJECT_COUNTS}
+    monkeypatch.setattr(router, "get_project_counts", lambda db, project_id: counts)
+    monkeypatch.setattr(router, "check_project_etag", lambda *args: ('"1-a"', None))
+    request = Request({"type": "http", "method": "GET", "path": "/", "headers": []})
+    db = FakeSession([Project(1, "project")])
+    stats = asyncio.run(router.project_endpoint(1, request, None, db))
+    assert ProjectStats.parse_obj(stats).embedding_count == 1
+
+
+@pytest.mark.parametrize("format", ["json", "normalized", "binary", "ndjson"])
+def test_plot_without_reduction_model(format, monkeypatch):
+    monkeypatch.setattr(router, "PLOT_SNAPSHOT_SERVING", False)
+    monkeypatch.setattr(router, "ProjectService", lambda project_id, db: None)
+    monkeypatch.setattr(router, "get_plot_model_ids", lambda project: (None, None))
+    monkeypatch.setattr(router.pipeline_runner, "ensure", lambda project_id: PIPELINE)
+    monkeypatch.setattr(router, "get_version", lambda db, project_id: 0)
+    response = asyncio.run(router.get_plot_endpoint(1, format=format, db=None))
+    if format in ("json", "normalized"):
+        table = PlotTable.parse_obj(body(response))
+        assert table.length == table.count == 0
+    else:
+        assert response.media_type != "application/json"
+        assert response.headers["x-plot-count"] == "0"
+        assert response.headers["x-plot-pipeline-status"] == "done"
+    if format == "binary":
+        assert struct.unpack_from("<4sIII", response.body)[2] == 0
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.elements import BinaryExpression
+
+# the search module imports the database session
+search = pytest.importorskip("plot.search", reason="Backend environment unavailable")
+
+from db.models import PlotPoint, Segment, Sentence  # noqa: E402
+
+# texts of the segments, the rank is the number of "apple" words, so most ranks tie
+TEXTS = ["apple"] * 5 + ["apple apple"] * 4 + ["apple pie apple apple"] * 3 + ["pear"] * 2
+
+
+@compiles(TSVECTOR, "sqlite")
+def compile_tsvector(type_, compiler, **kw):
+    return "TEXT"
+
+
+@compiles(BinaryExpression, "sqlite")
+def compile_match(binary, compiler, **kw):
+    if getattr(binary.operator, "opstring", None) == "@@":
+        left = compiler.process(binary.left, **kw)
+        right = compiler.process(binary.right, **kw)
+        return f"ts_match({left}, {right})"
+    return compiler.visit_binary(binary, **kw)
+
+
+def ts_rank(tsv, tsquery):
+    # a float4 value as Postgres returns it for ts_rank
+    return float(np.float32(tsv.split().count(tsquery) / 10)) if tsv else 0.0
+
+
+@pytest.fixture
+def db(monkeypatch):
+    engine = create_engine("sqlite://")
+
+    @event.listens_for(engine, "connect")
+    def functions(connection, record):
+        connection.create_function(
+            "to_tsvector", 2, lambda config, text: text, deterministic=True
+        )
+        connection.create_function("websearch_to_tsquery", 2, lambda config, query: query)
+        connection.create_function("ts_match", 2, lambda tsv, query: query in tsv.split())
+        connection.create_function("ts_rank", 2, ts_rank)
+
+    tables = [Sentence.__table__, Segment.__table__, PlotPoint.__table__]
+    Sentence.metadata.create_all(engine, tables=tables)
+    monkeypatch.setattr(search, "ProjectService", lambda project_id, db: None)
+    monkeypatch.setattr(search, "get_plot_model_ids", lambda project: (1, None))
+    with Session(engine) as db:
+        for i, text in enumerate(TEXTS):
+            db.add(Sentence(sentence_id=i, text=text))
+            db.add(Segment(segment_id=i, sentence_id=i, text=text, start_position=0))
+            db.add(
+                PlotPoint(
+                    reduced_embedding_id=i,
+                    project_id=1,
+                    embedding_model_id=1,
+                    reduction_model_id=1,
+                    segment_id=i,
+                    sentence_id=i,
+                    dataset_id=1,
+                    code_id=1,
+                    pos_x=i,
+                    pos_y=i,
+                )
+            )
+        db.commit()
+        yield db
+
+
+@pytest.mark.parametrize("limit", [1, 2, 4, 5, 12])
+def test_pages_continue_through_tied_ranks(db, limit):
+    pages, cursor = [], None
+    while True:
+        rows, cursor = search.search_plot(db, 1, "apple", limit=limit, cursor=cursor)
+        pages += [(row.rank, row.id) for row in rows]
+        if cursor is None:
+            break
+    expected = sorted(
+        ((ts_rank(text, "apple"), i) for i, text in enumerate(TEXTS) if "apple" in text),
+        key=lambda entry: (-entry[0], entry[1]),
+    )
+    assert pages == expected
+
+
+def test_rank_is_compared_as_double_precision(db):
+    statements = []
+
+    @event.listens_for(db.get_bind(), "before_cursor_execute")
+    def record(connection, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    search.search_plot(db, 1, "apple", limit=2, cursor="0.2:3")
+    # the select, the cursor predicate (twice) and the order by all use the cast rank
+    assert statements[-1].count("CAST(ts_rank(") == 4
@@ -0,0 +1,114 @@
+import contextlib
+import os
+import time
+from collections import namedtuple
+
+import pytest
+
+# the snapshot module imports the database session
+snapshot = pytest.importorskip("plot.snapshot", reason="Backend environment unavailable")
+
+Row = namedtuple(
+    "Row", "id sentence_id sentence segment start_position code x y cluster dataset"
+)
+ROWS = [
+    Row(
+        id=i,
+        sentence_id=i // 2,
+        sentence=f"sentence {i // 2}",
+        segment=f"ségment {i}",
+        start_position=i,
+        code=i % 3,
+        x=i / 4,
+        y=-i,
+        cluster=None if i % 4 == 0 else i % 2,
+        dataset=1,
+    )
+    for i in range(10)
+]
+
+
+class FakeSession:
+    """A session for the code query of write_plot_snapshot, the project has no codes"""
+
+    @staticmethod
+    def remove():
+        pass
+
+    def query(self, *columns):
+        return self
+
+    def filter(self, *conditions):
+        return iter([])
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    """Snapshots of project 1 in tmp_path, the test sets versions["current"]"""
+    versions = {"current": 1}
+    monkeypatch.setitem(snapshot.env, "exported_folder", str(tmp_path))
+    monkeypatch.setattr(snapshot, "single_flight", lambda *key: contextlib.nullcontext())
+    monkeypatch.setattr(snapshot, "ProjectService", lambda project_id, db: project_id)
+    monkeypatch.setattr(snapshot, "get_plot_model_ids", lambda project: (5, 6))
+    monkeypatch.setattr(
+        snapshot, "get_version", lambda db, project_id: versions["current"]
+    )
+    monkeypatch.setattr(
+        snapshot, "stream_plot_rows", lambda *model_ids, with_dataset: iter(ROWS)
+    )
+    monkeypatch.setattr(snapshot, "SessionLocal", FakeSession)
+    return versions
+
+
+def test_snapshot_round_trip(project):
+    directory = snapshot.write_plot_snapshot(FakeSession(), 1)
+    assert os.path.basename(directory) == "5_6_1"
+    opened = snapshot.PlotSnapshotCache().get(1)
+    assert opened.version == 1 and len(opened) == len(ROWS)
+    assert list(opened.rows(range(len(ROWS)))) == ROWS
+    indexes, cursor = opened.page(0, 4, None)
+    assert indexes.tolist() == [0, 1, 2, 3] and cursor == 3
+    assert opened.page(0, 4, cursor)[0].tolist() == [4, 5, 6, 7]
+
+
+def test_get_does_not_create_directories(tmp_path, project):
+    assert snapshot.PlotSnapshotCache().get(2) is None
+    assert not os.path.exists(tmp_path / "projects")
+
+
+def test_manifest_is_read_when_it_changes(project, monkeypatch):
+    cache = snapshot.PlotSnapshotCache()
+    snapshot.write_plot_snapshot(FakeSession(), 1)
+    first = cache.get(1)
+    loads = []
+    load = snapshot.json.load
+    monkeypatch.setattr(
+        snapshot.json, "load", lambda file: loads.append(file) or load(file)
+    )
+    assert cache.get(1) is first
+    assert loads == []
+
+    project["current"] = 2
+    snapshot.write_plot_snapshot(FakeSession(), 1)
+    second = cache.get(1)
+    assert second.version == 2
+    # latest.json and the meta.json of the new snapshot
+    assert len(loads) == 2
+    assert sorted(os.listdir(snapshot.snapshot_root(1))) == ["5_6_2", "latest.json"]
+
+
+def test_outdated_snapshots_are_not_served_and_rewritten(project):
+    cache = snapshot.PlotSnapshotCache()
+    snapshot.write_plot_snapshot(FakeSession(), 1)
+    assert cache.get_current(FakeSession(), 1).version == 1
+
+    project["current"] = 3
+    assert cache.get_current(FakeSession(), 1) is None
+    deadline = time.monotonic() + 10
+    while cache._rewrites:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert cache.get_current(FakeSession(), 1).version == 3